@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Startup benchmark of the command line interface
+
+Times simple sub-commands of sdmrun.py, which are called many times by workflow engines, and
+checks that they do not import heavy modules such as numpy and scipy. The median wall time of
+each command must be within the given budget, e.g.
+
+    python benchmarks/startup.py --repeat 20 --budget 0.1
+
+With Python 3.7+, --importtime also shows the breakdown of python -X importtime of each command.
+
+y.wang@bom.gov.au
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+SDMRUN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sdmrun.py')
+
+HEAVY_MODULES = ['numpy', 'scipy']
+
+# Run sdmrun.py as __main__ and report the heavy modules imported by the time it exits
+_RUNNER = '''
+import sys, atexit, runpy
+heavy = %r
+def report():
+    sys.stderr.write('HEAVY_MODULES %%s\\n' %% ' '.join(m for m in heavy if m in sys.modules))
+atexit.register(report)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+''' % HEAVY_MODULES
+
+
+def get_commands(config_file):
+    return {
+        'version': ['-V'],
+        'cod-getpath': ['-c', config_file, 'cod-getpath', '-m', 'ACCESS1.0', '-c', 'historical',
+                        '-r', 'tas', '-s', '2', '-p', 'rain'],
+    }
+
+
+def time_command(args, repeat):
+    """
+    :return: Wall times in seconds of running sdmrun.py with the given arguments
+    :rtype: list
+    """
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, SDMRUN] + args, stdout=devnull, stderr=devnull)
+            timings.append(time.time() - start)
+
+    return timings
+
+
+def get_heavy_modules(args):
+    """
+    :return: Names of the heavy modules imported by running sdmrun.py with the given arguments
+    :rtype: list
+    """
+    proc = subprocess.Popen([sys.executable, '-c', _RUNNER, SDMRUN] + args,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    for line in err.decode().splitlines():
+        if line.startswith('HEAVY_MODULES'):
+            return line.split()[1:]
+
+    raise RuntimeError('Failed to run sdmrun.py {}: {}'.format(' '.join(args), err))
+
+
+def print_importtime(args):
+    subprocess.call([sys.executable, '-X', 'importtime', SDMRUN] + args)
+
+
+def main(args):
+    ap = argparse.ArgumentParser(description='Startup benchmark of sdmrun.py')
+    ap.add_argument('--repeat', type=int, default=10,
+                    help='number of runs of each command')
+    ap.add_argument('--budget', type=float, default=0.1,
+                    help='maximum median wall time in seconds of each command')
+    ap.add_argument('--output',
+                    help='JSON file to save the results to')
+    ap.add_argument('--importtime', action='store_true', default=False,
+                    help='show the import time breakdown of each command (Python 3.7+)')
+    ns = ap.parse_args(args)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        config_file = os.path.join(tmp_dir, 'sdm.cfg')
+        with open(config_file, 'w') as f:
+            f.write('[dxt]\ncod_base_dir = {}\n'.format(tmp_dir))
+
+        results = {}
+        for name, command in sorted(get_commands(config_file).items()):
+            timings = sorted(time_command(command, ns.repeat))
+            results[name] = {
+                'median': timings[len(timings) // 2],
+                'min': timings[0],
+                'max': timings[-1],
+                'heavy_modules': get_heavy_modules(command),
+            }
+            if ns.importtime:
+                print_importtime(command)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    failed = False
+    for name, result in sorted(results.items()):
+        ok = result['median'] <= ns.budget and not result['heavy_modules']
+        failed = failed or not ok
+        print('{:<12} median {:.3f}s  min {:.3f}s  max {:.3f}s  heavy modules: {}  {}'.format(
+            name, result['median'], result['min'], result['max'],
+            ', '.join(result['heavy_modules']) or '-', 'OK' if ok else 'FAILED'))
+
+    if ns.output:
+        with open(ns.output, 'w') as f:
+            json.dump({'budget': ns.budget, 'results': results}, f, indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the extraction pipeline on synthetic data
+
+Synthetic AWAP monthly files are generated on the real 0.05 degree grid of AwapDailyDataReader,
+along with region masks from tas-sized to nmr-sized and CoD files of realistic length. Each case
+is then run in a fresh process, which reports its wall time and peak memory, e.g.
+
+    python benchmarks/synthetic.py --work-dir /tmp/sdm-bench --output results.json
+
+The data are generated only once per work directory, so later runs, e.g. of another version of
+the code, are timed on the same data and their results files can be compared offline.
+
+y.wang@bom.gov.au
+"""
+import os
+import sys
+import json
+import time
+import calendar
+import argparse
+import datetime
+import platform
+import resource
+import subprocess
+
+import numpy as np
+from scipy.io import netcdf
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'fast_extract'))
+
+from sdm import __version__
+from sdm.gridded import AwapDailyDataReader, MISSING_VALUE
+from sdm.parameters import MainParameters
+
+MODEL = 'SYNTHETIC'
+SCENARIO = 'rcp85'
+SEASON = '1'
+
+# Name and (lat_min, lat_max, lon_min, lon_max) of the ellipse of each region, from the size of
+# the tas region to the size of the nmr region
+REGIONS = [
+    ('tas', (-43.6, -39.6, 144.6, 148.4)),
+    ('sea', (-39.0, -33.0, 140.0, 150.0)),
+    ('nmr', (-20.0, -10.5, 120.0, 150.0)),
+]
+
+CASES = ['extract_2d', 'extract_cube', 'save_nc', 'to_3d', 'point_timeseries', 'point_histogram']
+
+# Point queries are made at the centre of the first region
+POINT = (-41.6, 146.5)
+
+
+def get_months(years):
+    return [(year, month) for year in range(1980, 1980 + years) for month in range(1, 13)]
+
+
+def generate(work_dir, years, n_dates, predictand, seed=0):
+    """
+    Generate the AWAP monthly files, masks and CoD files of the benchmarks, unless they exist.
+    """
+    rng = np.random.RandomState(seed)
+    awap_reader = AwapDailyDataReader(base_dir=os.path.join(work_dir, 'awap'))
+    lat, lon = awap_reader.lat, awap_reader.lon
+    var_code, _ = AwapDailyDataReader.get_codes(predictand)
+    months = get_months(years)
+
+    # AWAP monthly files with missing values over the ocean of the north-west corner
+    for year, month in months:
+        file_path = awap_reader.get_file_path(predictand, year, month)
+        if os.path.exists(file_path):
+            continue
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        print('generating {}'.format(file_path))
+
+        n_days = calendar.monthrange(year, month)[1]
+        f = netcdf.netcdf_file(file_path + '.tmp', 'w')
+        try:
+            f.createDimension('time', None)
+            f.createDimension('lat', lat.size)
+            f.createDimension('lon', lon.size)
+            var_time = f.createVariable('time', np.float64, ('time',))
+            var_time[:] = np.arange(n_days)
+            var_time.units = 'days since {:04d}-{:02d}-01'.format(year, month)
+            var_lat = f.createVariable('lat', np.float64, ('lat',))
+            var_lat[:] = lat
+            var_lon = f.createVariable('lon', np.float64, ('lon',))
+            var_lon[:] = lon
+            var_data = f.createVariable(var_code, np.float32, ('time', 'lat', 'lon'))
+            data = rng.rand(n_days, lat.size, lon.size).astype(np.float32)
+            data *= 30.0
+            data += 270.0
+            data[:, -100:, :200] = MISSING_VALUE
+            var_data[:] = data
+            var_data.missing_value = np.float32(MISSING_VALUE)
+        finally:
+            f.close()
+        os.rename(file_path + '.tmp', file_path)
+
+    mask_dir = os.path.join(work_dir, 'masks')
+    if not os.path.isdir(mask_dir):
+        os.makedirs(mask_dir)
+    for region, (lat_min, lat_max, lon_min, lon_max) in REGIONS:
+        file_path = os.path.join(mask_dir, 'mask_{}.nc'.format(region))
+        if os.path.exists(file_path):
+            continue
+
+        lat_2d, lon_2d = np.meshgrid(lat, lon, indexing='ij')
+        mask = ((lat_2d - (lat_min + lat_max) / 2) / ((lat_max - lat_min) / 2)) ** 2 + \
+               ((lon_2d - (lon_min + lon_max) / 2) / ((lon_max - lon_min) / 2)) ** 2 <= 1
+        f = netcdf.netcdf_file(file_path, 'w')
+        try:
+            f.createDimension('lat', lat.size)
+            f.createDimension('lon', lon.size)
+            var_lat = f.createVariable('lat', np.float64, ('lat',))
+            var_lat[:] = lat
+            var_lon = f.createVariable('lon', np.float64, ('lon',))
+            var_lon[:] = lon
+            var_mask = f.createVariable('mask', np.int8, ('lat', 'lon'))
+            var_mask[:] = mask.astype(np.int8)
+        finally:
+            f.close()
+
+    # One CoD file per region, reconstructing consecutive days from 2006 with random analog days
+    for region, _ in REGIONS:
+        main_parameters = MainParameters(MODEL, SCENARIO, region, SEASON, predictand)
+        file_path = os.path.join(work_dir, 'cod', main_parameters.get_cod_file())
+        if os.path.exists(file_path):
+            continue
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+
+        rdates = np.datetime64('2006-01-01') + np.arange(n_dates).astype('timedelta64[D]')
+        adates = []
+        for i in range(n_dates):
+            year, month = months[rng.randint(len(months))]
+            adates.append(datetime.date(year, month, rng.randint(1, calendar.monthrange(year, month)[1] + 1)))
+        with open(file_path, 'w') as f:
+            f.write('{} {} {}\n'.format(MODEL, SCENARIO, SEASON))
+            for rdate, adate in zip(rdates.tolist(), adates):
+                f.write('{} {} {:.4f}\n'.format(int(rdate.strftime('%Y%m%d')) - 19000000,
+                                                int(adate.strftime('%Y%m%d')) - 19000000,
+                                                rng.rand()))
+
+
+def run_case(work_dir, case, region, predictand):
+    """
+    Run one case in this process.
+    :return: Wall time in seconds of the timed part of the case
+    :rtype: float
+    """
+    from sdm.extractor import GriddedExtractor
+    from sdm.gridded import Data3D, convert_to_3d_nc
+    from sdm_extract import read_timeseries, build_output
+    from cod_file import CodFile
+
+    gridded_extractor = GriddedExtractor(cod_base_dir=os.path.join(work_dir, 'cod'),
+                                         mask_base_dir=os.path.join(work_dir, 'masks'),
+                                         gridded_base_dir=os.path.join(work_dir, 'awap'))
+    main_parameters = MainParameters(MODEL, SCENARIO, region, SEASON, predictand)
+    out_dir = os.path.join(work_dir, 'out')
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    if case == 'extract_2d':
+        start = time.time()
+        gridded_extractor.extract(main_parameters, cube=False)
+
+    elif case == 'extract_cube':
+        start = time.time()
+        gridded_extractor.extract(main_parameters, cube=True)
+
+    elif case == 'prepare_save_nc':
+        # The cube saved by the save_nc case, which is extracted in its own process so that the
+        # memory of the extraction is not counted in the save_nc case
+        data = gridded_extractor.extract(main_parameters, cube=True)
+        start = time.time()
+        np.save(os.path.join(out_dir, 'save_nc_{}.npy'.format(region)), data.data)
+        np.save(os.path.join(out_dir, 'save_nc_{}.dates.npy'.format(region)), data.dates)
+
+    elif case == 'save_nc':
+        cropped_mask = gridded_extractor.mask_reader.read(region).crop()
+        # The cube is memory-mapped, so only the pages read by the save are counted
+        data = Data3D(np.load(os.path.join(out_dir, 'save_nc_{}.npy'.format(region)), mmap_mode='r'),
+                      np.load(os.path.join(out_dir, 'save_nc_{}.dates.npy'.format(region))),
+                      cropped_mask.lat, cropped_mask.lon)
+        start = time.time()
+        data.save_nc(os.path.join(out_dir, 'save_nc_{}.nc'.format(region)), main_parameters=main_parameters)
+
+    elif case == 'prepare_to_3d':
+        # The 2D file converted by the to_3d case, which is written in its own process so that
+        # the memory of the extraction is not counted in the to_3d case
+        data2d_file = os.path.join(out_dir, main_parameters.get_ds_file())
+        if not os.path.isdir(os.path.dirname(data2d_file)):
+            os.makedirs(os.path.dirname(data2d_file))
+        start = time.time()
+        gridded_extractor.extract(main_parameters, cube=False).save_nc(data2d_file, main_parameters=main_parameters)
+
+    elif case == 'to_3d':
+        data2d_file = os.path.join(out_dir, main_parameters.get_ds_file())
+        mask = gridded_extractor.mask_reader.read(region)
+        start = time.time()
+        convert_to_3d_nc(data2d_file, os.path.join(out_dir, 'to_3d_{}.nc'.format(region)), mask, main_parameters)
+
+    elif case in ('point_timeseries', 'point_histogram'):
+        cod_file = gridded_extractor.cod_manager.get_cod_file_path(main_parameters)
+        start = time.time()
+        cod = CodFile(cod_file)
+        timeseries = read_timeseries(os.path.join(work_dir, 'awap'), None, predictand,
+                                     POINT[0], POINT[1], cod.analog_dates)
+        build_output(cod.base_dates, timeseries, predictand, case.split('_')[1], 10)
+
+    else:
+        raise ValueError('Unknown case: {}'.format(case))
+
+    return time.time() - start
+
+
+def measure_case(work_dir, case, region, predictand):
+    """
+    Run one case in a fresh process.
+    :return: The wall time and peak memory of the case
+    :rtype: dict
+    """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--work-dir', work_dir,
+                             '--predictand', predictand, '--run-case', case, region],
+                            stdout=subprocess.PIPE)
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError('Case {} of {} failed'.format(case, region))
+
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def get_peak_rss():
+    """
+    :return: Peak resident set size in bytes of this process
+    :rtype: int
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=open(os.devnull, 'w')).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    ap = argparse.ArgumentParser(description='Benchmarks of the extraction pipeline on synthetic data')
+    ap.add_argument('--work-dir', required=True,
+                    help='directory of the synthetic data and outputs')
+    ap.add_argument('--output',
+                    help='JSON file to save the results to')
+    ap.add_argument('--years', type=int, default=1,
+                    help='number of years of the synthetic AWAP monthly files')
+    ap.add_argument('--dates', type=int, default=3650,
+                    help='number of dates of the synthetic CoD files')
+    ap.add_argument('--predictand', default='tmax',
+                    help='predictand of the synthetic data')
+    ap.add_argument('--regions', default=','.join(region for region, _ in REGIONS),
+                    help='comma separated regions to benchmark')
+    ap.add_argument('--cases', default=','.join(CASES),
+                    help='comma separated cases to benchmark')
+    ap.add_argument('--run-case', nargs=2, metavar=('CASE', 'REGION'),
+                    help=argparse.SUPPRESS)
+    ns = ap.parse_args(args)
+
+    if ns.run_case:
+        baseline_rss = get_peak_rss()
+        seconds = run_case(ns.work_dir, ns.run_case[0], ns.run_case[1], ns.predictand)
+        print(json.dumps({'seconds': seconds,
+                          'peak_rss_bytes': get_peak_rss(),
+                          'rss_increase_bytes': get_peak_rss() - baseline_rss}))
+        return 0
+
+    generate(ns.work_dir, ns.years, ns.dates, ns.predictand)
+
+    results = []
+    for region in ns.regions.split(','):
+        for case in ns.cases.split(','):
+            if case in ('save_nc', 'to_3d'):
+                measure_case(ns.work_dir, 'prepare_' + case, region, ns.predictand)
+            result = measure_case(ns.work_dir, case, region, ns.predictand)
+            result.update({'case': case, 'region': region})
+            results.append(result)
+            print('{:<18} {:<5} {:8.3f}s  peak {:8.1f}M  increase {:8.1f}M'.format(
+                case, region, result['seconds'], result['peak_rss_bytes'] / 1024.0 ** 2,
+                result['rss_increase_bytes'] / 1024.0 ** 2))
+
+    if ns.output:
+        with open(ns.output, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'revision': get_revision(),
+                'timestamp': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'parameters': {'years': ns.years, 'dates': ns.dates, 'predictand': ns.predictand},
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,13 +4,20 @@ import datetime as dt
 
 import numpy as np
 
+try:
+    from sdm.cod import CoD
+except ImportError:
+    # The sdm package is not importable, e.g. in a plain checkout, so parse the file here
+    CoD = None
+
 
 class CodFile(object):
     """ Class that allows access to a change-of-date file dates."""
     
-    def __init__(self, filename):
+    def __init__(self, filename, cache_dir=None):
         
         self.filename = filename
+        self.cache_dir = cache_dir
         self._raw_data = None
 
     def __repr__(self):
@@ -22,8 +29,7 @@ class CodFile(object):
         if self._raw_data is None:
             self.read_data()
 
-        return [self.convert_date(datestring)
-                for datestring in self._raw_data[0]]
+        return self.convert_dates(self._raw_data[0])
 
     @property
     def projected_dates(self):
@@ -31,20 +37,44 @@ class CodFile(object):
         if self._raw_data is None:
             self.read_data()
 
-        return [self.convert_date(datestring)
-                for datestring in self._raw_data[1]]
+        return self.convert_dates(self._raw_data[1])
+
+    @property
+    def analog_dates(self):
+        """ The projected dates as integer CoD dates ([Y]YYMMDD), as used to read the AWAP data. """
+        if self._raw_data is None:
+            self.read_data()
+
+        return self._raw_data[1]
 
     def read_data(self):
         """ Read in the raw data from the COD file."""
 
-        with open(self.filename, "r") as open_codfile:
-            # Throw away the first line.
-            open_codfile.readline()
-            
-            raw_vals = [tuple(line.split())
-                        for line in open_codfile]
+        if CoD is None:
+            with open(self.filename, "r") as open_codfile:
+                # Throw away the first line.
+                open_codfile.readline()
+
+                # Only the first three columns are read, as by CoD.read_from_file.
+                fields = [line.split()[:3] for line in open_codfile if line.strip()]
+                if any(len(line_fields) != 3 for line_fields in fields):
+                    raise ValueError("Invalid CoD file {}: line of fewer than 3 columns".format(self.filename))
+                raw_vals = np.array(fields, dtype=float).reshape((-1, 3))
+
+            self._raw_data = (raw_vals[:, 0].astype(int), raw_vals[:, 1].astype(int), raw_vals[:, 2])
+            return
+
+        cod_dates = CoD.read_from_file(self.filename, self.cache_dir)
+
+        self._raw_data = (cod_dates['rdates'], cod_dates['adates'], cod_dates['edists'])
+
+    def convert_dates(self, dates):
+        """ Convert an array of integer dates to a list of python datetime objects. """
+
+        if CoD is None:
+            return [self.convert_date(str(date)) for date in dates]
 
-        self._raw_data = np.array(zip(*raw_vals))
+        return CoD.to_datetime64(dates).astype('datetime64[us]').tolist()
 
     def convert_date(self, datestring):
         """ Convert the string date to a python date object. """
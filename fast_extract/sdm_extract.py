@@ -5,12 +5,20 @@ It dumps straight to JSON format, and doesn't write out a netCDF file.
 
 """
 
+import os
+import sys
 import json
 import argparse
-import string
 
 import numpy as np
-import netCDF4 as nc4
+
+try:
+    import sdm
+except ImportError:
+    # Run from a plain checkout without the sdm package installed
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sdm.gridded import AwapDailyDataReader
 
 from cod_file import CodFile
 
@@ -27,53 +35,63 @@ def main(args):
 
     """
 
+    # Load in the CoD file, which is parsed once for both its analog and base dates.
+    cod = CodFile(args.cod_file)
+
+    # Extract the required values from the AWAP monthly files or the time-major store.
+    outts = read_timeseries(args.awap_dir, args.store_dir, args.variable,
+                            args.latitude, args.longitude, cod.analog_dates)
+
+    output = build_output(cod.base_dates, outts, args.variable, args.output_type, args.bins)
+
+    with open(args.outfile, 'w') as output_file:
+        output_file.write(json.dumps(output))
+
+def build_output(base_dates, timeseries, variable, output_type, bins):
+    """ Build the output dictionary of the given output type from a projected time series. """
+
     var_dict = {"rain": ("rr_calib", "rr", "rain"),
                 "tmin": ("tmin", "tmin", "tmin"),
                 "tmax": ("tmax", "tmax", "tmax")}
 
-    this_var = var_dict[args.variable]
+    this_var = var_dict[variable]
 
-    # Extract the required values from the cod file.
-    var_dict = dict(var_name=this_var[0])
-    awap_pattern = string.Template("/local/ep1_1/data/staging_data/AWAP/daily_0.05/${var_name}/${var_name}_daily_0.05*.nc").substitute(var_dict)
-    input_awap = nc4.MFDataset(awap_pattern, aggdim="time")
-    in_var = input_awap.variables[this_var[1]]
+    # Filter bad values from the time series.
+    out_dates, out_values, num_missing = filter_timeseries(base_dates, timeseries, this_var[1])
 
-    lat_var = input_awap.variables["lat"]
-    lon_var = input_awap.variables["lon"]
+    if output_type == "timeseries":
+        output = write_timeseries(out_dates, this_var[2], out_values, num_missing)
+    elif output_type == "histogram":
+        output = write_histogram(out_dates, this_var[2], out_values, int(bins), num_missing)
+    else:
+        raise ValueError("output_type: {} not understood"
+                        .format(output_type))
 
-    # Grab the time series of interest.
-    y_val = get_index(args.latitude, lat_var)
-    x_val = get_index(args.longitude, lon_var)
-    base_ts = in_var[:, y_val, x_val]
+    return output
 
-    # Ensure the base timeseries is a masked array.
-    base_ts = np.ma.masked_array(base_ts)
 
-    # Load in the CoD file.
-    cod = CodFile(args.cod_file)
+def read_timeseries(awap_dir, store_dir, variable, latitude, longitude, adates):
+    """ Read the projected time series of a point from the analog dates of a CoD file.
 
-    times = input_awap.variables["time"]
-    indices = calculate_time_index(cod.projected_dates, times)
+    Only the monthly AWAP files that the analog dates fall in are opened, and
+    only the needed days of the pixel are read from each.
 
-    input_awap.close()
+    If store_dir is given, the time-major store built with
+    "sdmrun.py awap-pack --time-major" is read instead, which holds the whole
+    daily history of each pixel contiguously.
 
-    # Now pull out the required values.
-    outts = base_ts[indices]
+    """
 
-    # Filter bad values from the time series.
-    out_dates, out_values, num_missing = filter_timeseries(cod.base_dates, outts, this_var[1])
+    awap_reader = AwapDailyDataReader(base_dir=awap_dir, packed_base_dir=store_dir)
+    if store_dir and awap_reader.get_time_major_store(variable) is None:
+        raise Exception("No time-major store of {} in {}"
+                        .format(variable, store_dir))
 
-    if args.output_type == "timeseries":
-        output = write_timeseries(out_dates, this_var[2], out_values, num_missing)
-    elif args.output_type == "histogram":
-        output = write_histogram(out_dates, this_var[2], out_values, int(args.bins), num_missing)
-    else:
-        raise Exception("output_type: {} not understood"
-                        .format(args.output_type))
+    timeseries = awap_reader.read_point(variable, latitude, longitude, adates)
+
+    # Missing values are NaN.
+    return np.ma.masked_invalid(timeseries)
 
-    with open(args.outfile, 'w') as output_file:
-        output_file.write(json.dumps(output))
 
 def filter_timeseries(date_list, timeseries, var_name):
     """ Filter out invalid values in the timeseries."""
@@ -115,6 +133,11 @@ def write_histogram(date_list, variable_name,
                     timeseries, bins, missing_vals):
     """ Create an output dictionary in timeseries form. """
 
+    # There are no time bounds of an empty time series.
+    if len(timeseries) == 0:
+        raise ValueError("No valid values to build a histogram of, {} values filtered out"
+                         .format(int(missing_vals)))
+
     # Use the numpy histogram calculator.
     counts, bins = np.histogram(timeseries, bins=bins)
 
@@ -135,38 +158,6 @@ def write_histogram(date_list, variable_name,
     return output
 
 
-def get_index(value, nc_var):
-    """ Given a netCDF variable, get the index of a particular lat/lon point.
-
-    Rounds to the nearest value.
-
-    """
-
-    n_steps = nc_var.shape[0] - 1
-    var_range = nc_var[-1] - nc_var[0]
-    step_size = var_range / n_steps
-
-    change = float(value) - nc_var[0]
-    index = int(round(change / step_size))
-
-    return index
-
-
-def calculate_time_index(datething, nc_time):
-    """ Given a python datetime object, return the index of the matching time variable."""
-
-    num_steps = nc_time.shape[0] - 1
-    time_range = nc_time[-1] - nc_time[0]
-    each_step = time_range / num_steps
-    step = int(round(each_step))
-
-    axis_numbers = nc4.date2num(datething, nc_time.units, nc_time.calendar)
-
-    return_vals = (axis_numbers - nc_time[0]) / step
-
-    return(return_vals.astype(int))
-
-
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -178,7 +169,12 @@ if __name__ == "__main__":
     parser.add_argument("bins", help="The number of bins for the output histogram")
     parser.add_argument("cod_file", help="The path to the change-of-date file")
     parser.add_argument("outfile", help="The path to write the output to")
+    parser.add_argument("--awap-dir", help="The base directory of the AWAP daily_0.05 monthly files")
+    parser.add_argument("--store-dir", help="The directory of the time-major AWAP stores, "
+                                            "read instead of the AWAP netCDF files if given")
 
     args = parser.parse_args()
+    if not args.awap_dir and not args.store_dir:
+        parser.error("one of --awap-dir and --store-dir is required")
 
     main(args)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+""" Batch version of sdm_extract.py for many time series or histogram queries.
+
+Jobs are read from a JSON file (a list of objects), a CSV file (with a header
+line) or stdin, each with the fields latitude, longitude, variable, cod_file
+and output_type, and optionally bins (default to 10) and id (default to the
+position of the job in the batch). Jobs of the same variable are read
+together, so each AWAP month is read only once per batch.
+
+One JSON result is written per line for each job, in the order of the jobs,
+with the id of the job and either the output of sdm_extract.py or an error.
+
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+
+import numpy as np
+
+try:
+    import sdm
+except ImportError:
+    # Run from a plain checkout without the sdm package installed
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sdm.gridded import AwapDailyDataReader
+
+from cod_file import CodFile
+from sdm_extract import build_output
+
+
+def main(args):
+    """ Run a batch of jobs. """
+
+    if args.jobs_file == "-":
+        jobs = read_jobs(sys.stdin)
+    else:
+        with open(args.jobs_file) as ins:
+            jobs = read_jobs(ins)
+
+    results = run_jobs(jobs, args.awap_dir, args.store_dir, args.workers)
+
+    if args.outfile:
+        with open(args.outfile, 'w') as output_file:
+            write_results(output_file, results)
+    else:
+        write_results(sys.stdout, results)
+
+
+def read_jobs(ins):
+    """ Read jobs as dictionaries from a JSON list or CSV lines with a header. """
+
+    content = ins.read()
+    if content.lstrip().startswith("["):
+        jobs = json.loads(content)
+    else:
+        jobs = list(csv.DictReader(line for line in content.splitlines()
+                                   if line.strip() and not line.startswith("#")))
+
+    for i, job in enumerate(jobs):
+        job.setdefault("id", i)
+        job.setdefault("bins", 10)
+
+    return jobs
+
+
+def run_jobs(jobs, awap_dir, store_dir=None, workers=1):
+    """ Run the jobs grouped by variable.
+
+    The time series of all jobs of a variable are read in a single pass over
+    the AWAP months needed by their CoD files, or from the time-major store of
+    the variable if store_dir is given, in which case the jobs of a variable
+    without a store fail rather than falling back to the AWAP monthly files.
+
+    """
+
+    results = [None] * len(jobs)
+    cod_files = {}
+
+    for variable in sorted(set(job["variable"] for job in jobs)):
+        awap_reader = AwapDailyDataReader(base_dir=awap_dir, workers=workers,
+                                          packed_base_dir=store_dir)
+        if store_dir and awap_reader.get_time_major_store(variable) is None:
+            for i, job in enumerate(jobs):
+                if job["variable"] == variable:
+                    results[i] = {"id": job["id"],
+                                  "error": "No time-major store of {} in {}".format(variable, store_dir)}
+            continue
+
+        idx_jobs = []
+        adates_list = []
+        points = []
+        for i, job in enumerate(jobs):
+            if job["variable"] != variable:
+                continue
+            try:
+                if job["cod_file"] not in cod_files:
+                    cod_files[job["cod_file"]] = CodFile(job["cod_file"])
+                adates = cod_files[job["cod_file"]].analog_dates
+                point = awap_reader.get_point_index(job["latitude"], job["longitude"])
+            except Exception as e:
+                results[i] = {"id": job["id"], "error": str(e)}
+                continue
+            adates_list.append(adates)
+            points.append(point)
+            idx_jobs.append(i)
+
+        try:
+            timeseries_list = awap_reader.read_points(variable, adates_list, points)
+        except Exception as e:
+            for i in idx_jobs:
+                results[i] = {"id": jobs[i]["id"], "error": str(e)}
+            continue
+
+        for i, timeseries in zip(idx_jobs, timeseries_list):
+            job = jobs[i]
+            try:
+                output = build_output(cod_files[job["cod_file"]].base_dates,
+                                      np.ma.masked_invalid(timeseries),
+                                      variable, job["output_type"], job["bins"])
+                output["id"] = job["id"]
+                results[i] = output
+            except Exception as e:
+                results[i] = {"id": job["id"], "error": str(e)}
+
+    return results
+
+
+def write_results(output_file, results):
+    """ Write one JSON result per line. """
+
+    for result in results:
+        output_file.write(json.dumps(result))
+        output_file.write("\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("jobs_file", help="The JSON or CSV file of the jobs, or - to read from stdin")
+    parser.add_argument("--outfile", help="The path to write the results to, default to stdout")
+    parser.add_argument("--awap-dir", help="The base directory of the AWAP daily_0.05 monthly files")
+    parser.add_argument("--store-dir", help="The directory of the time-major AWAP stores, "
+                                            "read instead of the AWAP netCDF files if given")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="The number of AWAP monthly files read concurrently")
+
+    args = parser.parse_args()
+    if not args.awap_dir and not args.store_dir:
+        parser.error("one of --awap-dir and --store-dir is required")
+
+    main(args)
@@ -0,0 +1,122 @@
+"""
+In-process caches for decoded data
+
+y.wang@bom.gov.au
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A least-recently-used cache of numpy arrays bounded by their total size in bytes.
+
+    A new key that would evict others is admitted only if it has been requested more often than
+    every key it would evict. Otherwise a scan over more keys than fit, e.g. the months of a long
+    CoD read in sorted order, would evict each key just before it is requested again and never
+    hit, whereas this way the keys first cached keep hitting on every later scan.
+    """
+
+    # The request counts are halved after this many requests, so that keys no longer requested
+    # are eventually evicted
+    AGING_REQUESTS = 10000
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self._items = OrderedDict()
+        self._requests = {}
+        self._n_requests = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def _count_request(self, key):
+        self._requests[key] = self._requests.get(key, 0) + 1
+        self._n_requests += 1
+        if self._n_requests >= self.AGING_REQUESTS:
+            self._requests = dict((k, n // 2) for k, n in self._requests.items() if n > 1)
+            self._n_requests = 0
+
+    def get(self, key):
+        """
+        Get the cached array of the given key and mark it as the most recently used.
+        :return: The cached array or None if the key is not cached
+        """
+        with self._lock:
+            self._count_request(key)
+            value = self._items.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def _admits(self, key, nbytes):
+        if nbytes > self.max_bytes:
+            return False
+        n_requests = self._requests.get(key, 0)
+        freed = self.max_bytes - self.nbytes
+        for evicted_key, evicted in self._items.iteritems():
+            if freed >= nbytes:
+                break
+            if evicted_key != key and self._requests.get(evicted_key, 0) >= n_requests:
+                return False
+            freed += evicted.nbytes
+        return True
+
+    def admits(self, key, nbytes):
+        """
+        Whether an array of the given size would be cached by put, so that callers can avoid
+        computing a value that would not be cached.
+        """
+        with self._lock:
+            if not self._admits(key, nbytes):
+                self.rejections += 1
+                return False
+            return True
+
+    def put(self, key, value):
+        """
+        Cache the given array if it is admitted, evicting the least recently used ones if the
+        memory budget is exceeded. Arrays larger than the whole budget are never cached.
+        """
+        with self._lock:
+            if not self._admits(key, value.nbytes):
+                self.rejections += 1
+                return
+            old_value = self._items.pop(key, None)
+            if old_value is not None:
+                self.nbytes -= old_value.nbytes
+            while self._items and self.nbytes + value.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+            self._items[key] = value
+            self.nbytes += value.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def info(self):
+        """
+        :return: Counters of the cache
+        :rtype: dict
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'rejections': self.rejections,
+            'items': len(self._items),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,235 @@
+"""
+Directory of independently written chunks of a (time, lat, lon) output, which worker processes
+can write concurrently without any locking and which is consolidated into a NetCDF file of the
+same layout as Data3D.save_nc
+
+The directory holds a manifest.json of the variable, the main parameters and the chunk shape,
+a coords.npz of the dates, latitudes and longitudes, and one float32 .npy file per chunk with
+missing values as NaN. Every file is written to a temporary file and renamed into place, so a
+chunk file is either complete or absent.
+
+y.wang@bom.gov.au
+"""
+import os
+import json
+import logging
+import tempfile
+import itertools
+
+import numpy as np
+
+from .gridded import Data3D
+from .parameters import MainParameters
+
+DEFAULT_CHUNK_DATES = 365
+
+_MANIFEST = 'manifest.json'
+_COORDS = 'coords.npz'
+
+
+def _write_atomic(path, write):
+    """
+    Write a file via the given function of a file object to a temporary file in the same
+    directory and rename it into place.
+    """
+    fd, path_tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(path_tmp, path)
+    except Exception:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+        raise
+
+
+class ChunkedOutputStore(object):
+    """
+    Output store of a data cube split into chunks along time, latitude and longitude. Chunks
+    are keyed by their (time, lat, lon) chunk indices.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._manifest = None
+        self._coords = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, _MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def create(self, dates, lat, lon, varname='unknown', main_parameters=None, chunks=None):
+        """
+        Create the store, or check that an existing one is of the same dates, grid and chunks,
+        so that every worker can call it before writing its chunks.
+
+        :param dates: CoD dates ([Y]YYMMDD) of the time dimension
+        :param chunks: Chunk shape (dates, lat, lon), default to DEFAULT_CHUNK_DATES dates of
+            the whole grid
+        :type chunks: tuple
+        """
+        dates = np.asarray(dates)
+        chunks = list(chunks or (DEFAULT_CHUNK_DATES, lat.size, lon.size))
+        if len(chunks) != 3 or any(size < 1 for size in chunks):
+            raise ValueError('Invalid chunk shape: {}'.format(chunks))
+        manifest = {
+            'varname': varname,
+            'main_parameters': list(main_parameters) if main_parameters else None,
+            'shape': [dates.size, lat.size, lon.size],
+            'chunks': chunks,
+        }
+
+        if self.exists():
+            if self.manifest != manifest or not (np.array_equal(self.dates, dates) and
+                                                 np.array_equal(self.lat, lat) and
+                                                 np.array_equal(self.lon, lon)):
+                raise ValueError('Chunked output store {} exists with different contents'.format(self.directory))
+            return
+
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created by another worker meanwhile
+                if not os.path.isdir(self.directory):
+                    raise
+
+        # The manifest goes last as it marks the store as created
+        _write_atomic(os.path.join(self.directory, _COORDS), lambda f: np.savez(f, dates=dates, lat=lat, lon=lon))
+        _write_atomic(self.manifest_path, lambda f: json.dump(manifest, f, indent=2, sort_keys=True))
+        self._manifest = None
+        self._coords = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            with open(self.manifest_path) as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    def _get_coord(self, name):
+        if self._coords is None:
+            with np.load(os.path.join(self.directory, _COORDS)) as coords:
+                self._coords = dict((key, coords[key]) for key in coords.files)
+        return self._coords[name]
+
+    @property
+    def dates(self):
+        return self._get_coord('dates')
+
+    @property
+    def lat(self):
+        return self._get_coord('lat')
+
+    @property
+    def lon(self):
+        return self._get_coord('lon')
+
+    @property
+    def shape(self):
+        return tuple(self.manifest['shape'])
+
+    @property
+    def chunks(self):
+        return tuple(self.manifest['chunks'])
+
+    @property
+    def main_parameters(self):
+        params = self.manifest['main_parameters']
+        return MainParameters(*params) if params else None
+
+    def get_n_chunks(self):
+        """
+        :return: Number of chunks along each dimension
+        :rtype: tuple
+        """
+        return tuple(-(-n // size) for n, size in zip(self.shape, self.chunks))
+
+    def get_slices(self, key):
+        """
+        :return: Slices of the chunk of the given key within the whole cube
+        :rtype: tuple
+        """
+        return tuple(slice(i * size, min((i + 1) * size, n)) for i, size, n in zip(key, self.chunks, self.shape))
+
+    def keys(self):
+        return itertools.product(*[xrange(n) for n in self.get_n_chunks()])
+
+    def get_chunk_path(self, key):
+        return os.path.join(self.directory, 'chunk_{}_{}_{}.npy'.format(*key))
+
+    def missing_keys(self):
+        """
+        :return: Keys of the chunks not written yet
+        :rtype: list
+        """
+        return [key for key in self.keys() if not os.path.exists(self.get_chunk_path(key))]
+
+    def write_chunk(self, key, data):
+        """
+        Write a chunk of data, with NaN as missing values.
+        """
+        shape = tuple(s.stop - s.start for s in self.get_slices(key))
+        if data.shape != shape:
+            raise ValueError('Chunk {} must be of shape {}: {}'.format(key, shape, data.shape))
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        _write_atomic(self.get_chunk_path(key), lambda f: np.save(f, data))
+
+    def read_chunk(self, key):
+        return np.load(self.get_chunk_path(key))
+
+    def write(self, data, start=0):
+        """
+        Write the chunks of all grid points of a block of dates. The block must be aligned with
+        the time chunks, i.e. start at a chunk boundary and end at one or at the last date, so
+        that no two workers write the same chunk.
+
+        :param data: Data of the dates from start on
+        :type data: numpy.ndarray
+        :param start: Index of the first date of the block
+        :type start: int
+        """
+        n_dates, n_lat, n_lon = self.shape
+        chunk_dates, chunk_lat, chunk_lon = self.chunks
+        end = start + data.shape[0]
+        if data.shape[1:] != (n_lat, n_lon):
+            raise ValueError('Data of shape {} do not cover the grid of {}'.format(data.shape, self.directory))
+        if start % chunk_dates != 0 or not (end % chunk_dates == 0 or end == n_dates) or end > n_dates:
+            raise ValueError('Dates {} to {} are not aligned with chunks of {} dates'.format(start, end, chunk_dates))
+
+        for key in itertools.product(xrange(start // chunk_dates, -(-end // chunk_dates)),
+                                     xrange(-(-n_lat // chunk_lat)),
+                                     xrange(-(-n_lon // chunk_lon))):
+            slice_dates, slice_lat, slice_lon = self.get_slices(key)
+            self.write_chunk(key, data[slice_dates.start - start:slice_dates.stop - start, slice_lat, slice_lon])
+
+    def consolidate(self, filename, output_format=None):
+        """
+        Save all chunks to a NetCDF file identical to that of Data3D.save_nc, one row of time
+        chunks at a time.
+
+        :param output_format: Format of the file, default to NetCDF classic
+        :type output_format: ncformat.OutputFormat
+        """
+        missing_keys = self.missing_keys()
+        if missing_keys:
+            raise ValueError('{} chunks of {} are not written yet, e.g. {}'.format(len(missing_keys), self.directory,
+                                                                                 missing_keys[:5]))
+
+        n_chunks = self.get_n_chunks()
+        for i in xrange(n_chunks[0]):
+            slice_dates = self.get_slices((i, 0, 0))[0]
+            data = np.empty((slice_dates.stop - slice_dates.start,) + self.shape[1:], dtype=np.float32)
+            for key in itertools.product([i], xrange(n_chunks[1]), xrange(n_chunks[2])):
+                _, slice_lat, slice_lon = self.get_slices(key)
+                data[:, slice_lat, slice_lon] = self.read_chunk(key)
+
+            logging.debug('consolidating dates {} to {}'.format(slice_dates.start, slice_dates.stop))
+            data3d = Data3D(data, self.dates[slice_dates], self.lat, self.lon)
+            if i == 0:
+                data3d.save_nc(filename, self.manifest['varname'], self.main_parameters, output_format)
+            else:
+                data3d.append_nc(filename)
@@ -4,17 +4,37 @@ Helper program that manages CoD files
 y.wang@bom.gov.au
 """
 import os
-from datetime import datetime
+import hashlib
+import logging
+import threading
 
 import numpy as np
 
+from . import profiling
 from .parameters import MainParameters
 
+# Whether each byte is whitespace, as str.split sees it
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[np.frombuffer(' \t\r\n\v\f', dtype=np.uint8)] = True
+
 
 class CoD(object):
-    def __init__(self, base_dir=None, verbose=False):
+    def __init__(self, base_dir=None, verbose=False, cache_dir=None, memoize=False):
+        """
+
+        :param cache_dir: Directory where parsed CoD files are cached, default to no caching
+        :type cache_dir: str
+        :param memoize: Whether to keep parsed CoD files in memory for later reads, e.g. in a
+            long-running process. A kept CoD file is used as long as its modification time and
+            size are unchanged.
+        :type memoize: bool
+        """
         self.base_dir = base_dir or os.getcwd()
         self.verbose = verbose
+        self.cache_dir = cache_dir
+        self.memoize = memoize
+        self._parsed = {}
+        self._lock = threading.Lock()
 
     @staticmethod
     def calc_dates(cod_dates):
@@ -35,6 +55,59 @@ class CoD(object):
             'yyyymm': yyyymms,
         }
 
+    @staticmethod
+    def to_datetime64(cod_dates):
+        """
+        Convert the given CoD dates ([Y]YYMMDD integers) to dates with pure array arithmetic.
+        :param cod_dates:
+        :type cod_dates: numpy.ndarray
+        :return:
+        :rtype: numpy.ndarray of datetime64[D]
+        """
+        date_components = CoD.calc_dates(np.asarray(cod_dates))
+        months = (date_components['yyyy'] - 1970) * 12 + date_components['mm'] - 1
+
+        return months.astype('datetime64[M]').astype('datetime64[D]') + \
+            (date_components['dd'] - 1).astype('timedelta64[D]')
+
+    @staticmethod
+    def to_days_since(cod_dates, epoch='1899-12-31'):
+        """
+        Convert the given CoD dates to number of days since the given epoch date.
+        :param cod_dates:
+        :type cod_dates: numpy.ndarray
+        :param epoch:
+        :type epoch: str
+        :return:
+        :rtype: numpy.ndarray of int
+        """
+        return (CoD.to_datetime64(cod_dates) - np.datetime64(epoch, 'D')).astype(int)
+
+    @staticmethod
+    def select(cod_dates, start=None, end=None, months=None):
+        """
+        Select the CoD entries whose reconstructed dates (rdates) fall in the given window.
+
+        :param cod_dates: CoD entries as returned by read
+        :type cod_dates: dict
+        :param start: First date of the window, e.g. '2081-01-01'
+        :param end: Last date of the window (inclusive), e.g. '2100-12-31'
+        :param months: Months of year (1 to 12) to select, default to all
+        :type months: list
+        :return: The selected entries in the same form of cod_dates
+        :rtype: dict
+        """
+        dates = CoD.to_datetime64(cod_dates['rdates'])
+        selected = np.ones(dates.size, dtype=bool)
+        if start is not None:
+            selected &= dates >= np.datetime64(start, 'D')
+        if end is not None:
+            selected &= dates <= np.datetime64(end, 'D')
+        if months:
+            selected &= np.in1d(CoD.calc_dates(cod_dates['rdates'])['mm'], months)
+
+        return dict((key, value[selected]) for key, value in cod_dates.items())
+
     @staticmethod
     def format_dates(cod_dates, format_str='%Y-%m-%d'):
         """
@@ -46,9 +119,11 @@ class CoD(object):
         :return:
         :rtype:
         """
-        dates = [datetime.strptime(str(d), '%Y%m%d').date().strftime(format_str)
-                 for d in cod_dates + 19000000]
-        return np.array(dates)
+        dates = CoD.to_datetime64(cod_dates)
+        if format_str == '%Y-%m-%d':
+            return dates.astype(str)
+        else:
+            return np.array([d.strftime(format_str) for d in dates.tolist()])
 
     @staticmethod
     def get_main_parameters_by_path(cod_file_path):
@@ -88,33 +163,146 @@ class CoD(object):
         :return:
         :rtype:
         """
-        cod_file_path = os.path.join(self.base_dir, main_parameters.get_dirout(),
-                                     'rawfield_analog_%s' % main_parameters.season)
+        cod_file_path = os.path.join(self.base_dir, main_parameters.get_cod_file())
         return cod_file_path
 
     @staticmethod
-    def read_from_file(cod_file_path):
-        """ Read from the given CoD file path
+    def _parse(content, cod_file_path):
         """
-        with open(cod_file_path) as ins:
-            _, _, season = ins.readline().split()
-            rdates = []
-            adates = []
-            edists = []
-            for line in ins.readlines():
-                if line.strip() != '':
-                    fields = line.split()
-                    rdates.append(fields[0])
-                    adates.append(fields[1])
-                    edists.append(fields[2])
+        Parse the lines of rdate, adate and edist of a CoD file, i.e. the lines after the header.
+        Only the first three columns are read, and a line of fewer columns or a value that is not
+        a number is an error.
+        """
+        # Number of columns of each non-empty line, from the starts of the whitespace separated
+        # values and the line each of them is in
+        chars = np.frombuffer(content, dtype=np.uint8)
+        is_space = _IS_SPACE[chars]
+        is_start = ~is_space & np.concatenate(([True], is_space[:-1]))
+        n_columns = np.bincount(np.cumsum(chars == ord('\n'))[is_start])
+        idx_lines = np.nonzero(n_columns)[0]
+        n_columns = n_columns[idx_lines]
+
+        def get_error(message, i):
+            # Line numbers of the file are one-based and after the header
+            return ValueError('Invalid CoD file {} at line {}: {}'.format(cod_file_path, idx_lines[i] + 2, message))
+
+        if np.any(n_columns < 3):
+            raise get_error('fewer than 3 columns', np.where(n_columns < 3)[0][0])
+
+        if np.all(n_columns == 3):
+            # np.fromstring stops silently at the first value that is not a number
+            values = np.fromstring(content, sep=' ')
+            if values.size != 3 * idx_lines.size:
+                raise get_error('not a number', values.size // 3)
+            values = values.reshape((-1, 3))
+        else:
+            fields = [line.split()[:3] for line in content.splitlines() if line.strip()]
+            try:
+                values = np.array(fields, dtype=np.float64)
+            except ValueError:
+                raise get_error('not a number', [i for i, line_fields in enumerate(fields)
+                                                 if not CoD._is_numbers(line_fields)][0])
+
+        idx_fractions = np.where((values[:, 0] % 1 != 0) | (values[:, 1] % 1 != 0))[0]
+        if idx_fractions.size > 0:
+            raise get_error('dates must be integers', idx_fractions[0])
 
         return {
-            'rdates': np.array(rdates, dtype=int),
-            'adates': np.array(adates, dtype=int),
-            'edists': np.array(edists, dtype=float),
+            'rdates': values[:, 0].astype(int),
+            'adates': values[:, 1].astype(int),
+            'edists': values[:, 2].copy(),
         }
 
+    @staticmethod
+    def _is_numbers(fields):
+        try:
+            [float(field) for field in fields]
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    def read_from_file(cod_file_path, cache_dir=None):
+        """ Read from the given CoD file path
+
+        If cache_dir is given, the parsed dates are cached there as a .npz file, which is used
+        as long as the modification time and size of the CoD file are unchanged.
+        """
+        with profiling.stage('cod.read', path=cod_file_path) as record:
+            if cache_dir is not None:
+                cod_dates = CoD._read_cache(cod_file_path, cache_dir)
+                if cod_dates is not None:
+                    record['cached'] = True
+                    return cod_dates
+
+            with open(cod_file_path) as ins:
+                _, _, season = ins.readline().split()
+                content = ins.read()
+            record['files_opened'] = 1
+            record['bytes_read'] = len(content)
+
+            cod_dates = CoD._parse(content, cod_file_path)
+
+            if cache_dir is not None:
+                CoD._write_cache(cod_file_path, cache_dir, cod_dates)
+
+            return cod_dates
+
+    @staticmethod
+    def _get_cache_path(cod_file_path, cache_dir):
+        return os.path.join(cache_dir, hashlib.md5(os.path.abspath(cod_file_path)).hexdigest() + '.npz')
+
+    @staticmethod
+    def _read_cache(cod_file_path, cache_dir):
+        cache_path = CoD._get_cache_path(cod_file_path, cache_dir)
+        if not os.path.exists(cache_path):
+            return None
+
+        stat = os.stat(cod_file_path)
+        with np.load(cache_path) as cached:
+            if cached['mtime'] != stat.st_mtime or cached['size'] != stat.st_size:
+                logging.debug('stale CoD cache: {}'.format(cache_path))
+                return None
+            return {
+                'rdates': cached['rdates'],
+                'adates': cached['adates'],
+                'edists': cached['edists'],
+            }
+
+    @staticmethod
+    def _write_cache(cod_file_path, cache_dir, cod_dates):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        stat = os.stat(cod_file_path)
+        cache_path = CoD._get_cache_path(cod_file_path, cache_dir)
+        # Write to a temporary file first so that concurrent readers never see a partial cache
+        cache_path_tmp = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(cache_path_tmp, 'wb') as f:
+            np.savez(f, mtime=stat.st_mtime, size=stat.st_size, **cod_dates)
+        os.rename(cache_path_tmp, cache_path)
+
     def read(self, main_parameters):
         """ Given the model, scenario, region_type, season, predictand, locate the CoD file path and read its content
         """
-        return CoD.read_from_file(self.get_cod_file_path(main_parameters))
+        return self.read_file(self.get_cod_file_path(main_parameters))
+
+    def read_file(self, cod_file_path):
+        """ Read the given CoD file, which is kept in memory for later reads if memoize is set
+        """
+        if not self.memoize:
+            return CoD.read_from_file(cod_file_path, self.cache_dir)
+
+        stat = os.stat(cod_file_path)
+        with self._lock:
+            parsed = self._parsed.get(cod_file_path)
+        if parsed is not None and parsed[0] == (stat.st_mtime, stat.st_size):
+            return parsed[1]
+
+        cod_dates = CoD.read_from_file(cod_file_path, self.cache_dir)
+        for value in cod_dates.values():
+            value.flags.writeable = False  # kept dates are shared by all callers
+        with self._lock:
+            self._parsed[cod_file_path] = ((stat.st_mtime, stat.st_size), cod_dates)
+
+        return cod_dates
@@ -3,27 +3,428 @@ Extractor for gridded data
 
 y.wang@bom.gov.au
 """
+import os
+import logging
 
+import numpy as np
+
+from . import profiling
 from .cod import CoD
-from .mask import MaskReader
-from .gridded import AwapDailyDataReader, Data2D
+from .chunkstore import ChunkedOutputStore, DEFAULT_CHUNK_DATES
+from .mask import MaskRegistry
+from .gridded import AwapDailyDataReader, Data2D, Data3D, MISSING_VALUE
+from .ncformat import NETCDF3
+from .ncrecords import RecordAppender, MappedRecordVariable
+from .stats import (GridpointStatistics, DEFAULT_BINS, DEFAULT_QUANTILES, DEFAULT_WET_DAY_THRESHOLD,
+                    MIN_VALID_TEMPERATURE)
+
+# Memory budget in bytes of the blocks of dates written at a time when creating or converting whole
+# output files
+_BLOCK_BYTES = 64 * 1024 ** 2
 
 
 class GriddedExtractor(object):
 
-    def __init__(self, cod_base_dir=None, mask_base_dir=None, gridded_base_dir=None):
-        self.cod_manager = CoD(base_dir=cod_base_dir)
-        self.mask_reader = MaskReader(base_dir=mask_base_dir)
-        self.awap_reader = AwapDailyDataReader(base_dir=gridded_base_dir)
+    def __init__(self, cod_base_dir=None, mask_base_dir=None, gridded_base_dir=None, awap_cache_size=0, workers=1,
+                 packed_base_dir=None, cod_cache_dir=None, dtype=np.float32, mask_cache_dir=None,
+                 cod_memoize=False):
+        self.cod_manager = CoD(base_dir=cod_base_dir, cache_dir=cod_cache_dir, memoize=cod_memoize)
+        self.mask_reader = MaskRegistry(base_dir=mask_base_dir, cache_dir=mask_cache_dir)
+        self.awap_reader = AwapDailyDataReader(base_dir=gridded_base_dir,
+                                               cache_size=awap_cache_size,
+                                               workers=workers,
+                                               packed_base_dir=packed_base_dir,
+                                               dtype=dtype)
 
-    def extract(self, main_parameters, region=None, cube=True):
+    def read_cod_dates(self, main_parameters, start=None, end=None, months=None):
+        """
+        Read the CoD entries within the given window of reconstructed dates, see CoD.select. The
+        window is applied before any AWAP file is read, so only the analog months needed by the
+        window are read.
+        """
         cod_dates = self.cod_manager.read(main_parameters)
-        mask = self.mask_reader.read(region or main_parameters.region_type)
-        data2d = Data2D(self.awap_reader.read(main_parameters.predictand, cod_dates['adates'], mask),
-                        cod_dates['rdates'],
-                        mask.gpnames)
+        if start is not None or end is not None or months:
+            cod_dates = CoD.select(cod_dates, start, end, months)
+            if cod_dates['rdates'].size == 0:
+                raise ValueError('No CoD dates of {} within the window: start={}, end={}, months={}'.format(
+                    main_parameters, start, end, months))
+
+        return cod_dates
+
+    def extract(self, main_parameters, region=None, cube=True, start=None, end=None, months=None):
+        """
+        Extract data for one or several regions. The AWAP data of all regions are read in a
+        single pass over the window enclosing them and then split by region.
+
+        :param region: Name of the region or a list of names, default to the region type
+        :type region: str or list
+        :param start: First reconstructed date to extract, default to the start of the CoD
+        :param end: Last reconstructed date to extract (inclusive), default to the end of the CoD
+        :param months: Months of year (1 to 12) to extract, default to all
+        :type months: list
+        :return: Data2D or Data3D, or a list of them in the order of the given regions
+        """
+        regions = self._get_regions(main_parameters, region)
+        cod_dates = self.read_cod_dates(main_parameters, start, end, months)
+        masks = [self.mask_reader.read(r) for r in regions]
+        with profiling.stage('awap.read', variable=main_parameters.predictand, dates=cod_dates['adates'].size):
+            raw_data_list = self.awap_reader.read_many(main_parameters.predictand,
+                                                       [cod_dates['adates']] * len(masks), masks)
+
+        results = []
+        for raw_data, mask in zip(raw_data_list, masks):
+            data2d = Data2D(raw_data, cod_dates['rdates'], mask.gpnames)
+            results.append(data2d.to_3d(mask.crop()) if cube else data2d)
+
+        return results if isinstance(region, (list, tuple)) else results[0]
 
+    @staticmethod
+    def _get_regions(main_parameters, region):
+        if isinstance(region, (list, tuple)):
+            return region
+        else:
+            return [region or main_parameters.region_type]
+
+    @staticmethod
+    def get_chunk_size(max_memory, masks, cube=True, itemsize=4, workers=1):
+        """
+        Estimate the number of dates that can be extracted and saved at a time within the given
+        memory budget in bytes, not counting the AWAP cache if any.
+
+        :param masks: Masks of the regions extracted at the same time
+        :type masks: list
+        :param itemsize: Size in bytes of the data type of the extracted data
+        :type itemsize: int
+        :param workers: Number of months read concurrently
+        :type workers: int
+        """
+        n_points_list = [mask.idx_mask_flat.size for mask in masks]
+        all_bounds = np.array([mask.bounds for mask in masks])
+        box_sizes = (all_bounds[:, 1] - all_bounds[:, 0]) * (all_bounds[:, 3] - all_bounds[:, 2])
+        window_size = ((all_bounds[:, 1].max() - all_bounds[:, 0].min()) *
+                       (all_bounds[:, 3].max() - all_bounds[:, 2].min()))
+
+        # Each worker reads a month of the window enclosing all masks at a time, i.e. the days read
+        # and the mask of their missing values, then gathers the grid points of each mask and
+        # converts them from big-endian
+        fixed_bytes = workers * 31 * (5 * window_size + 8 * sum(n_points_list))
+        # The extracted data of all masks are held at the same time, then each is saved in turn,
+        # i.e. its cube, the float32 copy, the mask of its missing values and the big-endian
+        # records written to the file
         if cube:
-            return data2d.to_3d(mask.crop())
+            save_bytes = max((itemsize + 9) * box_size for box_size in box_sizes)
         else:
-            return data2d
+            save_bytes = max(4 * n_points for n_points in n_points_list)
+        bytes_per_date = itemsize * sum(n_points_list) + save_bytes
+
+        if max_memory < fixed_bytes + bytes_per_date:
+            raise ValueError('Memory budget of {} bytes is below the {} bytes needed to extract a single '
+                             'date'.format(max_memory, fixed_bytes + bytes_per_date))
+        return (max_memory - fixed_bytes) // bytes_per_date
+
+    def extract_to_nc(self, filename, main_parameters, region=None, cube=True, max_memory=None,
+                      start=None, end=None, months=None, output_format=None):
+        """
+        Extract data and save them to a NetCDF file. If max_memory is given, the CoD dates are
+        processed in chunks with each chunk appended to the file along its record dimension,
+        so that the peak memory is bounded regardless of the region size or CoD length.
+
+        :param filename: Name of the file, or a list of names one for each of the given regions
+        :param region: Name of the region or a list of names, default to the region type
+        :param max_memory: Memory budget in bytes, default to extract all dates at once
+        :type max_memory: int
+        :param start: First reconstructed date to extract, also see end and months of extract
+        :param output_format: Format of the files, default to NetCDF classic
+        :type output_format: ncformat.OutputFormat
+        """
+        filenames = filename if isinstance(filename, (list, tuple)) else [filename]
+        regions = self._get_regions(main_parameters, region)
+
+        if max_memory is None:
+            for fname, data in zip(filenames, self.extract(main_parameters, list(regions), cube, start, end, months)):
+                data.save_nc(fname, main_parameters=main_parameters, output_format=output_format)
+            return
+
+        cod_dates = self.read_cod_dates(main_parameters, start, end, months)
+        masks = [self.mask_reader.read(r) for r in regions]
+
+        chunk_size = GriddedExtractor.get_chunk_size(max_memory, masks, cube, self.awap_reader.dtype.itemsize,
+                                                     self.awap_reader.workers)
+        logging.debug('extracting {} dates in chunks of {}'.format(cod_dates['adates'].size, chunk_size))
+
+        for i0 in xrange(0, cod_dates['adates'].size, chunk_size):
+            i1 = i0 + chunk_size
+            adates = cod_dates['adates'][i0:i1]
+            with profiling.stage('awap.read', variable=main_parameters.predictand, dates=adates.size):
+                raw_data_list = self.awap_reader.read_many(main_parameters.predictand, [adates] * len(masks), masks)
+
+            for fname, raw_data, mask in zip(filenames, raw_data_list, masks):
+                data = Data2D(raw_data, cod_dates['rdates'][i0:i1], mask.gpnames)
+                if cube:
+                    data = data.to_3d(mask.crop())
+
+                if i0 == 0:
+                    data.save_nc(fname, main_parameters=main_parameters, output_format=output_format)
+                else:
+                    data.append_nc(fname)
+
+    @staticmethod
+    def _get_block_dates(cropped_mask):
+        """
+        :return: Number of dates of the cube over the cropped mask within _BLOCK_BYTES
+        :rtype: int
+        """
+        return max(1, _BLOCK_BYTES // (cropped_mask.data.size * np.dtype(np.float32).itemsize))
+
+    @staticmethod
+    def _create_cube_nc(filename, main_parameters, rdates, mask):
+        """
+        Create a NetCDF classic file of the cube of the given dates over the cropped mask, filled
+        with missing values to be overwritten by the extracted data. The records are written a
+        block of dates at a time, so the file is never held in memory.
+
+        :return: Appender of the file and the name of its data variable
+        :rtype: tuple
+        """
+        cropped_mask = mask.crop()
+        days = CoD.to_days_since(rdates)
+        block_dates = GriddedExtractor._get_block_dates(cropped_mask)
+        data = np.empty((min(block_dates, rdates.size),) + cropped_mask.data.shape, dtype=np.float32)
+        data[:] = MISSING_VALUE
+        # Write the file with its first record only, then append all other records
+        Data3D(data[:1], rdates[:1], cropped_mask.lat, cropped_mask.lon).save_nc(filename,
+                                                                               main_parameters=main_parameters)
+        appender = RecordAppender(filename)
+        varname = [name for name in appender.names if name != 'time'][0]
+        for i0 in xrange(1, rdates.size, block_dates):
+            i1 = min(i0 + block_dates, rdates.size)
+            appender.append({'time': days[i0:i1], varname: data[:i1 - i0]})
+
+        return appender, varname
+
+    def extract_cube_to_nc(self, filename, main_parameters, region=None, start=None, end=None, months=None):
+        """
+        Extract data and save them as a cube to a NetCDF file. The data of each AWAP month are
+        gathered straight into the memory-mapped output variable, so neither the two-dimensional
+        data nor the cube are ever held in memory.
+
+        :param filename: Name of the file, or a list of names one for each of the given regions
+        :param region: Name of the region or a list of names, default to the region type
+        :param start: First reconstructed date to extract, also see end and months of extract
+        """
+        filenames = filename if isinstance(filename, (list, tuple)) else [filename]
+        regions = self._get_regions(main_parameters, region)
+        cod_dates = self.read_cod_dates(main_parameters, start, end, months)
+        masks = [self.mask_reader.read(r) for r in regions]
+        n_dates = cod_dates['adates'].size
+
+        records_list = []
+        cubes = []
+        try:
+            for fname, mask in zip(filenames, masks):
+                appender, varname = GriddedExtractor._create_cube_nc(fname, main_parameters, cod_dates['rdates'],
+                                                                     mask)
+                records = appender.memmap()
+                records_list.append(records)
+                cubes.append(records[varname])
+
+            with profiling.stage('awap.read', variable=main_parameters.predictand, dates=n_dates):
+                self.awap_reader.read_to_cubes(main_parameters.predictand, cod_dates['adates'], masks, cubes,
+                                               missing_value=MISSING_VALUE)
+            with profiling.stage('flush_nc', dates=n_dates):
+                for records in records_list:
+                    records.flush()
+        finally:
+            cubes = None
+            records = None
+            records_list = None
+
+    def extract_to_store(self, directory, main_parameters, region=None, part=0, n_parts=1,
+                         chunk_dates=DEFAULT_CHUNK_DATES, start=None, end=None, months=None):
+        """
+        Extract data as a cube into a chunked output store, see chunkstore.ChunkedOutputStore.
+        The time chunks are shared by n_parts workers, possibly running concurrently in
+        separate processes, each extracting and writing every n_parts-th chunk from its part
+        on. The store is consolidated into a NetCDF file once all parts are done.
+
+        :param directory: Directory of the store
+        :param region: Name of the region, default to the region type
+        :param part: Index of the part from 0 to n_parts - 1
+        :type part: int
+        :param chunk_dates: Number of dates per chunk, which must be the same for all parts
+        :type chunk_dates: int
+        :param start: First reconstructed date to extract, also see end and months of extract
+        """
+        if not 0 <= part < n_parts:
+            raise ValueError('Part {} is not within 0 to {}'.format(part, n_parts - 1))
+
+        cod_dates = self.read_cod_dates(main_parameters, start, end, months)
+        mask = self.mask_reader.read(region or main_parameters.region_type)
+        cropped_mask = mask.crop()
+
+        store = ChunkedOutputStore(directory)
+        store.create(cod_dates['rdates'], cropped_mask.lat, cropped_mask.lon, main_parameters=main_parameters,
+                     chunks=(chunk_dates, cropped_mask.lat.size, cropped_mask.lon.size))
+
+        n_chunks = store.get_n_chunks()[0]
+        for i in xrange(part, n_chunks, n_parts):
+            i0 = i * chunk_dates
+            i1 = i0 + chunk_dates
+            adates = cod_dates['adates'][i0:i1]
+            logging.debug('extracting chunk {} of {} to {}'.format(i, n_chunks, directory))
+            with profiling.stage('awap.read', variable=main_parameters.predictand, dates=adates.size):
+                raw_data = self.awap_reader.read(main_parameters.predictand, adates, mask)
+            data = Data2D(raw_data, cod_dates['rdates'][i0:i1], mask.gpnames).to_3d(cropped_mask)
+            store.write(data.data, i0)
+
+    def extract_statistics(self, main_parameters, region=None, bins=None, wet_day_threshold=None,
+                           start=None, end=None, months=None):
+        """
+        Accumulate the statistics of every grid point as each AWAP month is gathered, without
+        holding the extracted series in memory. Temperatures below MIN_VALID_TEMPERATURE are
+        skipped as anomalous, like fast_extract does.
+
+        :param region: Name of the region, default to the region type
+        :param bins: Edges of the bins of the histograms, default to DEFAULT_BINS of the predictand
+        :type bins: numpy.ndarray
+        :param wet_day_threshold: Threshold of wet days, default to DEFAULT_WET_DAY_THRESHOLD for
+            rain and no counting of wet days for other predictands
+        :type wet_day_threshold: float
+        :param start: First reconstructed date to extract, also see end and months of extract
+        :rtype: stats.GridpointStatistics
+        """
+        cod_dates = self.read_cod_dates(main_parameters, start, end, months)
+        mask = self.mask_reader.read(region or main_parameters.region_type)
+
+        if bins is None:
+            bins_start, bins_stop, n_bins = DEFAULT_BINS[main_parameters.predictand]
+            bins = np.linspace(bins_start, bins_stop, n_bins + 1)
+        if wet_day_threshold is None and main_parameters.predictand == 'rain':
+            wet_day_threshold = DEFAULT_WET_DAY_THRESHOLD
+
+        valid_min = MIN_VALID_TEMPERATURE if main_parameters.predictand in ('tmax', 'tmin') else None
+
+        statistics = GridpointStatistics(mask.idx_mask_flat.size, bins, wet_day_threshold, valid_min)
+        with profiling.stage('awap.read', variable=main_parameters.predictand, dates=cod_dates['adates'].size):
+            self.awap_reader.read_to(main_parameters.predictand, [cod_dates['adates']], [mask], [statistics.scatter])
+
+        return statistics
+
+    def extract_statistics_to_nc(self, filename, main_parameters, region=None, bins=None,
+                                 quantiles=DEFAULT_QUANTILES, wet_day_threshold=None,
+                                 start=None, end=None, months=None, histogram=True):
+        """
+        Extract the statistics of every grid point and save them as maps to a NetCDF file, see
+        extract_statistics and stats.GridpointStatistics.save_nc.
+
+        :param quantiles: Probabilities of the quantiles to save
+        :type quantiles: list
+        :param histogram: Whether to save the histograms too
+        :type histogram: bool
+        """
+        statistics = self.extract_statistics(main_parameters, region, bins, wet_day_threshold, start, end, months)
+        mask = self.mask_reader.read(region or main_parameters.region_type)
+        statistics.save_nc(filename, mask.crop(), quantiles, main_parameters=main_parameters, histogram=histogram)
+
+    def extract_many_to_nc(self, filenames, main_parameters_list, start=None, end=None, months=None,
+                           output_format=None):
+        """
+        Extract data for a list of main parameters and save each as a cube to its own NetCDF
+        file, sharing the AWAP reads like extract_many. The data of each AWAP month are gathered
+        straight into the memory-mapped output files, as by extract_cube_to_nc, so the memory
+        needed does not grow with the number or length of the extractions.
+
+        :param filenames: Names of the files, one for each of main_parameters_list
+        :type filenames: list
+        :param start: First reconstructed date to extract, also see end and months of extract
+        :param output_format: Format of the files, default to NetCDF classic. NetCDF4 files are
+            converted from NetCDF classic files gathered the same way, a block of dates at a time
+        :type output_format: ncformat.OutputFormat
+        """
+        cod_dates_list = [self.read_cod_dates(main_parameters, start, end, months)
+                          for main_parameters in main_parameters_list]
+        masks = [self.mask_reader.read(main_parameters.region) for main_parameters in main_parameters_list]
+        convert = output_format is not None and output_format.name != NETCDF3
+
+        for predictand in sorted(set(main_parameters.predictand for main_parameters in main_parameters_list)):
+            idx = [i for i, main_parameters in enumerate(main_parameters_list)
+                   if main_parameters.predictand == predictand]
+            gathered_filenames = [filenames[i] + '.tmp' if convert else filenames[i] for i in idx]
+
+            # Each month is written through a memory map of its own, so neither the outputs nor
+            # the pages written stay in memory
+            cubes = []
+            for i, fname in zip(idx, gathered_filenames):
+                appender, varname = GriddedExtractor._create_cube_nc(fname, main_parameters_list[i],
+                                                                     cod_dates_list[i]['rdates'], masks[i])
+                cubes.append(MappedRecordVariable(appender, varname))
+
+            n_dates = sum(cod_dates_list[i]['adates'].size for i in idx)
+            with profiling.stage('awap.read', variable=predictand, dates=n_dates):
+                self.awap_reader.read_many_to_cubes(predictand, [cod_dates_list[i]['adates'] for i in idx],
+                                                    [masks[i] for i in idx], cubes, missing_value=MISSING_VALUE)
+
+            if convert:
+                for i, fname in zip(idx, gathered_filenames):
+                    GriddedExtractor._convert_cube_nc(fname, filenames[i], main_parameters_list[i],
+                                                      cod_dates_list[i]['rdates'], masks[i], output_format)
+                    os.remove(fname)
+
+    @staticmethod
+    def _convert_cube_nc(src_filename, filename, main_parameters, rdates, mask, output_format):
+        """
+        Save the cube of a NetCDF classic file written by _create_cube_nc in the given format, a
+        block of dates at a time.
+        """
+        cropped_mask = mask.crop()
+        records = RecordAppender(src_filename).memmap()
+        try:
+            varname = [name for name in records.dtype.names if name != 'time'][0]
+            block_dates = GriddedExtractor._get_block_dates(cropped_mask)
+            for i0 in xrange(0, rdates.size, block_dates):
+                i1 = i0 + block_dates
+                data = Data3D(records[varname][i0:i1].astype(np.float32), rdates[i0:i1], cropped_mask.lat,
+                              cropped_mask.lon)
+                if i0 == 0:
+                    data.save_nc(filename, main_parameters=main_parameters, output_format=output_format)
+                else:
+                    data.append_nc(filename)
+        finally:
+            records = None
+
+    def extract_many(self, main_parameters_list, cube=True, start=None, end=None, months=None):
+        """
+        Extract data for a list of main parameters. CoD files of the same predictand share
+        their AWAP reads, i.e. each monthly file is read only once for the whole list.
+
+        The region of each extraction is given by the region member of its main parameters.
+        The window of reconstructed dates, if any, applies to every extraction, see extract.
+
+        :param main_parameters_list:
+        :type main_parameters_list: list
+        :return: List of Data2D or Data3D in the same order of main_parameters_list
+        :rtype: list
+        """
+        cod_dates_list = [self.read_cod_dates(main_parameters, start, end, months)
+                          for main_parameters in main_parameters_list]
+        masks = {}
+        for main_parameters in main_parameters_list:
+            if main_parameters.region not in masks:
+                masks[main_parameters.region] = self.mask_reader.read(main_parameters.region)
+
+        results = [None] * len(main_parameters_list)
+        for predictand in sorted(set(main_parameters.predictand for main_parameters in main_parameters_list)):
+            idx = [i for i, main_parameters in enumerate(main_parameters_list)
+                   if main_parameters.predictand == predictand]
+            n_dates = sum(cod_dates_list[i]['adates'].size for i in idx)
+            with profiling.stage('awap.read', variable=predictand, dates=n_dates):
+                raw_data_list = self.awap_reader.read_many(predictand,
+                                                           [cod_dates_list[i]['adates'] for i in idx],
+                                                           [masks[main_parameters_list[i].region] for i in idx])
+
+            for i, raw_data in zip(idx, raw_data_list):
+                mask = masks[main_parameters_list[i].region]
+                data2d = Data2D(raw_data, cod_dates_list[i]['rdates'], mask.gpnames)
+                results[i] = data2d.to_3d(mask.crop()) if cube else data2d
+
+        return results
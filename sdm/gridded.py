@@ -4,13 +4,26 @@ Extract data from gridded dataset, i.e. AWAP daily dataset
 y.wang@bom.gov.au
 """
 import os
+import re
 import logging
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from scipy.io import netcdf
 
+from . import profiling
 from .cod import CoD
+from .cache import LRUCache
+from .ncformat import OutputFormat, open_appender
+from .store import PackedAwapStore, TimeMajorAwapStore
+from .mask import Mask
+
+MISSING_VALUE = 99999.9
+
+_PACKED_BLOCK_SIZE = 1000
+
+_MONTHLY_FILE_PATTERN = re.compile(r'^\w+_daily_[\d.]+\.(\d{4})(\d{2})\.nc$')
 
 _Data2DBase = namedtuple('_Data2DBase', 'data, dates, gpnames')
 _Data3DBase = namedtuple('_Data3DBase', 'data, dates, lat, lon')
@@ -24,18 +37,28 @@ class Data2D(_Data2DBase):
         :param mask:
         :type mask: mask.Mask
         """
-        data = np.empty((self.data.shape[0], mask.data.size))
-        data[:] = np.NaN
+        with profiling.stage('to_3d', dates=self.data.shape[0]):
+            data = np.empty((self.data.shape[0], mask.data.size), dtype=self.data.dtype)
+            data[:] = np.NaN
 
-        data[:, mask.idx_mask_flat] = self.data
-        data = data.reshape((self.data.shape[0], mask.data.shape[0], mask.data.shape[1]))
+            data[:, mask.idx_mask_flat] = self.data
+            data = data.reshape((self.data.shape[0], mask.data.shape[0], mask.data.shape[1]))
 
         return Data3D(data, self.dates, mask.lat, mask.lon)
 
-    def save_nc(self, filename, varname='unknown', main_parameters=None):
+    def save_nc(self, filename, varname='unknown', main_parameters=None, output_format=None):
+        """
+
+        :param output_format: Format of the file, default to NetCDF classic
+        :type output_format: ncformat.OutputFormat
+        """
+        with profiling.stage('save_nc', path=filename, dates=self.data.shape[0]):
+            self._save_nc(filename, varname, main_parameters, output_format or OutputFormat())
+
+    def _save_nc(self, filename, varname, main_parameters, output_format):
         import datetime
 
-        f = netcdf.netcdf_file(filename, 'w')
+        f = output_format.open(filename)
         try:
             f.title = 'Daily gridded climate series'
             if main_parameters:
@@ -45,13 +68,13 @@ class Data2D(_Data2DBase):
             f.history = 'Generated on %s' % datetime.date.today()
 
             f.createDimension('dates', 0)
-            var_dates = f.createVariable('dates', np.int, ('dates',))
+            var_dates = f.createVariable('dates', np.int32, ('dates',))
             var_dates[:] = self.dates
             var_dates.units = 'day'
             var_dates.long_name = '[Y]YYMMDD'
 
             f.createDimension('gpnames', self.gpnames.size)
-            var_gpnames = f.createVariable('gpnames', np.int, ('gpnames',))
+            var_gpnames = f.createVariable('gpnames', np.int32, ('gpnames',))
             var_gpnames[:] = self.gpnames
             var_gpnames.units = 'LLLLLTTTT'
             var_gpnames.long_name = 'First 5 digits are longitude and last 4 digits are latitude'
@@ -61,8 +84,8 @@ class Data2D(_Data2DBase):
             else:
                 predictand = varname
 
-            var_data = f.createVariable(predictand, np.float32, ('dates', 'gpnames'))
-            var_data[:, :] = self.data.copy()
+            var_data = output_format.create_data_variable(f, predictand, ('dates', 'gpnames'), self.data.shape)
+            var_data[:, :] = self.data
             var_data.units = 'mm' if predictand == 'rain' else 'K'
             if main_parameters:
                 var_data.long_name = main_parameters.predictand
@@ -70,23 +93,38 @@ class Data2D(_Data2DBase):
         finally:
             f.close()
 
+    def append_nc(self, filename):
+        """
+        Append the data along the dates dimension of a file previously written by save_nc.
+        """
+        with profiling.stage('append_nc', path=filename, dates=self.data.shape[0]):
+            appender = open_appender(filename)
+            varname = [name for name in appender.names if name != 'dates'][0]
+            appender.append({'dates': self.dates, varname: self.data})
+
 
 class Data3D(_Data3DBase):
 
     def to_2d(self, mask):
-        data = np.empty((self.data.shape[0], len(mask.idx_mask_flat)))
-        data[:] = np.NaN
         data = self.data.reshape((self.data.shape[0], self.data.shape[1] * self.data.shape[2]))[:, mask.idx_mask_flat]
 
         return Data2D(data, self.dates, mask.gpnames)
 
-    def save_nc(self, filename, varname='unknown', main_parameters=None):
+    def save_nc(self, filename, varname='unknown', main_parameters=None, output_format=None):
+        """
+
+        :param output_format: Format of the file, default to NetCDF classic
+        :type output_format: ncformat.OutputFormat
+        """
+        with profiling.stage('save_nc', path=filename, dates=self.data.shape[0]):
+            self._save_nc(filename, varname, main_parameters, output_format or OutputFormat())
+
+    def _save_nc(self, filename, varname, main_parameters, output_format):
         import datetime
 
-        dates = (np.array([np.datetime64(d) for d in CoD.format_dates(self.dates)])
-                 - np.datetime64('1899-12-31')).astype('int')
+        dates = CoD.to_days_since(self.dates)
 
-        f = netcdf.netcdf_file(filename, 'w')
+        f = output_format.open(filename)
         try:
             f.title = 'Daily gridded climate series'
             if main_parameters:
@@ -120,19 +158,123 @@ class Data3D(_Data3DBase):
             else:
                 predictand = varname
 
-            missing_value = 99999.9
-            var_data = f.createVariable(predictand, np.float32, ('time', 'lat', 'lon'))
-            data = self.data.copy()
-            data[np.where(np.isnan(data))] = missing_value
+            var_data = output_format.create_data_variable(f, predictand, ('time', 'lat', 'lon'), self.data.shape,
+                                                          missing_value=MISSING_VALUE)
+            data = self.data.astype(np.float32)
+            np.copyto(data, MISSING_VALUE, where=np.isnan(data))
             var_data[:, :, :] = data
             var_data.units = 'mm' if predictand == 'rain' else 'K'
             if main_parameters:
                 var_data.long_name = main_parameters.predictand
-            var_data.missing_value = var_data._FillValue = missing_value
 
         finally:
             f.close()
 
+    def append_nc(self, filename):
+        """
+        Append the data along the time dimension of a file previously written by save_nc.
+        """
+        with profiling.stage('append_nc', path=filename, dates=self.data.shape[0]):
+            appender = open_appender(filename)
+            varname = [name for name in appender.names if name != 'time'][0]
+            data = self.data.astype(np.float32)
+            np.copyto(data, MISSING_VALUE, where=np.isnan(data))
+            appender.append({'time': CoD.to_days_since(self.dates), varname: data})
+
+
+class LazyData2D(object):
+    """
+    Data2D backed by the memory-mapped variable of a NetCDF file written by Data2D.save_nc or
+    the downscaling. The dates and gpnames are read up front but the data are only read on
+    selection, i.e. only the rows and columns selected are copied out of the file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._ncd_file = netcdf.netcdf_file(file_path)
+        self.dates = self._ncd_file.variables['dates'].data.copy()
+        self.gpnames = self._ncd_file.variables['gpnames'].data.copy()
+
+        varnames = self._ncd_file.variables.keys()
+        varnames.remove('dates')
+        varnames.remove('gpnames')
+        self.varname = varnames[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._ncd_file is not None:
+            self._ncd_file.close()
+            self._ncd_file = None
+
+    @property
+    def shape(self):
+        return self.dates.size, self.gpnames.size
+
+    @property
+    def lat(self):
+        """
+        Latitudes of the gpnames
+        """
+        return -(self.gpnames % 10000) / 100.0
+
+    @property
+    def lon(self):
+        """
+        Longitudes of the gpnames
+        """
+        return (self.gpnames // 10000) / 100.0
+
+    def select(self, start=None, end=None, gpnames=None, bbox=None):
+        """
+        Read a subset of the data. All criteria given are combined.
+
+        :param start: First date to select, e.g. '1990-01-01'
+        :param end: Last date to select (inclusive), e.g. '1999-12-31'
+        :param gpnames: gpnames to select in the given order
+        :type gpnames: list
+        :param bbox: (lat_min, lat_max, lon_min, lon_max) of the grid points to select (inclusive)
+        :type bbox: tuple
+        :return:
+        :rtype: Data2D
+        """
+        idx_rows = np.arange(self.dates.size)
+        if start is not None or end is not None:
+            dates = CoD.to_datetime64(self.dates)
+            selected = np.ones(dates.size, dtype=bool)
+            if start is not None:
+                selected &= dates >= np.datetime64(start, 'D')
+            if end is not None:
+                selected &= dates <= np.datetime64(end, 'D')
+            idx_rows = np.where(selected)[0]
+
+        idx_cols = np.arange(self.gpnames.size)
+        if gpnames is not None:
+            gpnames = np.asarray(gpnames)
+            idx_sorted = np.argsort(self.gpnames)
+            pos = np.minimum(np.searchsorted(self.gpnames, gpnames, sorter=idx_sorted), self.gpnames.size - 1)
+            idx_cols = idx_sorted[pos]
+            idx_missing = np.where(self.gpnames[idx_cols] != gpnames)[0]
+            if idx_missing.size > 0:
+                raise ValueError('gpnames not found in {}: {}'.format(self.file_path, gpnames[idx_missing[:10]]))
+        if bbox is not None:
+            lat_min, lat_max, lon_min, lon_max = bbox
+            lat, lon = self.lat[idx_cols], self.lon[idx_cols]
+            idx_cols = idx_cols[(lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)]
+
+        var_data = self._ncd_file.variables[self.varname].data
+        if idx_rows.size > 0 and idx_rows[-1] - idx_rows[0] + 1 == idx_rows.size:
+            # Contiguous dates, e.g. a date range, are read as a single slab
+            data = var_data[idx_rows[0]:idx_rows[-1] + 1][:, idx_cols]
+        else:
+            data = var_data[np.ix_(idx_rows, idx_cols)]
+
+        return Data2D(data, self.dates[idx_rows], self.gpnames[idx_cols])
+
 
 class Data2DReader(object):
 
@@ -155,6 +297,69 @@ class Data2DReader(object):
         finally:
             ncd_file.close()
 
+    def read_blocks(self, file_path, block_size=1000):
+        """
+        Read the data in blocks of dates. Only the slab of each block is copied out of the
+        memory-mapped file, so the memory needed is bounded by the block size regardless of the
+        length of the series.
+
+        :param block_size: Number of dates of each block
+        :type block_size: int
+        :return: Generator of Data2D, at least one even if the file has no dates
+        """
+        logging.debug('Reading {} in blocks of {} dates'.format(file_path, block_size))
+
+        ncd_file = netcdf.netcdf_file(file_path)
+        try:
+            gpnames = ncd_file.variables['gpnames'].data.copy()
+
+            varnames = ncd_file.variables.keys()
+            varnames.remove('dates')
+            varnames.remove('gpnames')
+            varname = varnames[0]
+
+            n_dates = ncd_file.variables['dates'].shape[0]
+            for start in xrange(0, max(n_dates, 1), block_size):
+                end = start + block_size
+                with profiling.stage('data2d.read_block', path=file_path, start=start) as record:
+                    data2d = Data2D(ncd_file.variables[varname].data[start:end].copy(),
+                                    ncd_file.variables['dates'].data[start:end].copy(),
+                                    gpnames)
+                    record['bytes_read'] = data2d.data.nbytes
+                yield data2d
+
+        finally:
+            ncd_file.close()
+
+    def read_lazy(self, file_path):
+        """
+        Open the file without reading its data, which are then read on selection.
+        :rtype: LazyData2D
+        """
+        logging.debug('Opening {}'.format(file_path))
+        return LazyData2D(file_path)
+
+
+def convert_to_3d_nc(data2d_file, data3d_file, mask, main_parameters=None, block_size=1000, output_format=None):
+    """
+    Convert a 2D (dates, gpnames) file to a 3D (time, lat, lon) file a block of dates at a time,
+    so the memory usage is independent of the series length.
+
+    :param mask: Mask of the 2D data
+    :type mask: mask.Mask
+    :param block_size: Number of dates converted and appended to the 3D file at a time
+    :type block_size: int
+    :param output_format: Format of the 3D file, default to NetCDF classic
+    :type output_format: ncformat.OutputFormat
+    """
+    cropped_mask = mask.crop()
+    for i, data2d in enumerate(Data2DReader().read_blocks(data2d_file, block_size)):
+        data3d = data2d.to_3d(cropped_mask)
+        if i == 0:
+            data3d.save_nc(data3d_file, main_parameters=main_parameters, output_format=output_format)
+        else:
+            data3d.append_nc(data3d_file)
+
 
 class DownscaledData2DReader(Data2DReader):
 
@@ -172,17 +377,58 @@ class DownscaledData2DReader(Data2DReader):
         file_path = os.path.join(self.base_dir, main_parameters.get_ds_file())
         return super(DownscaledData2DReader, self).read(file_path)
 
+    def read_lazy(self, main_parameters):
+        """
+
+        :param main_parameters:
+        :type main_parameters: parameters.MainParameters
+        :rtype: LazyData2D
+        """
+        file_path = os.path.join(self.base_dir, main_parameters.get_ds_file())
+        return super(DownscaledData2DReader, self).read_lazy(file_path)
+
 
 class AwapDailyDataReader(object):
 
-    def __init__(self, base_dir=None, verbose=False):
+    def __init__(self, base_dir=None, verbose=False, cache_size=0, workers=1, packed_base_dir=None,
+                 dtype=np.float32):
+        """
+
+        :param cache_size: Memory budget in bytes for caching decoded monthly data, 0 to disable caching
+        :type cache_size: int
+        :param workers: Number of threads reading monthly files concurrently
+        :type workers: int
+        :param packed_base_dir: Directory of packed stores, which are read instead of the monthly
+            files for variables that have been packed
+        :type packed_base_dir: str
+        :param dtype: Data type of the extracted data. AWAP data are single precision so the default
+            float32 loses nothing while halving the memory of float64
+        """
         self.resolution = '0.05'
         self.lat = np.arange(-4450, -995, 5) / 100.0
         self.lon = np.arange(11200, 15630, 5) / 100.0
         self.base_dir = base_dir or os.getcwd()
         self.verbose = verbose
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.workers = workers
+        self.packed_base_dir = packed_base_dir
+        self.dtype = np.dtype(dtype)
+        self._packed_stores = {}
+        self._time_major_stores = {}
+
+    def cache_info(self):
+        """
+        :return: Hit/miss counters and memory usage of the cache, None if caching is disabled
+        :rtype: dict
+        """
+        return self.cache.info() if self.cache is not None else None
 
-    def read_one_file(self, var_name, year, month):
+    @staticmethod
+    def get_codes(var_name):
+        """
+        :return: The variable code and file code of the given variable name
+        :rtype: tuple
+        """
         if var_name in ['rr', 'rain']:
             var_code = 'rr'
             file_code = var_code + '_calib'
@@ -190,19 +436,166 @@ class AwapDailyDataReader(object):
             var_code = var_name
             file_code = var_code
 
-        file_path = os.path.join(self.base_dir,
-                                 'daily_%s' % self.resolution,
-                                 file_code,
-                                 '%s_daily_%s.%04d%02d.nc' % (file_code, self.resolution, year, month))
+        return var_code, file_code
+
+    def get_file_path(self, var_name, year, month):
+        _, file_code = AwapDailyDataReader.get_codes(var_name)
+        return os.path.join(self.base_dir,
+                            'daily_%s' % self.resolution,
+                            file_code,
+                            '%s_daily_%s.%04d%02d.nc' % (file_code, self.resolution, year, month))
+
+    def _get_store(self, var_name, store_class, stores):
+        if not self.packed_base_dir:
+            return None
+
+        _, file_code = AwapDailyDataReader.get_codes(var_name)
+        if file_code not in stores:
+            store = store_class(self.packed_base_dir, file_code)
+            stores[file_code] = store if store.exists() else None
+
+        return stores[file_code]
+
+    def get_packed_store(self, var_name):
+        """
+        :return: The packed store of the given variable, None if it is not packed
+        :rtype: store.PackedAwapStore
+        """
+        return self._get_store(var_name, PackedAwapStore, self._packed_stores)
+
+    def get_time_major_store(self, var_name):
+        """
+        :return: The time-major store of the given variable, None if it is not packed
+        :rtype: store.TimeMajorAwapStore
+        """
+        return self._get_store(var_name, TimeMajorAwapStore, self._time_major_stores)
+
+    def get_point_index(self, lat, lon):
+        """
+        :return: Indices of the grid point nearest to the given latitude and longitude
+        :rtype: tuple
+        """
+        idx_lat = int(round((float(lat) - self.lat[0]) / (self.lat[1] - self.lat[0])))
+        idx_lon = int(round((float(lon) - self.lon[0]) / (self.lon[1] - self.lon[0])))
+        if not (0 <= idx_lat < self.lat.size and 0 <= idx_lon < self.lon.size):
+            raise ValueError('Point ({}, {}) is outside of the AWAP grid'.format(lat, lon))
+
+        return idx_lat, idx_lon
+
+    def read_point(self, var_name, lat, lon, adates):
+        """
+        Read the time series of the grid point nearest to the given latitude and longitude. The
+        time-major store is used if the variable has one.
+
+        :return: The time series as a one-dimensional array
+        :rtype: numpy.ndarray
+        """
+        idx_lat, idx_lon = self.get_point_index(lat, lon)
+
+        store = self.get_time_major_store(var_name)
+        if store is not None:
+            return store.read_point(idx_lat, idx_lon, adates)
+
+        mask_data = np.zeros((self.lat.size, self.lon.size), dtype=np.int8)
+        mask_data[idx_lat, idx_lon] = 1
+        mask = Mask.from_indices(mask_data, self.lat, self.lon, (np.array([idx_lat]), np.array([idx_lon])),
+                                 np.zeros(1, dtype=long))
+        return self.read(var_name, adates, mask)[:, 0]
+
+    def get_n_days(self, var_name, year, month):
+        """
+        :return: Number of days in the monthly file
+        :rtype: int
+        """
+        var_code, _ = AwapDailyDataReader.get_codes(var_name)
+        ncd_file = netcdf.netcdf_file(self.get_file_path(var_name, year, month))
+        try:
+            return ncd_file.variables[var_code].shape[0]
+        finally:
+            ncd_file.close()
+
+    def list_months(self, var_name):
+        """
+        :return: Sorted (year, month) pairs of all monthly files available for the given variable
+        :rtype: list
+        """
+        dir_name = os.path.dirname(self.get_file_path(var_name, 0, 0))
+        months = []
+        for filename in os.listdir(dir_name):
+            m = _MONTHLY_FILE_PATTERN.match(filename)
+            if m:
+                months.append((int(m.group(1)), int(m.group(2))))
+
+        return sorted(months)
+
+    @staticmethod
+    def _subset(data, bounds, idx_days):
+        """
+        Slice the given days and window out of the (days, lat, lon) data. A view is returned if
+        neither days nor window are given.
+        """
+        if bounds is None:
+            bounds = (0, data.shape[1], 0, data.shape[2])
+        idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max = bounds
+
+        if idx_days is None:
+            return data[:, idx_lat_min:idx_lat_max, idx_lon_min:idx_lon_max]
+        else:
+            return data[idx_days, idx_lat_min:idx_lat_max, idx_lon_min:idx_lon_max]
+
+    def read_one_file(self, var_name, year, month, bounds=None, idx_days=None):
+        """
+        Read data of one month with missing values replaced by NaN. Only the given days and
+        window are copied out of the memory-mapped file.
+
+        :param bounds: (idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max) of the window to read,
+            default to the whole grid
+        :type bounds: tuple
+        :param idx_days: sorted zero-based indices of the days to read, default to all days
+        :type idx_days: numpy.ndarray
+        :return: Data of shape (days, lat, lon)
+        :rtype: numpy.ndarray
+        """
+        var_code, _ = AwapDailyDataReader.get_codes(var_name)
+
+        if self.cache is not None:
+            # Whole months are cached so they can serve any other window or days, but a month is
+            # only decoded whole if the cache admits it, otherwise only the window is read
+            key = (var_code, int(year), int(month))
+            data = self.cache.get(key)
+            if data is None and self.cache.admits(key, self.get_month_nbytes(var_name, year, month)):
+                data = self._read_file(var_name, year, month, None, None)
+                data.flags.writeable = False  # cached data are shared by all callers
+                self.cache.put(key, data)
+            if data is not None:
+                return AwapDailyDataReader._subset(data, bounds, idx_days)
+
+        return self._read_file(var_name, year, month, bounds, idx_days)
+
+    def get_month_nbytes(self, var_name, year, month):
+        """
+        :return: Size in bytes of the decoded data of a whole monthly file
+        :rtype: int
+        """
+        return self.get_n_days(var_name, year, month) * self.lat.size * self.lon.size * np.dtype(np.float32).itemsize
+
+    def _read_file(self, var_name, year, month, bounds, idx_days):
+        var_code, _ = AwapDailyDataReader.get_codes(var_name)
+        file_path = self.get_file_path(var_name, year, month)
 
         if self.verbose:
             print 'reading netcdf file: %s' % file_path
-        ncd_file = netcdf.netcdf_file(file_path)
-        var = ncd_file.variables[var_code]
-        data = var.data.copy()
-        data[np.where(var.data == var.missing_value)] = np.NaN
-        var = None  # release handle of mmapped array, so file can be closed
-        ncd_file.close()
+        with profiling.stage('awap.read_file', variable=var_code, month=int(year) * 100 + int(month)) as record:
+            ncd_file = netcdf.netcdf_file(file_path)
+            var = ncd_file.variables[var_code]
+            data = AwapDailyDataReader._subset(var.data, bounds, idx_days)
+            if idx_days is None:
+                data = data.copy()
+            np.copyto(data, np.NaN, where=data == var.missing_value)
+            var = None  # release handle of mmapped array, so file can be closed
+            ncd_file.close()
+            record['files_opened'] = 1
+            record['bytes_read'] = data.nbytes
 
         return data
 
@@ -218,23 +611,224 @@ class AwapDailyDataReader(object):
         :return: Raw data as two-dimensional array, NOT Data2D or Data3D
         :rtype:
         """
+        return self.read_many(var_name, [adates], [mask])[0]
+
+    def read_many(self, var_name, adates_list, masks):
+        """
+        Read data of the same variable for multiple pairs of analog dates and masks. Each
+        monthly file is read only once and its data are scattered into every output that
+        needs it.
+
+        :param var_name:
+        :type var_name: str
+        :param adates_list: list of analog dates arrays
+        :type adates_list: list
+        :param masks: list of masks, one for each element of adates_list
+        :type masks: list
+        :return: List of raw data as two-dimensional arrays, NOT Data2D or Data3D
+        :rtype: list
+        """
+        rets = []
+        for adates, mask in zip(adates_list, masks):
+            ret = np.empty((adates.size, mask.idx_mask_flat.size), dtype=self.dtype)
+            ret[:] = np.NaN
+            rets.append(ret)
+
+        self.read_to(var_name, adates_list, masks, [ret.__setitem__ for ret in rets])
+
+        return rets
+
+    def read_to_cube(self, var_name, adates, mask, cube, missing_value=None):
+        """
+        Gather data straight into a preallocated cube over the bounding box of the mask, e.g. a
+        memory-mapped output variable, without building the two-dimensional data first. Cells
+        outside of the mask are left untouched.
+
+        :param cube: Array of shape (dates, lat, lon) over the bounding box of the mask
+        :type cube: numpy.ndarray
+        :param missing_value: Value to replace NaN with, default to keep NaN
+        :type missing_value: float
+        """
+        self.read_to_cubes(var_name, adates, [mask], [cube], missing_value)
+
+    def read_to_cubes(self, var_name, adates, masks, cubes, missing_value=None):
+        """
+        Gather data of the same analog dates into one preallocated cube for each of the given
+        masks. Each monthly file is read only once over the window enclosing all masks.
+        """
+        self.read_many_to_cubes(var_name, [adates] * len(masks), masks, cubes, missing_value)
 
-        date_components = CoD.calc_dates(adates)
+    def read_many_to_cubes(self, var_name, adates_list, masks, cubes, missing_value=None):
+        """
+        Gather data into one preallocated cube for each pair of analog dates and mask, e.g. of
+        the CoD files of a batch. Each monthly file is read only once over the window enclosing
+        all masks.
+        """
+        def get_scatter(mask, cube):
+            idx_lat_min, _, idx_lon_min, _ = mask.bounds
+            idx_lat = mask.idx_mask_2d[0] - idx_lat_min
+            idx_lon = mask.idx_mask_2d[1] - idx_lon_min
 
-        ret = np.empty((adates.size, mask.idx_mask_flat.size))
-        ret[:] = np.NaN
+            def scatter(idx_dates, values):
+                if missing_value is not None:
+                    np.copyto(values, missing_value, where=np.isnan(values))
+                cube[idx_dates[:, np.newaxis], idx_lat, idx_lon] = values
 
-        for yyyymm in sorted(set(date_components['yyyymm'])):
-            data = self.read_one_file(var_name, yyyymm / 100, yyyymm % 100)
-            data = data.reshape(data.shape[0], data.shape[1] * data.shape[2])
+            return scatter
 
-            idx_yyyymms = np.where(date_components['yyyymm'] == yyyymm)[0]
-            idx_days = date_components['dd'][idx_yyyymms] - 1
+        self.read_to(var_name, adates_list, masks, [get_scatter(mask, cube) for mask, cube in zip(masks, cubes)])
 
-            ret[idx_yyyymms, :] = data[idx_days, :][:, mask.idx_mask_flat]
+    def read_to(self, var_name, adates_list, masks, scatters):
+        """
+        Read data of the same variable for multiple pairs of analog dates and masks, and pass them
+        to the given scatter functions. Each monthly file is read only once.
 
-        return ret
+        :param scatters: One function for each element of adates_list, which is called as
+            scatter(idx_dates, values) with values as a (dates, grid points) array of the data of
+            the dates at idx_dates. Values of different months may be scattered concurrently.
+        :type scatters: list
+        """
+        date_components_list = [CoD.calc_dates(adates) for adates in adates_list]
+
+        # Only the window enclosing all masks is read from each monthly file
+        all_bounds = np.array([mask.bounds for mask in masks])
+        bounds = (all_bounds[:, 0].min(), all_bounds[:, 1].max(), all_bounds[:, 2].min(), all_bounds[:, 3].max())
+        idx_flats = [mask.idx_flat_within(bounds) for mask in masks]
+
+        store = self.get_packed_store(var_name)
+        if store is not None:
+            for adates, idx_flat, scatter in zip(adates_list, idx_flats, scatters):
+                for start in xrange(0, adates.size, _PACKED_BLOCK_SIZE):
+                    with profiling.stage('awap.read_packed', path=store.data_path, start=start) as record:
+                        data = store.read(adates[start:start + _PACKED_BLOCK_SIZE], bounds)
+                        record['bytes_read'] = data.nbytes
+                        scatter(np.arange(start, start + data.shape[0]),
+                                data.reshape(data.shape[0], -1)[:, idx_flat].astype(self.dtype, copy=False))
+            return
+
+        yyyymms = set()
+        for date_components in date_components_list:
+            yyyymms.update(date_components['yyyymm'])
+
+        def read_month(yyyymm):
+            idx_yyyymms_list = [np.where(date_components['yyyymm'] == yyyymm)[0]
+                                for date_components in date_components_list]
+            idx_days_list = [date_components['dd'][idx_yyyymms] - 1
+                             for date_components, idx_yyyymms in zip(date_components_list, idx_yyyymms_list)]
+            idx_days_needed = np.unique(np.concatenate(idx_days_list))
+
+            with profiling.stage('awap.month', variable=var_name, month=int(yyyymm), days=idx_days_needed.size):
+                data = self.read_one_file(var_name, yyyymm / 100, yyyymm % 100, bounds, idx_days_needed)
+                data = data.reshape(data.shape[0], data.shape[1] * data.shape[2])
+
+            # Every month goes to its own rows, so months can be scattered concurrently
+            for idx_yyyymms, idx_days, idx_flat, scatter in zip(idx_yyyymms_list, idx_days_list, idx_flats, scatters):
+                if idx_yyyymms.size == 0:
+                    continue
+                idx_rows = np.searchsorted(idx_days_needed, idx_days)
+                scatter(idx_yyyymms, data[np.ix_(idx_rows, idx_flat)].astype(self.dtype, copy=False))
+
+        self._map_months(read_month, yyyymms)
+
+    def _map_months(self, read_month, yyyymms):
+        """
+        Call read_month for each of the given months, concurrently if there are multiple workers.
+        """
+        if self.workers > 1:
+            pool = ThreadPool(self.workers)
+            try:
+                pool.map(read_month, sorted(yyyymms), chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for yyyymm in sorted(yyyymms):
+                read_month(yyyymm)
 
+    def read_points(self, var_name, adates_list, points):
+        """
+        Read the time series of multiple grid points, each for its own analog dates. Each monthly
+        file is opened only once and only the needed days of the points are read from it, so
+        points far apart do not cause the window between them to be read. The time-major store is
+        used if the variable has one.
+
+        :param adates_list: list of analog dates arrays
+        :type adates_list: list
+        :param points: list of (idx_lat, idx_lon), one for each element of adates_list, e.g. as
+            returned by get_point_index
+        :type points: list
+        :return: List of time series as one-dimensional arrays
+        :rtype: list
+        """
+        store = self.get_time_major_store(var_name)
+        if store is not None:
+            return [store.read_point(idx_lat, idx_lon, adates).astype(self.dtype, copy=False)
+                    for adates, (idx_lat, idx_lon) in zip(adates_list, points)]
+
+        rets = []
+        for adates in adates_list:
+            ret = np.empty(adates.size, dtype=self.dtype)
+            ret[:] = np.NaN
+            rets.append(ret)
+
+        idx_lats = np.array([idx_lat for idx_lat, _ in points], dtype=int)
+        idx_lons = np.array([idx_lon for _, idx_lon in points], dtype=int)
+        date_components_list = [CoD.calc_dates(adates) for adates in adates_list]
+
+        yyyymms = set()
+        for date_components in date_components_list:
+            yyyymms.update(date_components['yyyymm'])
+
+        def read_month(yyyymm):
+            idx_yyyymms_list = [np.where(date_components['yyyymm'] == yyyymm)[0]
+                                for date_components in date_components_list]
+            idx_days_list = [date_components['dd'][idx_yyyymms] - 1
+                             for date_components, idx_yyyymms in zip(date_components_list, idx_yyyymms_list)]
+            idx_days_needed = np.unique(np.concatenate(idx_days_list))
+
+            # Every point of the batch for every needed day, i.e. (days, points)
+            data = self.read_one_file_points(var_name, yyyymm / 100, yyyymm % 100, idx_lats, idx_lons,
+                                             idx_days_needed)
+
+            for i, (idx_yyyymms, idx_days) in enumerate(zip(idx_yyyymms_list, idx_days_list)):
+                if idx_yyyymms.size == 0:
+                    continue
+                rets[i][idx_yyyymms] = data[np.searchsorted(idx_days_needed, idx_days), i]
+
+        self._map_months(read_month, yyyymms)
+
+        return rets
+
+    def read_one_file_points(self, var_name, year, month, idx_lats, idx_lons, idx_days):
+        """
+        Read the given days of the given grid points of one month with missing values replaced by
+        NaN. Only the values of the points are copied out of the memory-mapped file.
+
+        :return: Data of shape (days, points)
+        :rtype: numpy.ndarray
+        """
+        var_code, _ = AwapDailyDataReader.get_codes(var_name)
+
+        # A few points are much faster to read from the file than a whole month is to decode, so
+        # the cache is only used if the month is already cached
+        key = (var_code, int(year), int(month))
+        if self.cache is not None and key in self.cache:
+            data = self.cache.get(key)
+            if data is not None:
+                return data[idx_days[:, np.newaxis], idx_lats, idx_lons]
 
+        file_path = self.get_file_path(var_name, year, month)
 
+        if self.verbose:
+            print 'reading netcdf file: %s' % file_path
+        with profiling.stage('awap.read_file', variable=var_code, month=int(year) * 100 + int(month)) as record:
+            ncd_file = netcdf.netcdf_file(file_path)
+            var = ncd_file.variables[var_code]
+            data = var.data[idx_days[:, np.newaxis], idx_lats, idx_lons]
+            np.copyto(data, np.NaN, where=data == var.missing_value)
+            var = None  # release handle of mmapped array, so file can be closed
+            ncd_file.close()
+            record['files_opened'] = 1
+            record['bytes_read'] = data.nbytes
 
+        return data
@@ -1,10 +1,14 @@
 import os
+import hashlib
+import threading
 from collections import namedtuple
 import logging
 
 import numpy as np
 from scipy.io import netcdf
 
+from . import profiling
+
 MaskBase = namedtuple('MaskBase', 'data, lat, lon')
 
 
@@ -13,14 +17,31 @@ class Mask(MaskBase):
         self = super(Mask, cls).__new__(cls, *args, **kwargs)
 
         # Additional initialization for the mask
-        self._idx_mask_2d = np.where(self.data != 0)
-        self._idx_mask_flat = np.ravel_multi_index(self._idx_mask_2d, self.data.shape)
-        lon = (self.lon[self._idx_mask_2d[1]] * 100).astype(long) * 10000
-        lat = (self.lat[self._idx_mask_2d[0]] * -100).astype(long)
-        self._gpnames = lon + lat
+        idx_mask_2d = np.where(self.data != 0)
+        lon = (self.lon[idx_mask_2d[1]] * 100).astype(long) * 10000
+        lat = (self.lat[idx_mask_2d[0]] * -100).astype(long)
+        self._set_indices(idx_mask_2d, lon + lat)
 
         return self
 
+    @classmethod
+    def from_indices(cls, data, lat, lon, idx_mask_2d, gpnames):
+        """
+        Create a mask from its precomputed 2D indices and gpnames, skipping the search of the
+        effective mask area over the whole grid.
+        """
+        self = MaskBase.__new__(cls, data, lat, lon)
+        self._set_indices(idx_mask_2d, gpnames)
+
+        return self
+
+    def _set_indices(self, idx_mask_2d, gpnames):
+        self._idx_mask_2d = idx_mask_2d
+        self._idx_mask_flat = np.ravel_multi_index(idx_mask_2d, self.data.shape)
+        self._gpnames = gpnames
+        self._bounds = None
+        self._cropped = None
+
     @property
     def idx_mask_2d(self):
         """
@@ -44,22 +65,56 @@ class Mask(MaskBase):
         """
         return self._gpnames
 
+    @property
+    def bounds(self):
+        """
+        Index bounds of the tightly enclosing rectangle of the effective mask area.
+        :return: (idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max), the max indices are exclusive
+        :rtype: tuple
+        """
+        if self._bounds is None:
+            self._bounds = (np.min(self.idx_mask_2d[0]), np.max(self.idx_mask_2d[0]) + 1,
+                            np.min(self.idx_mask_2d[1]), np.max(self.idx_mask_2d[1]) + 1)
+        return self._bounds
+
+    @property
+    def idx_cropped_flat(self):
+        """
+        The flat indices to the mask relative to its bounding box, i.e. the flat indices of the
+        cropped mask
+        """
+        return self.crop().idx_mask_flat
+
+    def idx_flat_within(self, bounds):
+        """
+        The flat indices to the mask relative to the given rectangle, which must enclose the
+        effective mask area.
+        :param bounds: (idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max) as returned by bounds
+        :type bounds: tuple
+        """
+        idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max = bounds
+        return np.ravel_multi_index((self.idx_mask_2d[0] - idx_lat_min, self.idx_mask_2d[1] - idx_lon_min),
+                                    (idx_lat_max - idx_lat_min, idx_lon_max - idx_lon_min))
+
     def crop(self):
         """
-        Crop the mask so that there is no effetive mask area is tightly bound.
+        Crop the mask so that there is no effetive mask area is tightly bound. The cropped mask
+        reuses the indices of this mask and is computed only once.
         :return:
         :rtype:
         """
-        idx_lat_min = np.min(self.idx_mask_2d[0])
-        idx_lat_max = np.max(self.idx_mask_2d[0]) + 1
-        idx_lon_min = np.min(self.idx_mask_2d[1])
-        idx_lon_max = np.max(self.idx_mask_2d[1]) + 1
+        if self._cropped is None:
+            idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max = self.bounds
+
+            lat_subsetted = self.lat[idx_lat_min: idx_lat_max]
+            lon_subsetted = self.lon[idx_lon_min: idx_lon_max]
+            data_subsetted = self.data[idx_lat_min: idx_lat_max, idx_lon_min: idx_lon_max]
 
-        lat_subsetted = self.lat[idx_lat_min: idx_lat_max]
-        lon_subsetted = self.lon[idx_lon_min: idx_lon_max]
-        data_subsetted = self.data[idx_lat_min: idx_lat_max, idx_lon_min: idx_lon_max]
+            self._cropped = Mask.from_indices(data_subsetted, lat_subsetted, lon_subsetted,
+                                              (self.idx_mask_2d[0] - idx_lat_min, self.idx_mask_2d[1] - idx_lon_min),
+                                              self.gpnames)
 
-        return Mask(data_subsetted, lat_subsetted, lon_subsetted)
+        return self._cropped
 
 
 class MaskReader(object):
@@ -69,14 +124,86 @@ class MaskReader(object):
     def read(self, region_name):
         file_path = os.path.join(self.base_dir, 'mask_%s.nc' % region_name)
         logging.debug('reading mask file: {}'.format(file_path))
-        ncd_file = netcdf.netcdf_file(file_path)
-
-        try:
-            mask = Mask(ncd_file.variables['mask'].data.copy(),
-                        ncd_file.variables['lat'].data.copy(),
-                        ncd_file.variables['lon'].data.copy())
-        finally:
-            ncd_file.close()
+        with profiling.stage('mask.read', region=region_name) as record:
+            ncd_file = netcdf.netcdf_file(file_path)
+
+            try:
+                mask = Mask(ncd_file.variables['mask'].data.copy(),
+                            ncd_file.variables['lat'].data.copy(),
+                            ncd_file.variables['lon'].data.copy())
+            finally:
+                ncd_file.close()
+            record['files_opened'] = 1
+            record['bytes_read'] = mask.data.nbytes + mask.lat.nbytes + mask.lon.nbytes
 
         return mask
 
+
+class MaskRegistry(MaskReader):
+    """
+    Reads each mask only once and keeps it, along with its precomputed indices, for the life of
+    the registry. If cache_dir is given, the indices, bounding box and gpnames of each mask are
+    also persisted there as a compact .npz file, which is used as long as the modification time
+    and size of the mask file are unchanged.
+    """
+
+    def __init__(self, base_dir=None, cache_dir=None):
+        super(MaskRegistry, self).__init__(base_dir)
+        self.cache_dir = cache_dir
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def regions(self):
+        """
+        Names of the regions read so far
+        """
+        return self._masks.keys()
+
+    def read(self, region_name):
+        with self._lock:
+            if region_name not in self._masks:
+                self._masks[region_name] = self._load(region_name)
+
+            return self._masks[region_name]
+
+    @staticmethod
+    def _get_cache_path(file_path, cache_dir):
+        # Keyed by the mask file, as a cache directory may be shared by different mask directories
+        return os.path.join(cache_dir, 'mask_%s.npz' % hashlib.md5(os.path.abspath(file_path)).hexdigest())
+
+    def _load(self, region_name):
+        if self.cache_dir is None:
+            return super(MaskRegistry, self).read(region_name)
+
+        file_path = os.path.join(self.base_dir, 'mask_%s.nc' % region_name)
+        cache_path = MaskRegistry._get_cache_path(file_path, self.cache_dir)
+        stat = os.stat(file_path)
+
+        if os.path.exists(cache_path):
+            with profiling.stage('mask.read_cache', region=region_name) as record, np.load(cache_path) as cached:
+                if cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                    logging.debug('reading cached mask: {}'.format(cache_path))
+                    idx_mask_2d = (cached['idx_lat'], cached['idx_lon'])
+                    data = np.zeros(tuple(cached['shape']), dtype=np.int8)
+                    data[idx_mask_2d] = 1
+                    mask = Mask.from_indices(data, cached['lat'], cached['lon'], idx_mask_2d, cached['gpnames'])
+                    mask._bounds = tuple(cached['bounds'])
+                    record['files_opened'] = 1
+                    record['bytes_read'] = os.path.getsize(cache_path)
+                    return mask
+
+        mask = super(MaskRegistry, self).read(region_name)
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Write to a temporary file first so that concurrent readers never see a partial cache
+        cache_path_tmp = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(cache_path_tmp, 'wb') as f:
+            np.savez(f, mtime=stat.st_mtime, size=stat.st_size, shape=mask.data.shape,
+                     lat=mask.lat, lon=mask.lon,
+                     idx_lat=mask.idx_mask_2d[0].astype(np.int32), idx_lon=mask.idx_mask_2d[1].astype(np.int32),
+                     bounds=mask.bounds, gpnames=mask.gpnames)
+        os.rename(cache_path_tmp, cache_path)
+
+        return mask
@@ -0,0 +1,198 @@
+"""
+Formats of the NetCDF files written by the extraction, i.e. uncompressed NetCDF classic via
+scipy.io.netcdf or chunked NetCDF4 with deflate compression via the optional netCDF4 module
+
+y.wang@bom.gov.au
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.io import netcdf
+
+from .ncrecords import RecordAppender
+
+NETCDF3 = 'netcdf3'
+NETCDF4 = 'netcdf4'
+FORMATS = (NETCDF3, NETCDF4)
+
+# Chunking presets of the data variable: time series access reads many dates of a few grid
+# points at a time, map access reads all grid points of a single date
+TIMESERIES = 'timeseries'
+MAP = 'map'
+CHUNKINGS = (TIMESERIES, MAP)
+
+# About 1 MB of float32 per time series chunk, i.e. 1024 dates of 16 x 16 or 256 grid points
+_TIMESERIES_CHUNK_DATES = 1024
+_TIMESERIES_CHUNK_POINTS = 256
+_TIMESERIES_CHUNK_SIDE = 16
+
+_HDF5_SIGNATURE = '\x89HDF'
+
+_OutputFormatBase = namedtuple('_OutputFormatBase', 'name, chunking, complevel, shuffle')
+
+
+def _import_netcdf4():
+    try:
+        import netCDF4
+    except ImportError:
+        raise ImportError('The netCDF4 module is required by the {} output format'.format(NETCDF4))
+    return netCDF4
+
+
+def parse_chunking(chunking):
+    """
+    Parse a chunking preset or a comma separated chunk shape, e.g. "365,10,10".
+
+    :rtype: str or tuple
+    """
+    if chunking in CHUNKINGS:
+        return chunking
+    try:
+        sizes = tuple(int(size) for size in chunking.split(','))
+    except ValueError:
+        raise ValueError('Chunking must be one of {} or a comma separated shape: {}'.format(CHUNKINGS, chunking))
+    if any(size < 1 for size in sizes):
+        raise ValueError('Chunk sizes must be positive: {}'.format(chunking))
+    return sizes
+
+
+class OutputFormat(_OutputFormatBase):
+    """
+    Format of the files written by save_nc of Data2D and Data3D. The files of either format have
+    the same dimensions, variables and attributes, only the data variable of a NetCDF4 file is
+    chunked and compressed.
+    """
+
+    def __new__(cls, name=NETCDF3, chunking=TIMESERIES, complevel=4, shuffle=True):
+        """
+
+        :param name: Either netcdf3 or netcdf4
+        :param chunking: Chunking preset of NetCDF4 files, timeseries or map, or the chunk shape
+        :type chunking: str or tuple
+        :param complevel: Deflate level from 1 to 9 of NetCDF4 files
+        :param shuffle: Whether to apply the HDF5 shuffle filter before deflate
+        """
+        if name not in FORMATS:
+            raise ValueError('Unknown output format {}, must be one of {}'.format(name, FORMATS))
+        if not isinstance(chunking, tuple) and chunking not in CHUNKINGS:
+            raise ValueError('Unknown chunking {}, must be one of {} or a chunk shape'.format(chunking, CHUNKINGS))
+        if not 1 <= complevel <= 9:
+            raise ValueError('Compression level must be from 1 to 9: {}'.format(complevel))
+
+        return super(OutputFormat, cls).__new__(cls, name, chunking, complevel, shuffle)
+
+    def get_chunk_sizes(self, shape):
+        """
+        Chunk sizes of a data variable of the given shape, with the dates as the first dimension.
+        The chunks of the other dimensions are capped at their sizes.
+
+        The dates chunk of the presets is also capped at the number of dates first written. A
+        file written in blocks, e.g. by extract_to_nc with max_memory, is created with its first
+        block, so every appended block then fills whole chunks of its own. Otherwise every append
+        would decompress, update and recompress the same partly filled chunks.
+
+        :type shape: tuple
+        :rtype: tuple
+        """
+        if isinstance(self.chunking, tuple):
+            if len(self.chunking) != len(shape):
+                raise ValueError('Chunk shape {} does not match the data of shape {}'.format(self.chunking, shape))
+            # The dates dimension is unlimited so an explicit chunk may exceed its current size
+            sizes = self.chunking
+            return tuple(sizes[:1]) + tuple(max(1, min(size, n)) for size, n in zip(sizes[1:], shape[1:]))
+        elif self.chunking == MAP:
+            sizes = (1,) + tuple(shape[1:])
+        elif len(shape) == 2:
+            sizes = (_TIMESERIES_CHUNK_DATES, _TIMESERIES_CHUNK_POINTS)
+        else:
+            sizes = (_TIMESERIES_CHUNK_DATES,) + (_TIMESERIES_CHUNK_SIDE,) * (len(shape) - 1)
+
+        return tuple(max(1, min(size, n)) for size, n in zip(sizes, shape))
+
+    def open(self, filename):
+        """
+        Create a file for writing, to be populated like a scipy.io.netcdf.netcdf_file.
+        """
+        if self.name == NETCDF3:
+            return netcdf.netcdf_file(filename, 'w')
+        else:
+            return _import_netcdf4().Dataset(filename, 'w', format='NETCDF4')
+
+    def create_data_variable(self, f, name, dimensions, shape, missing_value=None):
+        """
+        Create the float32 data variable, compressed and chunked for NetCDF4 files. The missing
+        value, if any, is set here as the fill value cannot be changed once a NetCDF4 variable
+        is created, and it is stored as float32 in NetCDF4 files as the netCDF4 module casts it
+        to the type of the variable.
+
+        :param f: File returned by open
+        :param shape: Shape of the data to be written
+        """
+        if self.name == NETCDF3:
+            var = f.createVariable(name, np.float32, dimensions)
+            if missing_value is not None:
+                var.missing_value = var._FillValue = missing_value
+        else:
+            var = f.createVariable(name, np.float32, dimensions,
+                                   zlib=True, complevel=self.complevel, shuffle=self.shuffle,
+                                   chunksizes=self.get_chunk_sizes(shape), fill_value=missing_value)
+            if missing_value is not None:
+                var.missing_value = np.float32(missing_value)
+        return var
+
+
+def is_netcdf4(filename):
+    """
+    Whether the file is a NetCDF4 (HDF5) file rather than NetCDF classic.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(_HDF5_SIGNATURE)) == _HDF5_SIGNATURE
+
+
+class NetCDF4Appender(object):
+    """
+    Appends records to an existing NetCDF4 file along its unlimited dimension, the counterpart
+    of ncrecords.RecordAppender for files written with the netcdf4 format.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        ncd_file = _import_netcdf4().Dataset(filename)
+        try:
+            self.dimension = [name for name, dim in ncd_file.dimensions.items() if dim.isunlimited()][0]
+            self._names = tuple(name for name, var in ncd_file.variables.items()
+                                if var.dimensions and var.dimensions[0] == self.dimension)
+        finally:
+            ncd_file.close()
+
+    @property
+    def names(self):
+        """
+        Names of the variables along the unlimited dimension
+        """
+        return self._names
+
+    def append(self, arrays):
+        """
+        Append records to the file.
+        :param arrays: Data of every record variable keyed by variable name, each with the
+            number of records to append as the first dimension
+        :type arrays: dict
+        """
+        ncd_file = _import_netcdf4().Dataset(self.filename, 'a')
+        try:
+            n_records = len(ncd_file.dimensions[self.dimension])
+            for name in self.names:
+                data = arrays[name]
+                ncd_file.variables[name][n_records:n_records + len(data)] = data
+        finally:
+            ncd_file.close()
+
+
+def open_appender(filename):
+    """
+    :return: Appender of records to a file written by save_nc in either format
+    :rtype: RecordAppender or NetCDF4Appender
+    """
+    return NetCDF4Appender(filename) if is_netcdf4(filename) else RecordAppender(filename)
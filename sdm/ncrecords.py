@@ -0,0 +1,114 @@
+"""
+Append records along the record (unlimited) dimension of NetCDF classic files
+
+y.wang@bom.gov.au
+"""
+import os
+
+import numpy as np
+from scipy.io import netcdf
+
+
+class RecordAppender(object):
+    """
+    Appends records to an existing NetCDF classic file, e.g. one written by scipy.io.netcdf,
+    without reading or rewriting the records already in the file. The record variables
+    must not need padding, i.e. their sizes per record are multiples of 4 bytes.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        ncd_file = netcdf.netcdf_file(filename)
+        try:
+            self.numrecs = ncd_file._recs
+            self.recsize = ncd_file._recsize
+            names = []
+            formats = []
+            for name, var in ncd_file.variables.items():
+                if var.isrec:
+                    names.append(name)
+                    formats.append((var.data.dtype.str, var.shape[1:]))
+            var = None  # release handle of mmapped array, so file can be closed
+        finally:
+            ncd_file.close()
+
+        self.dtype = np.dtype({'names': names, 'formats': formats})
+        if self.dtype.itemsize != self.recsize:
+            raise ValueError('Padded record variables are not supported: {}'.format(filename))
+
+        # The record data are always at the end of a NetCDF classic file
+        self.begin = os.path.getsize(filename) - self.numrecs * self.recsize
+
+    @property
+    def names(self):
+        """
+        Names of the record variables in the order they are stored in each record
+        """
+        return self.dtype.names
+
+    def append(self, arrays):
+        """
+        Append records to the file.
+        :param arrays: Data of every record variable keyed by variable name, each with the
+            number of records to append as the first dimension
+        :type arrays: dict
+        """
+        n_records = len(arrays[self.names[0]])
+        records = np.empty(n_records, dtype=self.dtype)
+        for name in self.names:
+            records[name] = arrays[name]
+
+        with open(self.filename, 'r+b') as f:
+            f.seek(self.begin + self.numrecs * self.recsize)
+            records.tofile(f)
+            self.numrecs += n_records
+            self._write_numrecs(f)
+
+    def extend(self, n_records):
+        """
+        Grow the file by the given number of records without writing their data, which are left
+        to be filled in via memmap().
+        """
+        with open(self.filename, 'r+b') as f:
+            self.numrecs += n_records
+            f.truncate(self.begin + self.numrecs * self.recsize)
+            self._write_numrecs(f)
+
+    def memmap(self):
+        """
+        Memory-map all records of the file for reading and writing.
+        :return: Structured array of the records with one field for each record variable
+        :rtype: numpy.memmap
+        """
+        return np.memmap(self.filename, dtype=self.dtype, mode='r+', offset=self.begin, shape=(self.numrecs,))
+
+    def _write_numrecs(self, f):
+        f.seek(4)  # right after the magic number and version byte
+        f.write(np.array(self.numrecs, dtype='>i4').tostring())
+
+
+class MappedRecordVariable(object):
+    """
+    A record variable of a file that is written via assignment, e.g. var[idx_records, ...] = values,
+    through a memory map held only for the duration of each assignment. The pages written thus
+    do not stay in the memory of the process, however many records are written in total.
+    """
+
+    def __init__(self, appender, name):
+        """
+
+        :param appender: Appender of the file
+        :type appender: RecordAppender
+        :param name: Name of the record variable
+        """
+        self.appender = appender
+        self.name = name
+
+    def __setitem__(self, key, value):
+        records = self.appender.memmap()
+        try:
+            records[self.name][key] = value
+            records.flush()
+        finally:
+            records = None
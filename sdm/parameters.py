@@ -49,6 +49,9 @@ class MainParameters(_MainParametersBase):
                             self.predictand,
                             'season_{}'.format(self.season))
 
+    def get_cod_file(self):
+        return os.path.join(self.get_dirout(), 'rawfield_analog_{}'.format(self.season))
+
     def get_ds_file(self):
         return os.path.join(self.get_dirout(), 'ds_grid_data_{}.nc'.format(self.season))
 
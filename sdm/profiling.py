@@ -0,0 +1,124 @@
+"""
+Lightweight instrumentation of the stages of an extraction
+
+Stages, e.g. parsing a CoD file or reading an AWAP month, report their wall time, bytes read,
+files opened and the peak RSS of the process so far to the registered callbacks. Nothing is
+measured when no callback is registered.
+
+y.wang@bom.gov.au
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_callbacks = []
+_lock = threading.Lock()
+
+
+def add_callback(callback):
+    """
+    Register a function to be called with the record of every finished stage. A record is a dict
+    with the stage name as "stage", "seconds", "files_opened", "bytes_read", "peak_rss_bytes" and
+    any stage specific members, e.g. "month". Callbacks may be called from multiple threads.
+    """
+    with _lock:
+        _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    with _lock:
+        _callbacks.remove(callback)
+
+
+def get_peak_rss():
+    """
+    :return: Peak resident set size in bytes of the process, None if unknown
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Instrument a stage. The yielded record can be updated by the stage, e.g. with its
+    "bytes_read" and "files_opened".
+    """
+    if not _callbacks:
+        yield {}
+        return
+
+    record = {'stage': name, 'files_opened': 0, 'bytes_read': 0}
+    record.update(info)
+    start = time.time()
+    yield record
+    record['seconds'] = time.time() - start
+    record['peak_rss_bytes'] = get_peak_rss()
+
+    for callback in list(_callbacks):
+        callback(record)
+
+
+class Profiler(object):
+    """
+    Collects the records of all stages while registered, e.g.
+
+        with Profiler() as profiler:
+            gridded_extractor.extract(main_parameters)
+        profiler.save('profile.json')
+    """
+
+    def __init__(self):
+        self.records = []
+        self.start = None
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start = time.time()
+        add_callback(self.callback)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        remove_callback(self.callback)
+        self.seconds = time.time() - self.start
+
+    def callback(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self):
+        """
+        :return: Totals of the records of each stage name
+        :rtype: dict
+        """
+        summary = {}
+        for record in self.records:
+            total = summary.setdefault(record['stage'], {'count': 0, 'seconds': 0.0, 'files_opened': 0,
+                                                         'bytes_read': 0, 'peak_rss_bytes': None})
+            total['count'] += 1
+            total['seconds'] += record['seconds']
+            total['files_opened'] += record['files_opened']
+            total['bytes_read'] += record['bytes_read']
+            total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record['peak_rss_bytes'])
+
+        return summary
+
+    def save(self, filename):
+        """
+        Save the summary and all records as JSON.
+        """
+        with open(filename, 'w') as f:
+            json.dump({'seconds': self.seconds,
+                       'peak_rss_bytes': get_peak_rss(),
+                       'summary': self.summary(),
+                       'stages': self.records}, f, indent=2, sort_keys=True)
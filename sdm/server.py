@@ -0,0 +1,267 @@
+"""
+Long-running extraction server that keeps masks, parsed CoD files and decoded AWAP months
+cached across requests
+
+Requests are JSON objects POSTed to the path of a command, e.g. /dxt-gridded, and responses are
+JSON objects, with an "error" member and a 4xx/5xx status if the request fails. Requests are not
+authenticated, so the server listens on a Unix socket that only its user can connect to by
+default, and only writes files within its output directory.
+
+y.wang@bom.gov.au
+"""
+import os
+import sys
+import json
+import socket
+import logging
+import SocketServer
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from .cod import CoD
+from .gridded import convert_to_3d_nc
+from .ncformat import NETCDF3, TIMESERIES, OutputFormat, parse_chunking
+from .parameters import MainParameters
+
+
+_FAST_EXTRACT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fast_extract')
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.sdm.sock')
+
+
+def _import_sdm_extract():
+    """
+    Import fast_extract/sdm_extract.py of the checkout, which is not part of the sdm package.
+    """
+    if _FAST_EXTRACT_DIR not in sys.path:
+        sys.path.append(_FAST_EXTRACT_DIR)
+    try:
+        import sdm_extract
+    except ImportError as e:
+        raise ImportError('The /point command requires {}: {}'.format(_FAST_EXTRACT_DIR, e))
+    return sdm_extract
+
+
+class ExtractionService(object):
+    """
+    The commands of the server. All requests share the same extractor and hence its caches.
+    """
+
+    def __init__(self, gridded_extractor, output_dir):
+        """
+
+        :param gridded_extractor:
+        :type gridded_extractor: extractor.GriddedExtractor
+        :param output_dir: Directory that all output files are written within
+        :type output_dir: str
+        """
+        self.gridded_extractor = gridded_extractor
+        self.output_dir = os.path.realpath(output_dir)
+        self.commands = {
+            'cod-getpath': self.cod_getpath,
+            'dxt-gridded': self.dxt_gridded,
+            'to-3d': self.to_3d,
+            'point': self.point,
+            'status': self.status,
+        }
+
+    @staticmethod
+    def get_main_parameters(request):
+        if 'cod_file_path' in request:
+            return MainParameters.from_filepath(request['cod_file_path'])
+        else:
+            return MainParameters(request['model'], request.get('scenario'), request['region_type'],
+                                  request['season'], request['predictand'])
+
+    @staticmethod
+    def get_output_format(request):
+        """
+        The output format of the optional format, chunking and complevel members, see sdmrun.py.
+        """
+        chunking = request.get('chunking', TIMESERIES)
+        chunking = tuple(chunking) if isinstance(chunking, list) else parse_chunking(chunking)
+        return OutputFormat(request.get('format', NETCDF3), chunking, request.get('complevel', 4))
+
+    def get_output_path(self, file_path):
+        """
+        The real path of an output file, relative to the output directory if not absolute.
+
+        :raise ValueError: If the file is not within the output directory
+        """
+        if isinstance(file_path, (list, tuple)):
+            return [self.get_output_path(p) for p in file_path]
+
+        real_path = os.path.realpath(os.path.join(self.output_dir, file_path))
+        if not real_path.startswith(os.path.join(self.output_dir, '')):
+            raise ValueError('Output file {} is not within the output directory {}'.format(file_path,
+                                                                                          self.output_dir))
+        return real_path
+
+    def cod_getpath(self, request):
+        main_parameters = ExtractionService.get_main_parameters(request)
+        return {'cod_file_path': self.gridded_extractor.cod_manager.get_cod_file_path(main_parameters)}
+
+    def dxt_gridded(self, request):
+        """
+        Extract gridded data with either cod_file_path or model, scenario, region_type, season and
+        predictand. The output_file and region members are either single names or lists of the
+        same length for a multi-region extraction.
+        """
+        main_parameters = ExtractionService.get_main_parameters(request)
+        output_format = ExtractionService.get_output_format(request)
+        output_file = self.get_output_path(request['output_file'])
+        kwargs = dict(start=request.get('start'), end=request.get('end'), months=request.get('months'))
+
+        if request.get('direct'):
+            if output_format.name != NETCDF3:
+                raise ValueError('Direct extraction only supports the {} format'.format(NETCDF3))
+            if request.get('max_memory') is not None:
+                raise ValueError('Direct extraction does not support max_memory')
+            self.gridded_extractor.extract_cube_to_nc(output_file, main_parameters, request.get('region'), **kwargs)
+        else:
+            self.gridded_extractor.extract_to_nc(output_file, main_parameters, request.get('region'),
+                                                 max_memory=request.get('max_memory'), output_format=output_format,
+                                                 **kwargs)
+
+        return {'output_file': output_file}
+
+    def to_3d(self, request):
+        main_parameters = MainParameters.from_filepath(request['data2d_file'])
+        data3d_file = self.get_output_path(request['data3d_file'])
+        mask = self.gridded_extractor.mask_reader.read(request.get('region') or main_parameters.region_type)
+        convert_to_3d_nc(request['data2d_file'], data3d_file, mask, main_parameters,
+                         request.get('block_size', 1000), ExtractionService.get_output_format(request))
+
+        return {'data3d_file': data3d_file}
+
+    def point(self, request):
+        """
+        The projected time series or histogram of the grid point nearest to the given latitude
+        and longitude, built by build_output of fast_extract/sdm_extract.py so that the output
+        is the same as that of the script.
+        """
+        sdm_extract = _import_sdm_extract()
+        awap_reader = self.gridded_extractor.awap_reader
+        cod_dates = self.gridded_extractor.cod_manager.read_file(request['cod_file'])
+        point = awap_reader.get_point_index(request['latitude'], request['longitude'])
+        timeseries = awap_reader.read_points(request['variable'], [cod_dates['adates']], [point])[0]
+
+        base_dates = CoD.to_datetime64(cod_dates['rdates']).astype('datetime64[us]').tolist()
+        return sdm_extract.build_output(base_dates, np.ma.masked_invalid(timeseries), request['variable'],
+                                        request.get('output_type', 'timeseries'), request.get('bins', 10))
+
+    def status(self, request):
+        return {'pid': os.getpid(),
+                'masks': sorted(self.gridded_extractor.mask_reader.regions),
+                'awap_cache': self.gridded_extractor.awap_reader.cache_info()}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.handle_command({})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))) or '{}')
+        except ValueError as e:
+            self.send_json(400, {'error': 'Invalid JSON request: {}'.format(e)})
+            return
+        self.handle_command(request)
+
+    def handle_command(self, request):
+        command = self.server.service.commands.get(self.path.strip('/'))
+        if command is None:
+            self.send_json(404, {'error': 'Unknown command: {}'.format(self.path)})
+            return
+
+        try:
+            response = command(request)
+        except (KeyError, ValueError, TypeError) as e:
+            logging.exception('bad request to {}'.format(self.path))
+            self.send_json(400, {'error': '{}: {}'.format(type(e).__name__, e)})
+        except Exception as e:
+            logging.exception('failed request to {}'.format(self.path))
+            self.send_json(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+        else:
+            self.send_json(200, response)
+
+    def send_json(self, code, response):
+        content = json.dumps(response)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.info('%s - %s' % (self.address_string(), format % args))
+
+
+class _PooledServerMixIn:
+    """
+    Handle requests concurrently in a fixed pool of worker threads.
+    """
+
+    def process_request(self, request, client_address):
+        self.pool.apply_async(self.process_request_thread, (request, client_address))
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _HTTPServer(_PooledServerMixIn, HTTPServer):
+    pass
+
+
+class _UnixHTTPServer(_PooledServerMixIn, SocketServer.UnixStreamServer):
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        # Only the user of the server may connect to the socket
+        umask = os.umask(0o177)
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        self.server_name = socket.gethostname()
+        self.server_port = 0
+
+
+def make_server(gridded_extractor, output_dir, socket_path=None, port=None, workers=4):
+    """
+    Create a server listening on the given Unix socket, default to DEFAULT_SOCKET_PATH, which only
+    the user of the server may connect to, or on the given port of localhost if a port is given,
+    which any local user may connect to. Call serve_forever of the returned server to serve
+    requests.
+
+    :param gridded_extractor:
+    :type gridded_extractor: extractor.GriddedExtractor
+    :param output_dir: Directory that all output files are written within
+    :type output_dir: str
+    :param workers: Number of requests handled concurrently
+    :type workers: int
+    """
+    if not os.path.isdir(output_dir):
+        raise ValueError('Output directory {} does not exist'.format(output_dir))
+
+    if port is not None:
+        server = _HTTPServer(('127.0.0.1', port), _RequestHandler)
+    else:
+        server = _UnixHTTPServer(socket_path or DEFAULT_SOCKET_PATH, _RequestHandler)
+    server.service = ExtractionService(gridded_extractor, output_dir)
+    server.pool = ThreadPool(workers)
+
+    return server
@@ -0,0 +1,261 @@
+"""
+Per-gridpoint statistics accumulated from the AWAP data as they are gathered, so that summaries
+of large regions need memory proportional to the grid rather than to the time series
+
+y.wang@bom.gov.au
+"""
+import threading
+
+import numpy as np
+from scipy.io import netcdf
+
+from .gridded import MISSING_VALUE
+
+# Bins (start, stop, number of bins) of the histograms of each predictand, i.e. bins of 5 mm
+# and 2 K, which keep the histograms of large regions small
+DEFAULT_BINS = {
+    'rain': (0.0, 250.0, 50),
+    'tmax': (220.0, 340.0, 60),
+    'tmin': (220.0, 340.0, 60),
+}
+
+# Temperatures below this are anomalous (in Kelvin) and skipped, as in fast_extract
+MIN_VALID_TEMPERATURE = 100.0
+
+DEFAULT_QUANTILES = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95)
+
+# Days of at least this amount of rain in mm are wet days
+DEFAULT_WET_DAY_THRESHOLD = 1.0
+
+
+class GridpointStatistics(object):
+    """
+    Running statistics of each grid point of a mask: the number of valid values, mean, variance,
+    minimum, maximum, number of wet days (values at or above a threshold) and a fixed-bin
+    histogram, from which the quantiles are approximated. Missing values (NaN) and values below
+    valid_min, if given, are skipped.
+
+    Values outside of the bins are counted in the first or the last bin. The quantiles are
+    interpolated linearly within the bins and bounded by the minimum and maximum, so they are
+    accurate to the bin width.
+    """
+
+    def __init__(self, n_points, bins, wet_day_threshold=None, valid_min=None):
+        """
+
+        :param n_points: Number of grid points
+        :type n_points: int
+        :param bins: Edges of the bins of the histograms in increasing order
+        :type bins: numpy.ndarray
+        :param wet_day_threshold: Threshold of wet days, default to not counting wet days
+        :type wet_day_threshold: float
+        :param valid_min: Values below this are skipped, default to skip only missing values
+        :type valid_min: float
+        """
+        self.bins = np.asarray(bins, dtype=np.float64)
+        if self.bins.ndim != 1 or self.bins.size < 2 or np.any(np.diff(self.bins) <= 0):
+            raise ValueError('Bins must be at least 2 edges in increasing order: {}'.format(bins))
+        self.wet_day_threshold = wet_day_threshold
+        self.valid_min = valid_min
+
+        self.count = np.zeros(n_points, dtype=np.int64)
+        self.mean = np.zeros(n_points, dtype=np.float64)
+        self.m2 = np.zeros(n_points, dtype=np.float64)
+        self.minimum = np.empty(n_points, dtype=np.float64)
+        self.minimum[:] = np.inf
+        self.maximum = np.empty(n_points, dtype=np.float64)
+        self.maximum[:] = -np.inf
+        self.wet_days = np.zeros(n_points, dtype=np.int64) if wet_day_threshold is not None else None
+        # The histograms are by far the largest of the statistics, so their counts are int32
+        self.histogram = np.zeros((self.bins.size - 1, n_points), dtype=np.int32)
+        self._lock = threading.Lock()
+
+    @property
+    def n_points(self):
+        return self.count.size
+
+    def update(self, values):
+        """
+        Accumulate a block of values. The moments of the block are computed before the lock is
+        taken, so blocks of different months can be accumulated concurrently. The histograms
+        are updated in place one date at a time, so no copy of them is ever made.
+
+        :param values: Values of shape (dates, grid points) with NaN as missing values
+        :type values: numpy.ndarray
+        """
+        if values.shape[0] == 0:
+            return
+        valid = ~np.isnan(values)
+        if self.valid_min is not None:
+            with np.errstate(invalid='ignore'):
+                valid &= values >= self.valid_min
+        n = valid.sum(axis=0)
+        values = np.where(valid, values, 0.0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, values.sum(axis=0) / n, 0.0)
+        m2 = (np.where(valid, values - mean, 0.0) ** 2).sum(axis=0)
+        minimum = np.where(valid, values, np.inf).min(axis=0)
+        maximum = np.where(valid, values, -np.inf).max(axis=0)
+        if self.wet_day_threshold is not None:
+            wet_days = (valid & (values >= self.wet_day_threshold)).sum(axis=0)
+
+        # Indices into the flattened histograms, unique within each date as each is of one grid point
+        idx_bins = np.clip(np.searchsorted(self.bins, values, side='right') - 1, 0, self.bins.size - 2)
+        idx_flat = idx_bins * self.n_points + np.arange(self.n_points)
+
+        with self._lock:
+            # Merge the moments of the block with the running ones (Chan et al.)
+            total = self.count + n
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight = np.where(total > 0, n.astype(np.float64) / total, 0.0)
+            delta = mean - self.mean
+            self.mean += delta * weight
+            self.m2 += m2 + delta ** 2 * self.count * weight
+            self.count = total
+            np.minimum(self.minimum, minimum, out=self.minimum)
+            np.maximum(self.maximum, maximum, out=self.maximum)
+            if self.wet_day_threshold is not None:
+                self.wet_days += wet_days
+            histogram = self.histogram.reshape(-1)
+            for idx_flat_date, valid_date in zip(idx_flat, valid):
+                histogram[idx_flat_date[valid_date]] += 1
+
+    def scatter(self, idx_dates, values):
+        """
+        Accumulate values in the form of the scatter functions of AwapDailyDataReader.read_to.
+        The statistics are independent of the order of the dates.
+        """
+        self.update(values)
+
+    def get_variance(self):
+        """
+        :return: Sample variance of each grid point, NaN for less than 2 values
+        :rtype: numpy.ndarray
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.NaN)
+
+    def get_quantiles(self, probabilities):
+        """
+        Approximate quantiles of each grid point from the histograms.
+
+        :param probabilities: Probabilities from 0 to 1 of the quantiles
+        :type probabilities: list
+        :return: Quantiles of shape (probabilities, grid points), NaN for grid points of no values
+        :rtype: numpy.ndarray
+        """
+        cumulative = np.cumsum(self.histogram, axis=0, dtype=np.int32)
+        idx_points = np.arange(self.n_points)
+        quantiles = np.empty((len(probabilities), self.n_points), dtype=np.float64)
+        for i, probability in enumerate(probabilities):
+            target = probability * self.count
+            # The first bin whose cumulative count reaches the target
+            idx_bins = np.minimum((cumulative < target).sum(axis=0), self.bins.size - 2)
+            below = np.where(idx_bins > 0, cumulative[idx_bins - 1, idx_points], 0)
+            in_bin = self.histogram[idx_bins, idx_points]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fraction = np.where(in_bin > 0, (target - below) / in_bin, 0.0)
+            quantiles[i] = self.bins[idx_bins] + np.clip(fraction, 0.0, 1.0) * np.diff(self.bins)[idx_bins]
+
+        quantiles = np.clip(quantiles, self.minimum, self.maximum)
+        quantiles[:, self.count == 0] = np.NaN
+        return quantiles
+
+    def save_nc(self, filename, mask, quantiles=DEFAULT_QUANTILES, varname='unknown', main_parameters=None,
+                histogram=True):
+        """
+        Save the statistics as maps over the given mask, in the same layout of latitude and
+        longitude as Data3D.save_nc, with missing values outside of the mask.
+
+        :param mask: Cropped mask of the grid points
+        :type mask: mask.Mask
+        :param quantiles: Probabilities of the quantiles to save
+        :param histogram: Whether to save the histograms, which are by far the largest variable
+        :type histogram: bool
+        """
+        import datetime
+
+        def to_maps(values, dtype=np.float32, missing_value=MISSING_VALUE):
+            values = np.atleast_2d(values)
+            maps = np.empty((values.shape[0], mask.data.size), dtype=dtype)
+            maps[:] = missing_value
+            maps[:, mask.idx_mask_flat] = np.where(np.isnan(values), missing_value, values)
+            return maps.reshape((values.shape[0],) + mask.data.shape)
+
+        if main_parameters:
+            predictand = main_parameters.get_var_code()
+        else:
+            predictand = varname
+        units = 'mm' if predictand in ('rr', 'rain') else 'K'
+
+        f = netcdf.netcdf_file(filename, 'w')
+        try:
+            f.title = 'Daily gridded climate statistics'
+            if main_parameters:
+                f.title = '{} ({})'.format(f.title, main_parameters)
+            f.institution = 'Bureau of Meteorology'
+            f.source = 'Statistical Downscaling Model'
+            f.history = 'Generated on %s' % datetime.date.today()
+
+            f.createDimension('lat', mask.lat.size)
+            var_lat = f.createVariable('lat', float, ('lat',))
+            var_lat[:] = mask.lat
+            var_lat.units = 'degrees_north'
+            var_lat.long_name = 'latitude'
+            var_lat.standard_name = 'latitude'
+
+            f.createDimension('lon', mask.lon.size)
+            var_lon = f.createVariable('lon', float, ('lon',))
+            var_lon[:] = mask.lon
+            var_lon.units = 'degrees_east'
+            var_lon.long_name = 'longitude'
+            var_lon.standard_name = 'longitude'
+
+            if histogram:
+                f.createDimension('bin', self.bins.size - 1)
+                f.createDimension('nv', 2)
+                var_bin_bounds = f.createVariable('bin_bounds', float, ('bin', 'nv'))
+                var_bin_bounds[:, :] = np.column_stack((self.bins[:-1], self.bins[1:]))
+                var_bin_bounds.units = units
+                var_bin_bounds.long_name = 'bounds of the histogram bins'
+
+            f.createDimension('quantile', len(quantiles))
+            var_quantile = f.createVariable('quantile', float, ('quantile',))
+            var_quantile[:] = quantiles
+            var_quantile.long_name = 'probability of the quantile'
+
+            var_count = f.createVariable('count', np.int32, ('lat', 'lon'))
+            var_count[:, :] = to_maps(self.count, np.int32, 0)[0]
+            var_count.long_name = 'number of valid days'
+
+            float_stats = [('mean', self.mean, 'mean'),
+                           ('std', np.sqrt(self.get_variance()), 'standard deviation'),
+                           ('min', self.minimum, 'minimum'),
+                           ('max', self.maximum, 'maximum')]
+            for name, values, long_name in float_stats:
+                var = f.createVariable('{}_{}'.format(predictand, name), np.float32, ('lat', 'lon'))
+                var[:, :] = to_maps(np.where(self.count > 0, values, np.NaN))[0]
+                var.units = units
+                var.long_name = '{} of {}'.format(long_name, main_parameters.predictand if main_parameters
+                                                  else predictand)
+                var.missing_value = var._FillValue = MISSING_VALUE
+
+            var_quantiles = f.createVariable('{}_quantiles'.format(predictand), np.float32,
+                                             ('quantile', 'lat', 'lon'))
+            var_quantiles[:, :, :] = to_maps(self.get_quantiles(quantiles))
+            var_quantiles.units = units
+            var_quantiles.long_name = 'approximate quantiles from the histogram'
+            var_quantiles.missing_value = var_quantiles._FillValue = MISSING_VALUE
+
+            if histogram:
+                var_histogram = f.createVariable('{}_histogram'.format(predictand), np.int32, ('bin', 'lat', 'lon'))
+                var_histogram[:, :, :] = to_maps(self.histogram, np.int32, 0)
+                var_histogram.long_name = 'number of days within each bin'
+
+            if self.wet_day_threshold is not None:
+                var_wet_days = f.createVariable('wet_days', np.int32, ('lat', 'lon'))
+                var_wet_days[:, :] = to_maps(self.wet_days, np.int32, 0)[0]
+                var_wet_days.long_name = 'number of days of at least {} {}'.format(self.wet_day_threshold, units)
+
+        finally:
+            f.close()
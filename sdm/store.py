@@ -0,0 +1,208 @@
+"""
+Packed stores of the AWAP daily dataset
+
+y.wang@bom.gov.au
+"""
+import os
+import logging
+
+import numpy as np
+
+# Memory budget of transposing the monthly files into a time-major store
+DEFAULT_PACK_MEMORY = 1024 ** 3
+
+
+class _NpyStore(object):
+    """
+    A memory-mapped .npy array of AWAP daily data along with the CoD dates ([Y]YYMMDD) of its days.
+    """
+    suffix = None
+
+    def __init__(self, base_dir, file_code):
+        self.base_dir = base_dir
+        self.file_code = file_code
+        self.data_path = os.path.join(base_dir, '%s_%s.npy' % (file_code, self.suffix))
+        self.dates_path = os.path.join(base_dir, '%s_%s.dates.npy' % (file_code, self.suffix))
+        self._data = None
+        self._dates = None
+
+    def exists(self):
+        return os.path.exists(self.data_path) and os.path.exists(self.dates_path)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(self.data_path, mmap_mode='r')
+        return self._data
+
+    @property
+    def dates(self):
+        if self._dates is None:
+            self._dates = np.load(self.dates_path)
+        return self._dates
+
+    def get_rows(self, cod_dates):
+        """
+        :return: The indices of the given CoD dates along the days dimension
+        :rtype: numpy.ndarray
+        """
+        rows = np.minimum(np.searchsorted(self.dates, cod_dates), self.dates.size - 1)
+        idx_missing = np.where(self.dates[rows] != cod_dates)[0]
+        if idx_missing.size > 0:
+            raise ValueError('Dates not found in packed store {}: {}'.format(self.data_path,
+                                                                             cod_dates[idx_missing[:10]]))
+        return rows
+
+    @staticmethod
+    def _get_dates(awap_reader, var_name, months):
+        """
+        :return: The number of days of each month and the CoD dates of all days of the months
+        :rtype: tuple
+        """
+        n_days_list = [awap_reader.get_n_days(var_name, year, month) for year, month in months]
+        dates = np.concatenate([year * 10000 + month * 100 + np.arange(1, n_days + 1) - 19000000
+                                for (year, month), n_days in zip(months, n_days_list)])
+        return n_days_list, dates.astype(np.int32)
+
+    def _save(self, data_path_tmp, dates):
+        """
+        Save the dates and move the temporarily written data in place, so that a partially packed
+        store is never used.
+        """
+        dates_path_tmp = self.dates_path + '.tmp'
+        with open(dates_path_tmp, 'wb') as f:
+            np.save(f, dates)
+
+        os.rename(data_path_tmp, self.data_path)
+        os.rename(dates_path_tmp, self.dates_path)
+        self._data = None
+        self._dates = None
+
+
+class PackedAwapStore(_NpyStore):
+    """
+    Daily data of an AWAP variable packed into a single memory-mapped float32 array of shape
+    (days, lat, lon) with missing values as NaN.
+    """
+    suffix = 'daily'
+
+    def read_day(self, cod_date, bounds=None):
+        """
+        Zero-copy view of the data of one day.
+        """
+        idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max = bounds or (None, None, None, None)
+        return self.data[self.get_rows(np.array([cod_date]))[0],
+                         idx_lat_min:idx_lat_max,
+                         idx_lon_min:idx_lon_max]
+
+    def read(self, cod_dates, bounds=None):
+        """
+        Read the data of the given CoD dates. Only the rows and window needed are copied out of
+        the memory-mapped store.
+
+        :param bounds: (idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max) of the window to read,
+            default to the whole grid
+        :type bounds: tuple
+        :return: Data of shape (dates, lat, lon)
+        :rtype: numpy.ndarray
+        """
+        idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max = bounds or (None, None, None, None)
+        return self.data[self.get_rows(cod_dates),
+                         idx_lat_min:idx_lat_max,
+                         idx_lon_min:idx_lon_max]
+
+    def pack(self, awap_reader, var_name, months=None):
+        """
+        Pack the monthly files of the given variable into this store.
+
+        :param awap_reader:
+        :type awap_reader: gridded.AwapDailyDataReader
+        :param months: (year, month) pairs to pack, default to all available monthly files
+        :type months: list
+        """
+        months = months or awap_reader.list_months(var_name)
+        n_days_list, dates = _NpyStore._get_dates(awap_reader, var_name, months)
+
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir)
+
+        data_path_tmp = self.data_path + '.tmp'
+        data = np.lib.format.open_memmap(data_path_tmp, mode='w+', dtype=np.float32,
+                                         shape=(dates.size, awap_reader.lat.size, awap_reader.lon.size))
+        row = 0
+        for (year, month), n_days in zip(months, n_days_list):
+            logging.debug('packing {:04d}{:02d} of {}'.format(year, month, var_name))
+            data[row:row + n_days] = awap_reader.read_one_file(var_name, year, month)
+            row += n_days
+        data.flush()
+        data = None
+
+        self._save(data_path_tmp, dates)
+
+
+class TimeMajorAwapStore(_NpyStore):
+    """
+    Daily data of an AWAP variable in a single memory-mapped float32 array of shape
+    (lat, lon, days) with missing values as NaN, i.e. the whole daily history of each pixel is
+    contiguous for fast point time series queries.
+    """
+    suffix = 'daily_tm'
+
+    def read_point(self, idx_lat, idx_lon, cod_dates=None):
+        """
+        Read the time series of one pixel.
+
+        :param cod_dates: CoD dates to read, default to all days in the store
+        :type cod_dates: numpy.ndarray
+        :return: The time series as a one-dimensional array
+        :rtype: numpy.ndarray
+        """
+        if cod_dates is None:
+            return np.array(self.data[idx_lat, idx_lon])
+        else:
+            return self.data[idx_lat, idx_lon][self.get_rows(cod_dates)]
+
+    def pack(self, awap_reader, var_name, months=None, max_memory=DEFAULT_PACK_MEMORY):
+        """
+        Transpose the monthly files of the given variable into this store. Each monthly file is
+        read once, into a buffer of consecutive months of the whole grid, and the buffer is written
+        into the store when full, so the days of each pixel are written in runs of the buffer
+        length rather than one month at a time.
+
+        :param awap_reader:
+        :type awap_reader: gridded.AwapDailyDataReader
+        :param months: (year, month) pairs to pack, default to all available monthly files
+        :type months: list
+        :param max_memory: Memory budget in bytes of the buffer, which holds at least one month
+        :type max_memory: int
+        """
+        months = months or awap_reader.list_months(var_name)
+        n_days_list, dates = _NpyStore._get_dates(awap_reader, var_name, months)
+        n_lat, n_lon = awap_reader.lat.size, awap_reader.lon.size
+
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir)
+
+        data_path_tmp = self.data_path + '.tmp'
+        data = np.lib.format.open_memmap(data_path_tmp, mode='w+', dtype=np.float32,
+                                         shape=(n_lat, n_lon, dates.size))
+        buffer_days = max(max(n_days_list), max_memory // (n_lat * n_lon * data.itemsize))
+        buffer = np.empty((n_lat, n_lon, min(buffer_days, dates.size)), dtype=np.float32)
+
+        row = 0  # first day of the store in the buffer
+        n_buffered = 0
+        for (year, month), n_days in zip(months, n_days_list):
+            if n_buffered + n_days > buffer.shape[2]:
+                logging.debug('transposing days {}-{} of {}'.format(row, row + n_buffered, var_name))
+                data[:, :, row:row + n_buffered] = buffer[:, :, :n_buffered]
+                row += n_buffered
+                n_buffered = 0
+            logging.debug('reading {:04d}{:02d} of {}'.format(year, month, var_name))
+            month_data = awap_reader.read_one_file(var_name, year, month)
+            buffer[:, :, n_buffered:n_buffered + n_days] = month_data.transpose((1, 2, 0))
+            n_buffered += n_days
+        data[:, :, row:row + n_buffered] = buffer[:, :, :n_buffered]
+        data.flush()
+        data = None
+
+        self._save(data_path_tmp, dates)
@@ -8,12 +8,10 @@ import logging
 from ConfigParser import ConfigParser
 import argparse
 
+# Only light modules are imported here so that simple sub-commands, e.g. cod-getpath, start fast.
+# Modules that need numpy and scipy are imported by the sub-commands that use them.
 from sdm import __version__
-from sdm.cod import CoD
-from sdm.gridded import Data2DReader
-from sdm.extractor import GriddedExtractor
 from sdm.parameters import MainParameters
-from sdm.mask import MaskReader
 
 
 def read_config(config_file):
@@ -30,6 +28,265 @@ def read_config(config_file):
     return config
 
 
+def get_optional(config, option):
+    if config.has_option('dxt', option):
+        return config.get('dxt', option)
+    else:
+        return None
+
+
+def get_gridded_extractor(config, jobs=1, cod_memoize=False):
+    from sdm.extractor import GriddedExtractor
+
+    if config.has_option('dxt', 'awap_cache_size'):
+        awap_cache_size = config.getint('dxt', 'awap_cache_size')
+    else:
+        awap_cache_size = 0
+
+    return GriddedExtractor(cod_base_dir=config.get('dxt', 'cod_base_dir'),
+                            mask_base_dir=config.get('dxt', 'mask_base_dir'),
+                            gridded_base_dir=config.get('dxt', 'gridded_base_dir'),
+                            awap_cache_size=awap_cache_size,
+                            workers=jobs,
+                            packed_base_dir=get_optional(config, 'packed_base_dir'),
+                            cod_cache_dir=get_optional(config, 'cod_cache_dir'),
+                            dtype=get_optional(config, 'dtype') or 'float32',
+                            mask_cache_dir=get_optional(config, 'mask_cache_dir'),
+                            cod_memoize=cod_memoize)
+
+
+def parse_memory_size(size):
+    """
+    Parse a memory size in bytes with an optional K, M or G suffix, e.g. 512M or 4G.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper()
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    else:
+        return int(size)
+
+
+def get_region_output_files(output_file, regions):
+    """
+    Output file names of a multi-region extraction. A "{region}" placeholder in the given file
+    name is replaced by each region name, otherwise the region name is appended to the base name,
+    e.g. out.nc becomes out_tas.nc and out_sea.nc.
+    """
+    if '{region}' in output_file:
+        return [output_file.format(region=region) for region in regions]
+    else:
+        root, ext = os.path.splitext(output_file)
+        return ['{}_{}{}'.format(root, region, ext) for region in regions]
+
+
+def parse_months(months):
+    """
+    Parse a comma separated list of months of year, e.g. 12,1,2 for DJF.
+    """
+    return [int(month) for month in months.split(',')]
+
+
+def parse_bins(bins):
+    """
+    Parse the histogram bins of the form START,STOP,N, e.g. 0,300,300 for 1 mm bins up to 300 mm.
+    """
+    start, stop, n_bins = bins.split(',')
+    return float(start), float(stop), int(n_bins)
+
+
+def parse_quantiles(quantiles):
+    """
+    Parse a comma separated list of probabilities of quantiles, e.g. 0.1,0.5,0.9.
+    """
+    return [float(quantile) for quantile in quantiles.split(',')]
+
+
+def parse_part(part):
+    """
+    Parse the part of a chunked extraction of the form I/N, e.g. 0/4 for the first of 4 parts.
+    """
+    i, n = [int(x) for x in part.split('/')]
+    if not 0 <= i < n:
+        raise ValueError('Part must be of the form I/N with I from 0 to N-1: {}'.format(part))
+    return i, n
+
+
+def add_output_format_arguments(parser):
+    """
+    Add the options of the format of the output files to a sub-command parser.
+    """
+    parser.add_argument('--format',
+                        choices=('netcdf3', 'netcdf4'),
+                        default='netcdf3',
+                        help='format of the output files, netcdf4 files are chunked and compressed, '
+                             'default to netcdf3')
+    parser.add_argument('--chunking',
+                        default='timeseries',
+                        help='chunking of netcdf4 output, either timeseries (many dates of a few grid points), '
+                             'map (all grid points of a single date) or a comma separated chunk shape, '
+                             'e.g. 365,16,16, default to timeseries')
+    parser.add_argument('--complevel',
+                        type=int,
+                        default=4,
+                        help='deflate level from 1 to 9 of netcdf4 output, default to 4')
+
+
+def get_output_format(ns):
+    """
+    :rtype: sdm.ncformat.OutputFormat
+    """
+    from sdm.ncformat import OutputFormat, parse_chunking
+
+    return OutputFormat(ns.format, parse_chunking(ns.chunking), ns.complevel)
+
+
+def read_batch_file(batch_file):
+    """
+    Read a batch file of extractions. Each non-empty line is of the form
+    "model scenario region_type season predictand output_file [region]".
+    Lines starting with "#" are comments and a "-" scenario stands for no scenario.
+
+    :return: list of (main_parameters, output_file) pairs
+    """
+    batch = []
+    with open(batch_file) as ins:
+        for line in ins:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) not in (6, 7):
+                raise ValueError('Invalid line in batch file {}: {}'.format(batch_file, line))
+            model, scenario, region_type, season, predictand, output_file = fields[:6]
+            if scenario == '-':
+                scenario = ''
+            region = fields[6] if len(fields) == 7 else region_type
+            batch.append((MainParameters(model, scenario, region_type, season, predictand, region), output_file))
+
+    return batch
+
+
+def run_sub_command(ns, config):
+    """
+    Run the sub-command of the parsed arguments.
+    """
+    if ns.sub_command == 'cod-getpath':
+        main_parameters = MainParameters(ns.model, ns.scenario, ns.region_type, ns.season, ns.predictand)
+        print os.path.join(config.get('dxt', 'cod_base_dir'), main_parameters.get_cod_file())
+
+    elif ns.sub_command in ('dxt-gridded', 'dxt-gridded2'):
+        gridded_extractor = get_gridded_extractor(config, ns.jobs)
+
+        if ns.sub_command == 'dxt-gridded':
+            main_parameters = MainParameters.from_filepath(ns.cod_file_path)
+        else:
+            main_parameters = MainParameters(ns.model, ns.scenario, ns.region_type, ns.season, ns.predictand)
+
+        if ns.region and len(ns.region) > 1:
+            region = ns.region
+            output_file = get_region_output_files(ns.output_file, ns.region)
+        else:
+            region = ns.region[0] if ns.region else None
+            output_file = ns.output_file
+
+        if ns.store:
+            if isinstance(region, list) or ns.direct:
+                sys.stderr.write('The --store option supports neither several regions nor --direct\n')
+                sys.exit(1)
+            part, n_parts = ns.part
+            gridded_extractor.extract_to_store(output_file, main_parameters, region, part, n_parts, ns.chunk_dates,
+                                               start=ns.start, end=ns.end, months=ns.months)
+        elif ns.direct:
+            if ns.format != 'netcdf3':
+                sys.stderr.write('The --direct option only supports the netcdf3 format\n')
+                sys.exit(1)
+            if ns.max_memory is not None:
+                sys.stderr.write('The --direct option does not support --max-memory\n')
+                sys.exit(1)
+            gridded_extractor.extract_cube_to_nc(output_file, main_parameters, region,
+                                                 start=ns.start, end=ns.end, months=ns.months)
+        else:
+            gridded_extractor.extract_to_nc(output_file, main_parameters, region, max_memory=ns.max_memory,
+                                            start=ns.start, end=ns.end, months=ns.months,
+                                            output_format=get_output_format(ns))
+
+    elif ns.sub_command == 'dxt-stats':
+        import numpy as np
+
+        gridded_extractor = get_gridded_extractor(config, ns.jobs)
+        main_parameters = MainParameters(ns.model, ns.scenario, ns.region_type, ns.season, ns.predictand)
+        bins = np.linspace(ns.bins[0], ns.bins[1], ns.bins[2] + 1) if ns.bins else None
+
+        gridded_extractor.extract_statistics_to_nc(ns.output_file, main_parameters, ns.region, bins, ns.quantiles,
+                                                   ns.wet_day_threshold, start=ns.start, end=ns.end, months=ns.months,
+                                                   histogram=not ns.no_histogram)
+
+    elif ns.sub_command == 'dxt-batch':
+        gridded_extractor = get_gridded_extractor(config, ns.jobs)
+
+        batch = read_batch_file(ns.batch_file)
+        gridded_extractor.extract_many_to_nc([output_file for _, output_file in batch],
+                                             [main_parameters for main_parameters, _ in batch],
+                                             start=ns.start, end=ns.end, months=ns.months,
+                                             output_format=get_output_format(ns))
+
+    elif ns.sub_command == 'to-3d':
+        from sdm.gridded import convert_to_3d_nc
+        from sdm.mask import MaskRegistry
+
+        main_parameters = MainParameters.from_filepath(ns.data2d_file)
+        mask_reader = MaskRegistry(base_dir=config.get('dxt', 'mask_base_dir'),
+                                   cache_dir=get_optional(config, 'mask_cache_dir'))
+        mask = mask_reader.read(ns.region if ns.region else main_parameters.region_type)
+
+        convert_to_3d_nc(ns.data2d_file, ns.data3d_file, mask, main_parameters, ns.block_size,
+                         output_format=get_output_format(ns))
+
+    elif ns.sub_command == 'consolidate':
+        from sdm.chunkstore import ChunkedOutputStore
+
+        ChunkedOutputStore(ns.store_dir).consolidate(ns.output_file, get_output_format(ns))
+
+    elif ns.sub_command == 'awap-pack':
+        from sdm.gridded import AwapDailyDataReader
+        from sdm.store import PackedAwapStore, TimeMajorAwapStore, DEFAULT_PACK_MEMORY
+
+        packed_base_dir = get_optional(config, 'packed_base_dir')
+        if not packed_base_dir:
+            sys.stderr.write('The packed_base_dir option of the dxt section is required\n')
+            sys.exit(1)
+        awap_reader = AwapDailyDataReader(base_dir=config.get('dxt', 'gridded_base_dir'))
+        _, file_code = AwapDailyDataReader.get_codes(ns.predictand)
+        if ns.time_major:
+            TimeMajorAwapStore(packed_base_dir, file_code).pack(awap_reader, ns.predictand,
+                                                                max_memory=ns.max_memory or DEFAULT_PACK_MEMORY)
+        else:
+            PackedAwapStore(packed_base_dir, file_code).pack(awap_reader, ns.predictand)
+
+    elif ns.sub_command == 'serve':
+        from sdm.server import make_server
+
+        output_dir = ns.output_dir or get_optional(config, 'output_dir')
+        if not output_dir:
+            sys.stderr.write('The serve sub-command requires --output-dir or the output_dir option of the config\n')
+            sys.exit(1)
+        gridded_extractor = get_gridded_extractor(config, ns.jobs, cod_memoize=True)
+        server = make_server(gridded_extractor, output_dir, ns.socket, ns.port, ns.workers)
+        logging.warning('serving on {}, writing within {}'.format(
+            'http://127.0.0.1:{}'.format(ns.port) if ns.port is not None else server.server_address, output_dir))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.pool.close()
+
+    else:
+        sys.stderr.write('Unknown sub-command: {}'.format(ns.sub_command))
+
+
 def main(args):
     ap = argparse.ArgumentParser(prog=os.path.basename(__file__),
                                  formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -50,6 +307,13 @@ def main(args):
                     action='store_true',
                     default=False,
                     help='print debug messages')
+    ap.add_argument('-j', '--jobs',
+                    type=int,
+                    default=1,
+                    help='number of AWAP monthly files to read concurrently, default to 1')
+    ap.add_argument('--profile',
+                    metavar='FILE',
+                    help='save the wall time, bytes read, files opened and peak memory of every stage to a JSON file')
     # Overriding config options
     ap.add_argument('--dxt-cod_base_dir',
                     help='override cod_base_dir option of the dxt section')
@@ -57,6 +321,8 @@ def main(args):
                     help='override mask_base_dir option of the dxt section')
     ap.add_argument('--dxt_gridded_base_dir',
                     help='override gridded_base_dir option of the dxt section')
+    ap.add_argument('--dxt-packed_base_dir',
+                    help='override packed_base_dir option of the dxt section')
 
     subparsers = ap.add_subparsers(dest='sub_command',
                                    title='List of sub-commands',
@@ -90,7 +356,41 @@ def main(args):
                                     help='output netCDF file name')
     dxt_gridded_parser.add_argument('-R', '--region',
                                     required=False,
-                                    help='the region where the data are to be extracted')
+                                    action='append',
+                                    help='the region where the data are to be extracted, repeat to extract '
+                                         'several regions in a single pass with one output file per region')
+    dxt_gridded_parser.add_argument('--direct',
+                                    action='store_true',
+                                    default=False,
+                                    help='gather the data straight into the memory-mapped output cube, '
+                                         'which is never held in memory')
+    dxt_gridded_parser.add_argument('--max-memory',
+                                    type=parse_memory_size,
+                                    help='extract and save the dates in chunks so that the memory usage stays '
+                                         'within the given size, e.g. 512M or 4G')
+    dxt_gridded_parser.add_argument('--start',
+                                    help='first reconstructed date to extract, e.g. 2081-01-01')
+    dxt_gridded_parser.add_argument('--end',
+                                    help='last reconstructed date to extract, e.g. 2100-12-31')
+    dxt_gridded_parser.add_argument('--months',
+                                    type=parse_months,
+                                    help='comma separated months of year to extract, e.g. 12,1,2')
+    dxt_gridded_parser.add_argument('--store',
+                                    action='store_true',
+                                    default=False,
+                                    help='write to a directory of chunk files at output_file instead, which several '
+                                         'workers can write concurrently, see --part and the consolidate sub-command')
+    dxt_gridded_parser.add_argument('--part',
+                                    type=parse_part,
+                                    default=(0, 1),
+                                    help='with --store, extract only part I of N of the time chunks, e.g. 0/4, '
+                                         'default to 0/1')
+    dxt_gridded_parser.add_argument('--chunk-dates',
+                                    type=int,
+                                    default=365,
+                                    help='with --store, number of dates per chunk file, the same for all parts, '
+                                         'default to 365')
+    add_output_format_arguments(dxt_gridded_parser)
 
     dxt_gridded2_parser = subparsers.add_parser('dxt-gridded2',
                                                 help='extract gridded data with the given parameters')
@@ -113,7 +413,105 @@ def main(args):
                                      help='predictand name, e.g. rain, tmax, tmin')
     dxt_gridded2_parser.add_argument('-R', '--region',
                                      required=False,
-                                     help='the region where the data are to be extracted (default to region-type)')
+                                     action='append',
+                                     help='the region where the data are to be extracted (default to region-type), '
+                                          'repeat to extract several regions in a single pass with one output '
+                                          'file per region')
+    dxt_gridded2_parser.add_argument('--direct',
+                                     action='store_true',
+                                     default=False,
+                                     help='gather the data straight into the memory-mapped output cube, '
+                                         'which is never held in memory')
+    dxt_gridded2_parser.add_argument('--max-memory',
+                                     type=parse_memory_size,
+                                     help='extract and save the dates in chunks so that the memory usage stays '
+                                          'within the given size, e.g. 512M or 4G')
+    dxt_gridded2_parser.add_argument('--start',
+                                     help='first reconstructed date to extract, e.g. 2081-01-01')
+    dxt_gridded2_parser.add_argument('--end',
+                                     help='last reconstructed date to extract, e.g. 2100-12-31')
+    dxt_gridded2_parser.add_argument('--months',
+                                     type=parse_months,
+                                     help='comma separated months of year to extract, e.g. 12,1,2')
+    dxt_gridded2_parser.add_argument('--store',
+                                     action='store_true',
+                                     default=False,
+                                     help='write to a directory of chunk files at output_file instead, which several '
+                                          'workers can write concurrently, see --part and the consolidate sub-command')
+    dxt_gridded2_parser.add_argument('--part',
+                                     type=parse_part,
+                                     default=(0, 1),
+                                     help='with --store, extract only part I of N of the time chunks, e.g. 0/4, '
+                                          'default to 0/1')
+    dxt_gridded2_parser.add_argument('--chunk-dates',
+                                     type=int,
+                                     default=365,
+                                     help='with --store, number of dates per chunk file, the same for all parts, '
+                                          'default to 365')
+    add_output_format_arguments(dxt_gridded2_parser)
+
+    dxt_stats_parser = subparsers.add_parser('dxt-stats',
+                                             help='save statistics of every grid point accumulated during the '
+                                                  'extraction instead of the daily series')
+    dxt_stats_parser.add_argument('output_file',
+                                  help='output netCDF file name')
+    dxt_stats_parser.add_argument('-m', '--model',
+                                  required=True,
+                                  help='model name')
+    dxt_stats_parser.add_argument('-c', '--scenario',
+                                  required=False,
+                                  help='scenario name, e.g. historical, rcp45, rcp85')
+    dxt_stats_parser.add_argument('-r', '--region-type',
+                                  required=True,
+                                  help='pre-defined region type name, e.g. sea, sec, tas ...')
+    dxt_stats_parser.add_argument('-s', '--season',
+                                  required=True,
+                                  help='season number, e.g. 1 (DJF), 2 (MAM), 3 (JJA), or 4 (SON)')
+    dxt_stats_parser.add_argument('-p', '--predictand',
+                                  required=True,
+                                  help='predictand name, e.g. rain, tmax, tmin')
+    dxt_stats_parser.add_argument('-R', '--region',
+                                  required=False,
+                                  help='the region where the data are to be extracted (default to region-type)')
+    dxt_stats_parser.add_argument('--start',
+                                  help='first reconstructed date to extract, e.g. 2081-01-01')
+    dxt_stats_parser.add_argument('--end',
+                                  help='last reconstructed date to extract, e.g. 2100-12-31')
+    dxt_stats_parser.add_argument('--months',
+                                  type=parse_months,
+                                  help='comma separated months of year to extract, e.g. 12,1,2')
+    dxt_stats_parser.add_argument('--bins',
+                                  type=parse_bins,
+                                  help='histogram bins as START,STOP,N, default to 0,250,50 (mm) for rain and '
+                                       '220,340,60 (K) for temperatures')
+    dxt_stats_parser.add_argument('--quantiles',
+                                  type=parse_quantiles,
+                                  default=[0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95],
+                                  help='comma separated probabilities of the quantiles approximated from the '
+                                       'histograms, default to 0.05,0.1,0.25,0.5,0.75,0.9,0.95')
+    dxt_stats_parser.add_argument('--wet-day-threshold',
+                                  type=float,
+                                  help='count the days of at least this value, default to 1.0 for rain and no '
+                                       'counting for temperatures')
+    dxt_stats_parser.add_argument('--no-histogram',
+                                  action='store_true',
+                                  default=False,
+                                  help='leave the histograms out of the output file, which are still used for '
+                                       'the quantiles')
+
+    dxt_batch_parser = subparsers.add_parser('dxt-batch',
+                                             help='extract gridded data for a batch of parameters sharing AWAP reads')
+    dxt_batch_parser.add_argument('batch_file',
+                                  help='file with one "model scenario region_type season predictand output_file '
+                                       '[region]" per line, use "-" for an empty scenario')
+    dxt_batch_parser.add_argument('--start',
+                                  help='first reconstructed date to extract, e.g. 2081-01-01')
+    dxt_batch_parser.add_argument('--end',
+                                  help='last reconstructed date to extract, e.g. 2100-12-31')
+    dxt_batch_parser.add_argument('--months',
+                                  type=parse_months,
+                                  help='comma separated months of year to extract, e.g. 12,1,2')
+    add_output_format_arguments(dxt_batch_parser)
 
     to_3d_parser = subparsers.add_parser('to-3d',
                                          help='Convert and save the 2D (dates, gpnames) file to 3D (dates, lat, lon)')
@@ -123,6 +521,53 @@ def main(args):
                               help='the output file')
     to_3d_parser.add_argument('-R', '--region',
                               help='the region of the downscaled data')
+    to_3d_parser.add_argument('--block-size',
+                              type=int,
+                              default=1000,
+                              help='number of dates converted and appended to the output at a time')
+    add_output_format_arguments(to_3d_parser)
+
+    consolidate_parser = subparsers.add_parser('consolidate',
+                                               help='save a chunked output store written with --store to a NetCDF '
+                                                    'file of the same layout as dxt-gridded')
+    consolidate_parser.add_argument('store_dir',
+                                    help='directory of the chunked output store')
+    consolidate_parser.add_argument('output_file',
+                                    help='output netCDF file name')
+    add_output_format_arguments(consolidate_parser)
+
+    awap_pack_parser = subparsers.add_parser('awap-pack',
+                                             help='pack the AWAP monthly files of a variable into a single '
+                                                  'memory-mapped store under packed_base_dir')
+    awap_pack_parser.add_argument('-p', '--predictand',
+                                  required=True,
+                                  help='predictand name, e.g. rain, tmax, tmin')
+    awap_pack_parser.add_argument('--time-major',
+                                  action='store_true',
+                                  default=False,
+                                  help='pack into a time-major store for fast point time series queries instead')
+    awap_pack_parser.add_argument('--max-memory',
+                                  type=parse_memory_size,
+                                  help='memory budget of the months buffered at a time for the time-major store, '
+                                       'e.g. 512M or 4G, default to 1G')
+
+    serve_parser = subparsers.add_parser('serve',
+                                         help='run a long-running server for cod-getpath, dxt-gridded, to-3d and point '
+                                              'queries, which keeps masks, CoD files and AWAP months cached')
+    serve_parser.add_argument('--socket',
+                              help='path of the Unix socket to listen on, which only the user of the server may '
+                                   'connect to, default to ~/.sdm.sock')
+    serve_parser.add_argument('--port',
+                              type=int,
+                              help='port of localhost to listen on instead of a Unix socket, which any local user '
+                                   'may connect to')
+    serve_parser.add_argument('--output-dir',
+                              help='directory that all output files are written within, output files of relative '
+                                   'paths are relative to it, default to the output_dir option of the config')
+    serve_parser.add_argument('--workers',
+                              type=int,
+                              default=4,
+                              help='number of requests handled concurrently')
 
     ns = ap.parse_args(args)
 
@@ -140,36 +585,17 @@ def main(args):
         config.set('dxt', 'mask_base_dir', ns.dxt_mask_base_dir)
     if ns.dxt_gridded_base_dir:
         config.set('dxt', 'gridded_base_dir', ns.dxt_gridded_base_dir)
+    if ns.dxt_packed_base_dir:
+        config.set('dxt', 'packed_base_dir', ns.dxt_packed_base_dir)
 
-    if ns.sub_command == 'cod-getpath':
-        main_parameters = MainParameters(ns.model, ns.scenario, ns.region_type, ns.season, ns.predictand)
-        print CoD(config.get('dxt', 'cod_base_dir')).get_cod_file_path(main_parameters)
-
-    elif ns.sub_command in ('dxt-gridded', 'dxt-gridded2'):
-        gridded_extractor = GriddedExtractor(cod_base_dir=config.get('dxt', 'cod_base_dir'),
-                                             mask_base_dir=config.get('dxt', 'mask_base_dir'),
-                                             gridded_base_dir=config.get('dxt', 'gridded_base_dir'))
-
-        if ns.sub_command == 'dxt-gridded':
-            main_parameters = MainParameters.from_filepath(ns.cod_file_path)
-        else:
-            main_parameters = MainParameters(ns.model, ns.scenario, ns.region_type, ns.season, ns.predictand)
-
-        data = gridded_extractor.extract(main_parameters, ns.region)
-
-        data.save_nc(ns.output_file, main_parameters)
-
-    elif ns.sub_command == 'to-3d':
-        main_parameters = MainParameters.from_filepath(ns.data2d_file)
-        data2d = Data2DReader().read(ns.data2d_file)
-        mask_reader = MaskReader(base_dir=config.get('dxt', 'mask_base_dir'))
-        mask = mask_reader.read(ns.region if ns.region else main_parameters.region_type)
-        data3d = data2d.to_3d(mask.crop())
-
-        data3d.save_nc(ns.data3d_file, main_parameters=main_parameters)
+    if ns.profile:
+        from sdm.profiling import Profiler
 
+        with Profiler() as profiler:
+            run_sub_command(ns, config)
+        profiler.save(ns.profile)
     else:
-        sys.stderr.write('Unknown sub-command: {}'.format(ns.sub_command))
+        run_sub_command(ns, config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+"""
+Synthetic AWAP monthly files, masks and CoD files on the real 0.05 degree grid, shared by the tests
+
+The monthly files are only a few days long to keep them small. Each value encodes its month, day
+and grid point, so that the tests can check which value went where.
+"""
+import os
+import datetime
+from collections import namedtuple
+
+import numpy as np
+import pytest
+from scipy.io import netcdf
+
+from sdm.gridded import AwapDailyDataReader, MISSING_VALUE
+from sdm.parameters import MainParameters
+
+MONTHS = [(1980, 1), (1980, 2), (1980, 3), (1980, 4)]
+N_DAYS = 3
+
+# Bounding rows and columns of the rectangle of each region within the grid
+REGIONS = {
+    'tas': (20, 40, 600, 630),
+    'sea': (190, 230, 280, 340),
+}
+
+N_COD_DATES = 60
+
+SyntheticData = namedtuple('SyntheticData', 'awap_dir, mask_dir, cod_dir, predictand')
+
+
+def get_value(year, month, idx_days, idx_lat, idx_lon):
+    """
+    Values of the given days and grid points of a synthetic monthly file
+    """
+    return (idx_days * 100.0 + (year - 1980) * 12 + month) + (idx_lat * 1000.0 + idx_lon) / 1e6
+
+
+def get_expected_values(adates, idx_lat, idx_lon):
+    """
+    Values of the given grid points on the given CoD analog dates, with NaN as missing values
+
+    :return: Values of shape (dates, grid points)
+    :rtype: numpy.ndarray
+    """
+    adates = np.asarray(adates)[:, np.newaxis]
+    idx_lat, idx_lon = np.asarray(idx_lat), np.asarray(idx_lon)
+    values = get_value(adates // 10000 + 1900, adates // 100 % 100, adates % 100 - 1, idx_lat, idx_lon)
+    values = values.astype(np.float32)
+    for idx_lat_min, _, idx_lon_min, _ in REGIONS.values():
+        missing = ((idx_lat >= idx_lat_min) & (idx_lat < idx_lat_min + 2) &
+                   (idx_lon >= idx_lon_min) & (idx_lon < idx_lon_min + 2))
+        values[:, missing] = np.NaN
+    return values
+
+
+def to_cod_date(date):
+    """
+    The [Y]YYMMDD CoD date of the given date, e.g. 1000101 for 2000-01-01
+    """
+    return date.year * 10000 + date.month * 100 + date.day - 19000000
+
+
+def get_main_parameters(region):
+    return MainParameters('SYNTHETIC', 'rcp85', region, '1', 'tmax')
+
+
+def _write_awap(awap_dir, predictand):
+    awap_reader = AwapDailyDataReader(base_dir=awap_dir)
+    lat, lon = awap_reader.lat, awap_reader.lon
+    var_code, _ = AwapDailyDataReader.get_codes(predictand)
+    idx_lat, idx_lon = np.meshgrid(np.arange(lat.size), np.arange(lon.size), indexing='ij')
+
+    for year, month in MONTHS:
+        file_path = awap_reader.get_file_path(predictand, year, month)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        f = netcdf.netcdf_file(file_path, 'w')
+        try:
+            f.createDimension('time', None)
+            f.createDimension('lat', lat.size)
+            f.createDimension('lon', lon.size)
+            var_lat = f.createVariable('lat', np.float64, ('lat',))
+            var_lat[:] = lat
+            var_lon = f.createVariable('lon', np.float64, ('lon',))
+            var_lon[:] = lon
+            var_data = f.createVariable(var_code, np.float32, ('time', 'lat', 'lon'))
+            data = get_value(year, month, np.arange(N_DAYS)[:, np.newaxis, np.newaxis], idx_lat, idx_lon)
+            data = data.astype(np.float32)
+            # A missing corner in each region
+            for idx_lat_min, _, idx_lon_min, _ in REGIONS.values():
+                data[:, idx_lat_min:idx_lat_min + 2, idx_lon_min:idx_lon_min + 2] = MISSING_VALUE
+            var_data[:] = data
+            var_data.missing_value = np.float32(MISSING_VALUE)
+        finally:
+            f.close()
+
+
+def write_mask(file_path, mask):
+    """
+    Write a mask of the whole grid, of 1 for the grid points of the region
+    """
+    awap_reader = AwapDailyDataReader()
+    f = netcdf.netcdf_file(file_path, 'w')
+    try:
+        f.createDimension('lat', awap_reader.lat.size)
+        f.createDimension('lon', awap_reader.lon.size)
+        var_lat = f.createVariable('lat', np.float64, ('lat',))
+        var_lat[:] = awap_reader.lat
+        var_lon = f.createVariable('lon', np.float64, ('lon',))
+        var_lon[:] = awap_reader.lon
+        var_mask = f.createVariable('mask', np.int8, ('lat', 'lon'))
+        var_mask[:] = mask
+    finally:
+        f.close()
+
+
+def _write_masks(mask_dir):
+    awap_reader = AwapDailyDataReader()
+    os.makedirs(mask_dir)
+    for region, (idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max) in REGIONS.items():
+        mask = np.zeros((awap_reader.lat.size, awap_reader.lon.size), dtype=np.int8)
+        mask[idx_lat_min:idx_lat_max, idx_lon_min:idx_lon_max] = 1
+        mask[idx_lat_max - 1, idx_lon_max - 1] = 0  # not a plain rectangle
+        write_mask(os.path.join(mask_dir, 'mask_{}.nc'.format(region)), mask)
+
+
+def _write_cods(cod_dir, seed=0):
+    random = np.random.RandomState(seed)
+    for region in sorted(REGIONS):
+        main_parameters = get_main_parameters(region)
+        file_path = os.path.join(cod_dir, main_parameters.get_cod_file())
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+
+        # Consecutive days from 2000-01-01 reconstructed from random analog days
+        with open(file_path, 'w') as f:
+            f.write('SYNTHETIC rcp85 1\n')
+            for i in xrange(N_COD_DATES):
+                rdate = datetime.date(2000, 1, 1) + datetime.timedelta(i)
+                year, month = MONTHS[random.randint(len(MONTHS))]
+                adate = datetime.date(year, month, random.randint(1, N_DAYS + 1))
+                f.write('{} {} {:.4f}\n'.format(to_cod_date(rdate), to_cod_date(adate), random.rand()))
+
+
+@pytest.fixture(scope='session')
+def synthetic_data(tmpdir_factory):
+    base_dir = str(tmpdir_factory.mktemp('synthetic'))
+    data = SyntheticData(os.path.join(base_dir, 'awap'), os.path.join(base_dir, 'masks'),
+                         os.path.join(base_dir, 'cod'), 'tmax')
+    _write_awap(data.awap_dir, data.predictand)
+    _write_masks(data.mask_dir)
+    _write_cods(data.cod_dir)
+    return data
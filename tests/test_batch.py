@@ -0,0 +1,21 @@
+from sdm.extractor import GriddedExtractor
+
+from conftest import get_main_parameters
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_extract_many_to_nc(synthetic_data, tmpdir):
+    gridded_extractor = GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir)
+    main_parameters_list = [get_main_parameters(region) for region in ('tas', 'sea', 'tas')]
+    filenames = [str(tmpdir.join('many_{}.nc'.format(i))) for i in xrange(len(main_parameters_list))]
+    gridded_extractor.extract_many_to_nc(filenames, main_parameters_list, start='2000-01-10', end='2000-02-20')
+
+    # Each file is the same as if extracted on its own
+    for main_parameters, filename in zip(main_parameters_list, filenames):
+        filename_one = str(tmpdir.join('one.nc'))
+        gridded_extractor.extract_cube_to_nc(filename_one, main_parameters, start='2000-01-10', end='2000-02-20')
+        assert read_bytes(filename) == read_bytes(filename_one)
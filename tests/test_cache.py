@@ -0,0 +1,73 @@
+import datetime
+
+import numpy as np
+
+from sdm.cache import LRUCache
+from sdm.extractor import GriddedExtractor
+from sdm.gridded import AwapDailyDataReader
+
+from conftest import MONTHS, get_main_parameters, to_cod_date
+
+
+def test_scan_keeps_cached_keys():
+    cache = LRUCache(3 * 8)
+    for _ in xrange(3):
+        for key in xrange(5):
+            if cache.get(key) is None:
+                cache.put(key, np.zeros(1))
+
+    # The keys first cached hit on every later scan instead of being evicted by the others
+    assert sorted(cache._items) == [0, 1, 2]
+    assert cache.hits == 6
+    assert cache.misses == 9
+
+
+def test_frequent_key_admitted():
+    cache = LRUCache(2 * 8)
+    for key in (0, 1):
+        cache.get(key)
+        cache.put(key, np.zeros(1))
+    for _ in xrange(2):
+        cache.get(2)
+    assert cache.admits(2, 8)
+    cache.put(2, np.zeros(1))
+    assert sorted(cache._items) == [1, 2]
+
+
+def test_repeated_extractions_hit(synthetic_data):
+    def get_extractor(awap_cache_size):
+        return GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir,
+                                awap_cache_size=awap_cache_size)
+
+    main_parameters = get_main_parameters('sea')
+    expected = get_extractor(0).extract(main_parameters)
+
+    # A budget of 2 of the months read in every extraction
+    awap_reader = get_extractor(0).awap_reader
+    extractor = get_extractor(2 * awap_reader.get_month_nbytes(main_parameters.predictand, *MONTHS[0]))
+    for i in xrange(3):
+        data = extractor.extract(main_parameters)
+        np.testing.assert_array_equal(data.data, expected.data)
+
+    info = extractor.awap_reader.cache_info()
+    assert info['items'] == 2
+    assert info['hits'] == 2 * 2
+    assert info['misses'] == len(MONTHS) + 2 * (len(MONTHS) - 2)
+
+
+def test_points_bypass_cache(synthetic_data):
+    awap_reader = AwapDailyDataReader(base_dir=synthetic_data.awap_dir, cache_size=1024 ** 3)
+    adates = np.array([to_cod_date(datetime.date(year, month, 2)) for year, month in MONTHS])
+    points = [(200, 300), (25, 610)]
+    expected = AwapDailyDataReader(base_dir=synthetic_data.awap_dir).read_points('tmax', [adates] * 2, points)
+
+    # Points never decode whole months
+    for data, data_expected in zip(awap_reader.read_points('tmax', [adates] * 2, points), expected):
+        np.testing.assert_array_equal(data, data_expected)
+    assert len(awap_reader.cache) == 0
+
+    # but are read from the months already cached
+    awap_reader.read_one_file('tmax', *MONTHS[0])
+    for data, data_expected in zip(awap_reader.read_points('tmax', [adates] * 2, points), expected):
+        np.testing.assert_array_equal(data, data_expected)
+    assert awap_reader.cache_info()['hits'] == 1
@@ -0,0 +1,96 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from sdm.chunkstore import ChunkedOutputStore
+from sdm.gridded import Data3D
+from sdm.parameters import MainParameters
+
+from conftest import to_cod_date
+
+_N_DATES = 100
+_CHUNKS = (40, 2, 3)
+
+
+def get_data3d(seed=0):
+    random = np.random.RandomState(seed)
+    data = random.uniform(0.0, 50.0, (_N_DATES, 3, 5)).astype(np.float32)
+    data[random.rand(*data.shape) < 0.1] = np.NaN
+    first = datetime.date(1980, 1, 1)
+    dates = np.array([to_cod_date(first + datetime.timedelta(i)) for i in xrange(_N_DATES)])
+    lat = np.array([-30.0, -29.95, -29.9])
+    lon = np.array([150.0, 150.05, 150.1, 150.15, 150.2])
+    return Data3D(data, dates, lat, lon)
+
+
+def create_store(directory, data3d, chunks=_CHUNKS, main_parameters=None):
+    store = ChunkedOutputStore(str(directory))
+    store.create(data3d.dates, data3d.lat, data3d.lon, 'rain', main_parameters, chunks)
+    return store
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_write_alignment(tmpdir):
+    data3d = get_data3d()
+    store = create_store(tmpdir.join('store'), data3d)
+
+    with pytest.raises(ValueError):  # not starting at a chunk boundary
+        store.write(data3d.data[10:40], 10)
+    with pytest.raises(ValueError):  # not ending at a chunk boundary
+        store.write(data3d.data[0:50], 0)
+    with pytest.raises(ValueError):  # beyond the last date
+        store.write(data3d.data[80:100], 90)
+    with pytest.raises(ValueError):  # not the whole grid
+        store.write(data3d.data[0:40, :, 1:], 0)
+    assert len(store.missing_keys()) == len(list(store.keys()))
+
+    # The last block may end at the last date
+    store.write(data3d.data[80:], 80)
+    assert all(key[0] != 2 for key in store.missing_keys())
+
+
+def test_create_mismatch(tmpdir):
+    data3d = get_data3d()
+    directory = tmpdir.join('store')
+    create_store(directory, data3d)
+
+    # The same contents are accepted, e.g. by every worker
+    create_store(directory, data3d)
+    with pytest.raises(ValueError):
+        create_store(directory, data3d._replace(dates=data3d.dates + 1))
+    with pytest.raises(ValueError):
+        create_store(directory, data3d, chunks=(50, 2, 3))
+
+
+def test_consolidate_missing_chunks(tmpdir):
+    data3d = get_data3d()
+    store = create_store(tmpdir.join('store'), data3d)
+    store.write(data3d.data[:40], 0)
+    store.write(data3d.data[80:], 80)
+
+    with pytest.raises(ValueError) as excinfo:
+        store.consolidate(str(tmpdir.join('output.nc')))
+    assert 'not written yet' in str(excinfo.value)
+    assert not tmpdir.join('output.nc').check()
+
+
+def test_consolidate(tmpdir):
+    data3d = get_data3d()
+    main_parameters = MainParameters('ACCESS1.0', 'historical', 'sea', '1', 'rain')
+    filename = str(tmpdir.join('output.nc'))
+    data3d.save_nc(filename, 'rain', main_parameters)
+
+    # Three parts written independently, e.g. by three workers
+    directory = tmpdir.join('store')
+    for start, end in ((40, 80), (0, 40), (80, _N_DATES)):
+        store = create_store(directory, data3d, main_parameters=main_parameters)
+        store.write(data3d.data[start:end], start)
+
+    filename_consolidated = str(tmpdir.join('consolidated.nc'))
+    ChunkedOutputStore(str(directory)).consolidate(filename_consolidated)
+    assert read_bytes(filename_consolidated) == read_bytes(filename)
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+
+from sdm.cod import CoD
+
+_HEADER = 'ACCESS1.0 historical 1\n'
+
+
+def write_cod(tmpdir, lines):
+    file_path = str(tmpdir.join('rawfield_analog_1'))
+    with open(file_path, 'w') as f:
+        f.write(_HEADER + ''.join(line + '\n' for line in lines))
+    return file_path
+
+
+def test_read_lines(tmpdir):
+    cod_dates = CoD.read_from_file(write_cod(tmpdir, ['1000101 800101 0.5', '', '  1000102\t800131 0.25  ']))
+    np.testing.assert_array_equal(cod_dates['rdates'], [1000101, 1000102])
+    np.testing.assert_array_equal(cod_dates['adates'], [800101, 800131])
+    np.testing.assert_array_equal(cod_dates['edists'], [0.5, 0.25])
+
+
+def test_extra_columns(tmpdir):
+    # Only the first three columns are read, even if the number of all values is a multiple of 3
+    cod_dates = CoD.read_from_file(write_cod(tmpdir, ['1000101 800101 0.5 7', '1000102 800102 0.25 7',
+                                                      '1000103 800103 0.125 7']))
+    np.testing.assert_array_equal(cod_dates['rdates'], [1000101, 1000102, 1000103])
+    np.testing.assert_array_equal(cod_dates['adates'], [800101, 800102, 800103])
+    np.testing.assert_array_equal(cod_dates['edists'], [0.5, 0.25, 0.125])
+
+
+@pytest.mark.parametrize('lines, line_number', [
+    (['1000101 800101 0.5', '1000102 800102 0.25', 'abc 800103 0.125', '1000104 800104 0.5'], 4),
+    (['1000101 800101 0.5 7', '1000102 abc 0.25 7'], 3),
+    (['1000101 800101', '1000102 800102 0.25 0.5'], 2),
+    (['1000101 800101 0.5', '1000102.5 800102 0.25'], 3),
+])
+def test_malformed(tmpdir, lines, line_number):
+    cache_dir = str(tmpdir.join('cache'))
+    os.makedirs(cache_dir)
+    with pytest.raises(ValueError) as excinfo:
+        CoD.read_from_file(write_cod(tmpdir, lines), cache_dir)
+    assert 'at line {}:'.format(line_number) in str(excinfo.value)
+    # Nothing is cached
+    assert os.listdir(cache_dir) == []
@@ -0,0 +1,58 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from sdm.gridded import Data2D, LazyData2D
+from sdm.mask import MaskRegistry
+
+from conftest import to_cod_date
+
+
+def get_data2d(synthetic_data, n_dates=50, seed=0):
+    mask = MaskRegistry(synthetic_data.mask_dir).read('sea')
+    random = np.random.RandomState(seed)
+    data = random.uniform(270.0, 310.0, (n_dates, mask.gpnames.size)).astype(np.float32)
+    first = datetime.date(1999, 12, 15)
+    dates = np.array([to_cod_date(first + datetime.timedelta(i)) for i in xrange(n_dates)], dtype=np.int32)
+    return Data2D(data, dates, mask.gpnames.astype(np.int32)), mask
+
+
+def test_lazy_select(synthetic_data, tmpdir):
+    data2d, mask = get_data2d(synthetic_data)
+    filename = str(tmpdir.join('data2d.nc'))
+    data2d.save_nc(filename, 'tmax')
+
+    with LazyData2D(filename) as lazy_data:
+        assert lazy_data.shape == data2d.data.shape
+        # gpnames truncate the coordinates to 0.01 degree
+        np.testing.assert_allclose(lazy_data.lat, mask.lat[mask.idx_mask_2d[0]], atol=0.011)
+        np.testing.assert_allclose(lazy_data.lon, mask.lon[mask.idx_mask_2d[1]], atol=0.011)
+
+        selected = lazy_data.select()
+        np.testing.assert_array_equal(selected.data, data2d.data)
+        np.testing.assert_array_equal(selected.dates, data2d.dates)
+        np.testing.assert_array_equal(selected.gpnames, data2d.gpnames)
+
+        # A date range across the turn of the year
+        selected = lazy_data.select(start='1999-12-30', end='2000-01-05')
+        np.testing.assert_array_equal(selected.dates, data2d.dates[15:22])
+        np.testing.assert_array_equal(selected.data, data2d.data[15:22])
+        assert lazy_data.select(start='2001-01-01').data.shape == (0, data2d.gpnames.size)
+
+        # gpnames in the given order
+        idx_cols = [100, 3, 57, 3]
+        selected = lazy_data.select(end='1999-12-20', gpnames=data2d.gpnames[idx_cols])
+        np.testing.assert_array_equal(selected.gpnames, data2d.gpnames[idx_cols])
+        np.testing.assert_array_equal(selected.data, data2d.data[:6, idx_cols])
+        with pytest.raises(ValueError):
+            lazy_data.select(gpnames=[data2d.gpnames[0] + 1])
+
+        # A bounding box of the grid points
+        lat, lon = lazy_data.lat, lazy_data.lon
+        bbox = (np.median(lat), lat.max(), lon.min(), np.median(lon))
+        within = (lat >= bbox[0]) & (lat <= bbox[1]) & (lon >= bbox[2]) & (lon <= bbox[3])
+        assert 0 < within.sum() < within.size
+        selected = lazy_data.select(start='2000-01-01', bbox=bbox)
+        np.testing.assert_array_equal(selected.gpnames, data2d.gpnames[within])
+        np.testing.assert_array_equal(selected.data, data2d.data[17:][:, within])
@@ -0,0 +1,144 @@
+import datetime
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from sdm.extractor import GriddedExtractor
+from sdm.gridded import AwapDailyDataReader
+
+from conftest import get_expected_values, get_main_parameters, to_cod_date, write_mask
+
+# A region large enough for its extraction to take far more memory than the budget below
+_BIG_REGION = (100, 300, 100, 400)
+
+
+def get_big_extractor(synthetic_data, mask_dir):
+    awap_reader = AwapDailyDataReader()
+    mask = np.zeros((awap_reader.lat.size, awap_reader.lon.size), dtype=np.int8)
+    idx_lat_min, idx_lat_max, idx_lon_min, idx_lon_max = _BIG_REGION
+    mask[idx_lat_min:idx_lat_max, idx_lon_min:idx_lon_max] = 1
+    write_mask(os.path.join(mask_dir, 'mask_big.nc'), mask)
+    return GriddedExtractor(synthetic_data.cod_dir, mask_dir, synthetic_data.awap_dir)
+
+
+def get_memory_status(name):
+    """
+    Memory status in bytes of this process, e.g. VmRSS or VmHWM (peak)
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(name + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def extract_peak_growth(cod_dir, mask_dir, awap_dir, filename, max_memory):
+    """
+    Extract the big region and print the growth in bytes of the resident memory of the process
+    at its peak during the extraction, to be run in a process of its own
+    """
+    gridded_extractor = GriddedExtractor(cod_dir, mask_dir, awap_dir)
+    main_parameters = get_main_parameters('tas')
+    # Everything but the extraction itself is read up front
+    gridded_extractor.mask_reader.read('big')
+    gridded_extractor.read_cod_dates(main_parameters)
+
+    # Reset the peak to the current resident memory
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    before = get_memory_status('VmRSS')
+    gridded_extractor.extract_to_nc(filename, main_parameters, 'big', max_memory=max_memory)
+    print get_memory_status('VmHWM') - before
+
+
+def get_peak_growth(synthetic_data, mask_dir, filename, max_memory):
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    code = ('import sys; sys.path[:0] = {!r}; from test_gridded_extractor import extract_peak_growth; '
+            'extract_peak_growth(*sys.argv[1:5], max_memory=eval(sys.argv[5]))').format(
+        [tests_dir, os.path.dirname(tests_dir)])
+    output = subprocess.check_output([sys.executable, '-c', code, synthetic_data.cod_dir, mask_dir,
+                                      synthetic_data.awap_dir, filename, repr(max_memory)])
+    return int(output.split()[-1])
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'), reason='peak memory is not resettable')
+def test_max_memory(synthetic_data, tmpdir):
+    mask_dir = str(tmpdir.mkdir('masks'))
+    gridded_extractor = get_big_extractor(synthetic_data, mask_dir)
+    max_memory = 32 * 1024 ** 2
+
+    filename_whole = str(tmpdir.join('whole.nc'))
+    filename_chunked = str(tmpdir.join('chunked.nc'))
+    assert get_peak_growth(synthetic_data, mask_dir, filename_whole, None) > max_memory
+    assert get_peak_growth(synthetic_data, mask_dir, filename_chunked, max_memory) <= max_memory
+    with open(filename_whole, 'rb') as f_whole, open(filename_chunked, 'rb') as f_chunked:
+        assert f_whole.read() == f_chunked.read()
+
+    with pytest.raises(ValueError):
+        gridded_extractor.extract_to_nc(filename_chunked, get_main_parameters('tas'), 'big', max_memory=1024 ** 2)
+
+
+def test_date_window(synthetic_data, monkeypatch):
+    gridded_extractor = GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir)
+    main_parameters = get_main_parameters('tas')
+    cod_dates = gridded_extractor.read_cod_dates(main_parameters)
+    mask = gridded_extractor.mask_reader.read('tas')
+
+    whole = gridded_extractor.extract(main_parameters, cube=False)
+    np.testing.assert_array_equal(whole.dates, cod_dates['rdates'])
+    np.testing.assert_array_equal(whole.data, get_expected_values(cod_dates['adates'], *mask.idx_mask_2d))
+
+    months_read = []
+    read_one_file = gridded_extractor.awap_reader.read_one_file
+    monkeypatch.setattr(gridded_extractor.awap_reader, 'read_one_file',
+                        lambda var_name, year, month, *args: months_read.append((year, month)) or
+                        read_one_file(var_name, year, month, *args))
+    window = gridded_extractor.extract(main_parameters, cube=False, start='2000-01-10', end='2000-02-20',
+                                       months=[2])
+
+    expected_dates = [to_cod_date(datetime.date(2000, 2, 1) + datetime.timedelta(i)) for i in xrange(20)]
+    np.testing.assert_array_equal(window.dates, expected_dates)
+    selected = np.in1d(cod_dates['rdates'], expected_dates)
+    np.testing.assert_array_equal(window.data, whole.data[selected])
+    # Only the analog months of the window are read
+    adates = cod_dates['adates'][selected]
+    assert sorted(months_read) == sorted(set(zip(adates // 10000 + 1900, adates // 100 % 100)))
+
+    with pytest.raises(ValueError):
+        gridded_extractor.extract(main_parameters, start='2000-03-01', months=[1])
+
+
+def test_multiple_regions(synthetic_data, tmpdir, monkeypatch):
+    gridded_extractor = GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir)
+    main_parameters = get_main_parameters('tas')
+    regions = ['tas', 'sea']
+    adates = gridded_extractor.read_cod_dates(main_parameters)['adates']
+    expected = [gridded_extractor.extract(main_parameters, region) for region in regions]
+
+    files_read = []
+    read_one_file = gridded_extractor.awap_reader.read_one_file
+    monkeypatch.setattr(gridded_extractor.awap_reader, 'read_one_file',
+                        lambda var_name, year, month, *args: files_read.append((year, month)) or
+                        read_one_file(var_name, year, month, *args))
+    for data, expected_data, region in zip(gridded_extractor.extract(main_parameters, regions), expected, regions):
+        for name in data._fields:
+            np.testing.assert_array_equal(getattr(data, name), getattr(expected_data, name))
+        mask = gridded_extractor.mask_reader.read(region)
+        np.testing.assert_array_equal(data.to_2d(mask.crop()).data,
+                                      get_expected_values(adates, *mask.idx_mask_2d))
+    # Each monthly file is read once for all regions
+    assert len(files_read) == len(set(files_read))
+
+    # In chunks too, with each region saved to its own file
+    max_memory = 13 * 1024 ** 2
+    masks = [gridded_extractor.mask_reader.read(region) for region in regions]
+    assert GriddedExtractor.get_chunk_size(max_memory, masks) < expected[0].dates.size
+    filenames = [str(tmpdir.join('{}.nc'.format(region))) for region in regions]
+    gridded_extractor.extract_to_nc(filenames, main_parameters, regions, max_memory=max_memory)
+    for filename, expected_data in zip(filenames, expected):
+        filename_expected = str(tmpdir.join('expected.nc'))
+        expected_data.save_nc(filename_expected, main_parameters=main_parameters)
+        with open(filename, 'rb') as f, open(filename_expected, 'rb') as f_expected:
+            assert f.read() == f_expected.read()
@@ -0,0 +1,61 @@
+import datetime
+
+import numpy as np
+
+from sdm.gridded import Data2D, Data3D
+from sdm.ncrecords import RecordAppender
+
+from conftest import to_cod_date
+
+# Blocks of uneven numbers of dates, including a single date
+_BLOCKS = (0, 31, 32, 60, 100)
+
+
+def get_dates(n_dates):
+    first = datetime.date(2000, 1, 1)
+    return np.array([to_cod_date(first + datetime.timedelta(i)) for i in xrange(n_dates)], dtype=np.int32)
+
+
+def get_data(shape, seed=0):
+    random = np.random.RandomState(seed)
+    data = random.uniform(270.0, 310.0, shape).astype(np.float32)
+    data[random.rand(*shape) < 0.1] = np.NaN
+    return data
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def check_appended(tmpdir, whole, get_block):
+    filename_whole = str(tmpdir.join('whole.nc'))
+    filename_appended = str(tmpdir.join('appended.nc'))
+    whole.save_nc(filename_whole, 'tmax')
+
+    for i, (start, end) in enumerate(zip(_BLOCKS[:-1], _BLOCKS[1:])):
+        block = get_block(start, end)
+        if i == 0:
+            block.save_nc(filename_appended, 'tmax')
+        else:
+            block.append_nc(filename_appended)
+
+    assert RecordAppender(filename_appended).numrecs == _BLOCKS[-1]
+    assert read_bytes(filename_appended) == read_bytes(filename_whole)
+
+
+def test_append_data2d(tmpdir):
+    data = get_data((_BLOCKS[-1], 7))
+    dates = get_dates(_BLOCKS[-1])
+    gpnames = np.arange(100000000, 100000007, dtype=np.int32)
+    check_appended(tmpdir, Data2D(data, dates, gpnames),
+                   lambda start, end: Data2D(data[start:end], dates[start:end], gpnames))
+
+
+def test_append_data3d(tmpdir):
+    data = get_data((_BLOCKS[-1], 3, 5))
+    dates = get_dates(_BLOCKS[-1])
+    lat = np.array([-30.0, -29.95, -29.9])
+    lon = np.array([150.0, 150.05, 150.1, 150.15, 150.2])
+    check_appended(tmpdir, Data3D(data, dates, lat, lon),
+                   lambda start, end: Data3D(data[start:end], dates[start:end], lat, lon))
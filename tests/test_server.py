@@ -0,0 +1,70 @@
+import os
+import json
+import stat
+import socket
+import threading
+
+import pytest
+
+from sdm.extractor import GriddedExtractor
+from sdm.server import make_server
+
+from conftest import get_main_parameters
+
+
+def post(socket_path, command, request):
+    """
+    POST the request to the server on the given Unix socket
+    :return: Status and response of the server
+    :rtype: tuple
+    """
+    content = json.dumps(request)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall('POST /{} HTTP/1.0\r\nContent-Length: {}\r\n\r\n{}'.format(command, len(content), content))
+        response = ''
+        while True:
+            received = client.recv(65536)
+            if not received:
+                break
+            response += received
+    finally:
+        client.close()
+    header, body = response.split('\r\n\r\n', 1)
+    return int(header.split()[1]), json.loads(body)
+
+
+@pytest.fixture
+def server(synthetic_data, tmpdir):
+    gridded_extractor = GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir)
+    server = make_server(gridded_extractor, str(tmpdir.mkdir('outputs')), str(tmpdir.join('sdm.sock')), workers=1)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.pool.close()
+
+
+def test_socket_permissions(server):
+    assert stat.S_IMODE(os.stat(server.server_address).st_mode) == 0o600
+
+
+def test_output_dir(server, tmpdir):
+    main_parameters = get_main_parameters('tas')
+    request = dict(main_parameters._asdict(), start='2000-01-01', end='2000-01-10')
+
+    status, response = post(server.server_address, 'dxt-gridded', dict(request, output_file='tas.nc'))
+    assert status == 200
+    assert response['output_file'] == str(tmpdir.join('outputs', 'tas.nc'))
+    assert tmpdir.join('outputs', 'tas.nc').check()
+
+    outside = [('../tas.nc', 'tas'), (str(tmpdir.join('tas.nc')), 'tas'), (['tas.nc', '/tmp/sea.nc'], ['tas', 'sea'])]
+    for output_file, region in outside:
+        status, response = post(server.server_address, 'dxt-gridded',
+                                dict(request, output_file=output_file, region=region))
+        assert status == 400
+        assert 'not within the output directory' in response['error']
+    assert not tmpdir.join('tas.nc').check()
@@ -0,0 +1,85 @@
+import numpy as np
+
+from sdm.stats import GridpointStatistics
+
+
+def get_values(n_dates=200, n_points=30, seed=0):
+    random = np.random.RandomState(seed)
+    values = random.gamma(2.0, 5.0, (n_dates, n_points))
+    values[random.rand(n_dates, n_points) < 0.2] = np.NaN
+    values[:, 0] = np.NaN  # a grid point of missing values only
+    values[:5, 1] = np.NaN
+    values[5:, 1] = 7.0
+    return values
+
+
+def accumulate(values, bins, block_sizes=(31, 1, 60, 28), **kwargs):
+    statistics = GridpointStatistics(values.shape[1], bins, **kwargs)
+    start = 0
+    while start < values.shape[0]:
+        for block_size in block_sizes:
+            statistics.update(values[start:start + block_size])
+            start += block_size
+    return statistics
+
+
+def test_moments():
+    values = get_values()
+    statistics = accumulate(values, np.linspace(0.0, 100.0, 51), wet_day_threshold=10.0)
+    valid = ~np.isnan(values)
+
+    np.testing.assert_array_equal(statistics.count, valid.sum(axis=0))
+    np.testing.assert_allclose(statistics.mean[1:], np.nanmean(values[:, 1:], axis=0), rtol=1e-12)
+    np.testing.assert_allclose(statistics.get_variance()[1:], np.nanvar(values[:, 1:], axis=0, ddof=1),
+                               rtol=1e-10, atol=1e-12)
+    np.testing.assert_array_equal(statistics.minimum[1:], np.nanmin(values[:, 1:], axis=0))
+    np.testing.assert_array_equal(statistics.maximum[1:], np.nanmax(values[:, 1:], axis=0))
+    np.testing.assert_array_equal(statistics.wet_days, (valid & (np.nan_to_num(values) >= 10.0)).sum(axis=0))
+
+    # No values at all
+    assert statistics.count[0] == 0
+    assert np.isnan(statistics.get_variance()[0])
+    assert np.all(statistics.histogram[:, 0] == 0)
+
+
+def test_histogram_outside_bins():
+    values = get_values()
+    bins = np.linspace(5.0, 20.0, 16)
+    statistics = accumulate(values, bins)
+
+    for j in xrange(1, values.shape[1]):
+        # Values outside of the bins are counted in the end bins
+        column = np.clip(values[:, j][~np.isnan(values[:, j])], bins[0], bins[-1])
+        np.testing.assert_array_equal(statistics.histogram[:, j], np.histogram(column, bins)[0])
+
+    quantiles = statistics.get_quantiles([0.0, 0.01, 0.5, 0.99, 1.0])
+    assert np.all(np.isnan(quantiles[:, 0]))
+    assert np.all(quantiles[:, 1:] >= statistics.minimum[1:])
+    assert np.all(quantiles[:, 1:] <= statistics.maximum[1:])
+
+
+def test_quantiles():
+    values = get_values(n_dates=2000)
+    bins = np.linspace(0.0, 200.0, 201)
+    statistics = accumulate(values, bins)
+    probabilities = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+    quantiles = statistics.get_quantiles(probabilities)
+    for j in xrange(1, values.shape[1]):
+        expected = np.nanpercentile(values[:, j], [100 * p for p in probabilities])
+        # Accurate to the bin width
+        np.testing.assert_allclose(quantiles[:, j], expected, atol=bins[1] - bins[0])
+
+    # A constant grid point
+    np.testing.assert_array_equal(quantiles[:, 1], 7.0)
+
+
+def test_valid_min():
+    values = get_values()
+    statistics = accumulate(values, np.linspace(0.0, 100.0, 51), valid_min=5.0)
+    with np.errstate(invalid='ignore'):
+        values[values < 5.0] = np.NaN
+
+    np.testing.assert_array_equal(statistics.count, (~np.isnan(values)).sum(axis=0))
+    np.testing.assert_allclose(statistics.mean[1:], np.nanmean(values[:, 1:], axis=0), rtol=1e-12)
+    assert statistics.histogram.sum() == statistics.count.sum()
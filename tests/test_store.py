@@ -0,0 +1,67 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from sdm.extractor import GriddedExtractor
+from sdm.gridded import AwapDailyDataReader
+from sdm.store import PackedAwapStore, TimeMajorAwapStore
+
+from conftest import MONTHS, N_DAYS, REGIONS, get_expected_values, get_main_parameters, to_cod_date
+
+
+def get_all_dates():
+    return np.array([to_cod_date(datetime.date(year, month, day))
+                     for year, month in MONTHS for day in xrange(1, N_DAYS + 1)])
+
+
+def pack(synthetic_data, store_class, packed_dir, **kwargs):
+    awap_reader = AwapDailyDataReader(base_dir=synthetic_data.awap_dir)
+    _, file_code = AwapDailyDataReader.get_codes(synthetic_data.predictand)
+    store_class(packed_dir, file_code).pack(awap_reader, synthetic_data.predictand, **kwargs)
+    return AwapDailyDataReader(base_dir=synthetic_data.awap_dir, packed_base_dir=packed_dir)
+
+
+def test_packed_store(synthetic_data, tmpdir, monkeypatch):
+    awap_reader = pack(synthetic_data, PackedAwapStore, str(tmpdir.join('packed')))
+    store = awap_reader.get_packed_store(synthetic_data.predictand)
+    np.testing.assert_array_equal(store.dates, get_all_dates())
+
+    bounds = REGIONS['tas']
+    idx_lat, idx_lon = np.meshgrid(np.arange(*bounds[:2]), np.arange(*bounds[2:]), indexing='ij')
+    dates = store.dates[[7, 0, 11, 7]]
+    np.testing.assert_array_equal(store.read(dates, bounds).reshape(dates.size, -1),
+                                  get_expected_values(dates, idx_lat.ravel(), idx_lon.ravel()))
+    np.testing.assert_array_equal(store.read_day(dates[0], bounds), store.read(dates[:1], bounds)[0])
+    with pytest.raises(ValueError):
+        store.read(np.array([to_cod_date(datetime.date(1980, 5, 1))]))
+
+    # Extractions read the store instead of the monthly files
+    gridded_extractor = GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir)
+    packed_extractor = GriddedExtractor(synthetic_data.cod_dir, synthetic_data.mask_dir, synthetic_data.awap_dir,
+                                        packed_base_dir=str(tmpdir.join('packed')))
+    monkeypatch.setattr(packed_extractor.awap_reader, 'read_one_file', None)
+    main_parameters = get_main_parameters('sea')
+    np.testing.assert_array_equal(packed_extractor.extract(main_parameters, cube=False).data,
+                                  gridded_extractor.extract(main_parameters, cube=False).data)
+
+
+@pytest.mark.parametrize('max_memory', [1, 1024 ** 3])
+def test_time_major_store(synthetic_data, tmpdir, monkeypatch, max_memory):
+    # One month or all months are buffered at a time
+    awap_reader = pack(synthetic_data, TimeMajorAwapStore, str(tmpdir.join('packed')), max_memory=max_memory)
+    store = awap_reader.get_time_major_store(synthetic_data.predictand)
+    np.testing.assert_array_equal(store.dates, get_all_dates())
+
+    points = [(20, 600), (21, 601), (25, 610), (200, 300), (0, 0)]
+    for idx_lat, idx_lon in points:
+        np.testing.assert_array_equal(store.read_point(idx_lat, idx_lon),
+                                      get_expected_values(store.dates, [idx_lat], [idx_lon])[:, 0])
+
+    # Point reads use the store and give the same time series as the monthly files
+    monthly_reader = AwapDailyDataReader(base_dir=synthetic_data.awap_dir)
+    monkeypatch.setattr(awap_reader, 'read_one_file_points', None)
+    adates_list = [store.dates[[3, 0, 3]], store.dates[::2], store.dates[-1:], store.dates, store.dates[[5]]]
+    for series, expected in zip(awap_reader.read_points(synthetic_data.predictand, adates_list, points),
+                                monthly_reader.read_points(synthetic_data.predictand, adates_list, points)):
+        np.testing.assert_array_equal(series, expected)